@@ -0,0 +1,199 @@
+"""
+Throughput and latency of the WSGI and ASGI serving paths at fixed concurrency
+
+Usage:
+    python -m benchmarks.asgi_vs_wsgi --requests 2000 --concurrency 32
+    python -m benchmarks.asgi_vs_wsgi --wsgi-url http://127.0.0.1:8000 \\
+        --asgi-url http://127.0.0.1:8001 --concurrency 64
+
+By default both Django handlers are driven in-process: WSGI from a pool of
+`concurrency` threads (one request per thread, as a threaded WSGI server
+would), ASGI from `concurrency` tasks on one event loop (as a single
+uvicorn worker would). With --wsgi-url/--asgi-url the same mix is sent over
+HTTP to servers started separately, e.g.
+
+    gunicorn tc.wsgi -w 1 --threads 32 -b 127.0.0.1:8000
+    uvicorn tc.asgi:application --workers 1 --port 8001
+
+The request mix alternates a GraphQL lookup query, a single tax quote and
+the calculator page.
+"""
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from benchmarks import setup_django
+
+LOOKUP_QUERY = '{ provinces { id name } regTypes { id name } categories { id name hasCcRange } }'
+QUOTE_QUERY = ('{ taxQuotes(inputs: [{province: 1, regType: 1, category: 14, ccPower: "130", '
+               'lastPaidDate: "2079-05-01", nextPaymentDate: "2082-06-01"}]) { ok grandTotal } }')
+
+REQUEST_MIX = [
+    ('POST', '/graphql/', json.dumps({'query': LOOKUP_QUERY}).encode()),
+    ('POST', '/graphql/', json.dumps({'query': QUOTE_QUERY}).encode()),
+    ('GET', '/', b''),
+]
+
+
+def wsgi_call(application, method, path, body):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    chunks = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_call(application, method, path, body):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'accept', b'application/json'),
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 50000),
+    }
+    sent = False
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Block like a real server would until the client disconnects
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def http_call(base_url, method, path, body):
+    parts = urlsplit(base_url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    try:
+        connection.request(method, path, body=body or None,
+                           headers={'Content-Type': 'application/json', 'Accept': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def run_threads(call, total, concurrency):
+    """Issue total requests from a pool of concurrency threads"""
+    def one(number):
+        method, path, body = REQUEST_MIX[number % len(REQUEST_MIX)]
+        started = time.perf_counter()
+        status = call(method, path, body)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    return time.perf_counter() - started, results
+
+
+def run_tasks(application, total, concurrency):
+    """Issue total requests from concurrency tasks on one event loop"""
+    async def main():
+        counter = iter(range(total))
+        results = []
+
+        async def worker():
+            for number in counter:
+                method, path, body = REQUEST_MIX[number % len(REQUEST_MIX)]
+                started = time.perf_counter()
+                status = await asgi_call(application, method, path, body)
+                results.append((time.perf_counter() - started, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started, results
+
+    return asyncio.run(main())
+
+
+def report(name, elapsed, results):
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status >= 400)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<6} {len(results) / elapsed:>9,.0f} req/s   p50 {p50 * 1000:>7.1f} ms   "
+          f"p99 {p99 * 1000:>7.1f} ms   errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--wsgi-url', help="Benchmark a running WSGI server instead of in-process")
+    parser.add_argument('--asgi-url', help="Benchmark a running ASGI server instead of in-process")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}")
+    if args.wsgi_url or args.asgi_url:
+        for name, url in (('wsgi', args.wsgi_url), ('asgi', args.asgi_url)):
+            if url:
+                report(name, *run_threads(lambda *request: http_call(url, *request),
+                                          args.requests, args.concurrency))
+        return
+
+    setup_django()
+    from django.core.asgi import get_asgi_application
+    from django.core.wsgi import get_wsgi_application
+
+    wsgi_application = get_wsgi_application()
+    asgi_application = get_asgi_application()
+
+    # Warm up both paths (rate book, schema validation, template loading)
+    run_threads(lambda *request: wsgi_call(wsgi_application, *request), len(REQUEST_MIX), 1)
+    run_tasks(asgi_application, len(REQUEST_MIX), 1)
+
+    report('wsgi', *run_threads(lambda *request: wsgi_call(wsgi_application, *request),
+                                args.requests, args.concurrency))
+    report('asgi', *run_tasks(asgi_application, args.requests, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
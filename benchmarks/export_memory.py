@@ -0,0 +1,93 @@
+"""
+Peak memory of exporting quote results, buffered vs streamed
+
+Usage:
+    python -m benchmarks.export_memory --rows 1000 10000 50000 --format csv
+
+For each row count, quotes random vehicles and writes them to /dev/null two
+ways: the old approach (collect every result, then build one string with
+json.dumps / StringIO) and the streaming writers in calc.exporters fed by
+calc.quoting.iter_quotes. Peak traced memory should grow with the row count
+for the first and stay flat for the second.
+"""
+import argparse
+import io
+import json
+import os
+import time
+import tracemalloc
+
+from benchmarks import setup_django
+from benchmarks.quote_throughput import build_requests
+
+
+def request_rows(requests):
+    for number, request in enumerate(requests):
+        row = request._asdict()
+        row['vehicle_id'] = f"V-{number}"
+        yield row
+
+
+def buffered_export(rows, format_type, book):
+    from calc.exporters import CSV_COLUMNS, csv_record, txt_record
+    from calc.quoting import iter_quotes
+
+    results = list(iter_quotes(rows, book))
+    if format_type == 'json':
+        text = json.dumps(results, indent=2, default=str, ensure_ascii=False)
+    elif format_type == 'ndjson':
+        text = "".join(json.dumps(result, default=str, ensure_ascii=False) + "\n" for result in results)
+    elif format_type == 'csv':
+        import csv
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(csv_record(result) for result in results)
+        text = output.getvalue()
+    else:
+        text = "".join("".join(txt_record(result)) for result in results)
+    with open(os.devnull, 'w', encoding='utf-8') as sink:
+        sink.write(text)
+
+
+def streamed_export(rows, format_type, book):
+    from calc.exporters import write_export
+    from calc.quoting import iter_quotes
+
+    with open(os.devnull, 'w', encoding='utf-8') as sink:
+        write_export(iter_quotes(rows, book), sink, format_type)
+
+
+def measure(export, requests, format_type, book):
+    tracemalloc.start()
+    started = time.perf_counter()
+    export(request_rows(requests), format_type, book)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--format', choices=('txt', 'csv', 'json', 'ndjson'), default='json')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from calc.ratebook import get_rate_book
+
+    book = get_rate_book()
+    print(f"format={args.format}")
+    print(f"{'rows':>8}  {'buffered peak':>14}  {'streamed peak':>14}  {'buffered s':>10}  {'streamed s':>10}")
+    for count in args.rows:
+        requests = build_requests(book, count, args.seed)
+        buffered_peak, buffered_time = measure(buffered_export, requests, args.format, book)
+        streamed_peak, streamed_time = measure(streamed_export, requests, args.format, book)
+        print(f"{count:>8}  {buffered_peak / 2**20:>11.1f} MB  {streamed_peak / 2**20:>11.1f} MB  "
+              f"{buffered_time:>10.2f}  {streamed_time:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
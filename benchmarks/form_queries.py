@@ -0,0 +1,96 @@
+"""
+SQL queries and time spent by one full calculator form submission
+
+Usage:
+    python -m benchmarks.form_queries [--submissions 200] [--seed 1]
+
+Builds submissions from calc.synthetic.iter_vehicles and runs each one the
+way a view would: validate the form, build the calculation summary, then
+price it with TaxCalculator, all sharing the form's LookupContext. Reports
+SQL queries and median milliseconds per step once the rate book is warm
+(the first submission per category also builds that category's range
+index). The query counts should stay the same however large the rate
+tables are.
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks import setup_django
+
+STEPS = ('is_valid', 'summary', 'calculate')
+
+
+def submit(data, province):
+    """Run one submission, returning (queries, seconds) per step or None if the form is invalid"""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from calc.arrears import QuoteError
+    from calc.calculator import TaxCalculator
+    from calc.forms import TaxCalculatorForm
+
+    def calculate():
+        try:
+            return TaxCalculator(form, province=province).calculate()
+        except QuoteError as e:
+            return e
+
+    form = TaxCalculatorForm(data)
+    calls = {
+        'is_valid': form.is_valid,
+        'summary': form.get_calculation_summary,
+        'calculate': calculate,
+    }
+    results = {}
+    for step in STEPS:
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            value = calls[step]()
+            elapsed = time.perf_counter() - started
+        if step == 'is_valid' and not value:
+            return None
+        results[step] = (len(captured.captured_queries), elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from calc.ratebook import get_rate_book
+    from calc.synthetic import iter_vehicles
+
+    book = get_rate_book()
+    queries = {step: 0 for step in STEPS}
+    timings = {step: [] for step in STEPS + ('submit',)}
+    submitted = invalid = 0
+    for row in iter_vehicles(book, args.submissions, args.seed):
+        data = {key: row[key] for key in ('reg_type', 'category', 'cc_power',
+                                          'last_paid_date', 'next_payment_date')}
+        results = submit(data, book.provinces[int(row['province'])])
+        if results is None:
+            invalid += 1
+            continue
+        submitted += 1
+        for step, (count, seconds) in results.items():
+            queries[step] += count
+            timings[step].append(seconds)
+        timings['submit'].append(sum(seconds for _, seconds in results.values()))
+
+    if not submitted:
+        print(f"No valid submissions among {invalid} generated")
+        return
+    queries['submit'] = sum(queries.values())
+    print(f"{'step':<10} {'sql':>6} {'median ms':>10}")
+    for step in STEPS + ('submit',):
+        print(f"{step:<10} {queries[step] / submitted:>6.1f} "
+              f"{statistics.median(timings[step]) * 1000:>10.3f}")
+    print(f"{submitted} submissions, {invalid} rejected by validation")
+
+
+if __name__ == '__main__':
+    main()
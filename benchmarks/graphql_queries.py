@@ -0,0 +1,101 @@
+"""
+SQL query counts and timings for the frontend's GraphQL queries
+
+Usage:
+    python -m benchmarks.graphql_queries [--repeat 50]
+
+Runs every query in useri/queries.js (plus a few nested variants that
+exercise the loaders) through /graphql/ and reports rows returned, SQL
+queries issued and mean latency. Query counts should not change with the
+number of rows in the database. Finishes with the parse/validate time the
+document cache saved per request.
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+from benchmarks import setup_django
+
+QUERIES_JS = Path(__file__).resolve().parent.parent / 'useri' / 'queries.js'
+
+NESTED_QUERIES = {
+    'regTypesWithCategories': '{ regTypes { id name categories { id name nameEn } } }',
+    'ccRangesWithRelations': ('query ccRangesWithRelations($province: ID!, $fiscalYear: ID!, '
+                              '$reg_type: ID!, $category: ID!) { ccRanges(province: $province, '
+                              'fiscalYear: $fiscalYear, regType: $reg_type, category: $category) '
+                              '{ id name province { name } category { name hasCcRange } '
+                              'fiscalYear { name } regType { name } } }'),
+}
+
+
+def frontend_queries():
+    """Operation name -> query text for each gql`...` block in queries.js"""
+    queries = {}
+    for text in re.findall(r'gql`(.*?)`', QUERIES_JS.read_text(encoding='utf-8'), re.DOTALL):
+        name = re.search(r'query\s+(\w+)', text)
+        queries[name.group(1) if name else f"query{len(queries)}"] = text
+    return queries
+
+
+def count_rows(data):
+    if isinstance(data, list):
+        return len(data) + sum(count_rows(item) for item in data)
+    if isinstance(data, dict):
+        return sum(count_rows(value) for value in data.values())
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    from calc.documents import get_document_cache
+    from calc.models import CCRange
+    from calc.ratebook import get_rate_book
+
+    get_rate_book()
+    sample = CCRange.objects.values('province_id', 'fiscal_year_id', 'reg_type_id', 'category_id').first() or {}
+    variables = {
+        'province': sample.get('province_id', 1),
+        'fiscalYear': sample.get('fiscal_year_id', 1),
+        'reg_type': sample.get('reg_type_id', 1),
+        'category': sample.get('category_id', 1),
+    }
+
+    client = Client(HTTP_HOST='localhost')
+    print(f"{'query':<26} {'rows':>6} {'sql':>5} {'mean ms':>9}")
+    for name, query in {**frontend_queries(), **NESTED_QUERIES}.items():
+        body = json.dumps({'query': query, 'variables': variables})
+        with CaptureQueriesContext(connection) as captured:
+            response = client.post('/graphql/', body, content_type='application/json')
+        # captured_queries reads the live query log, which the next request resets
+        sql_count = len(captured.captured_queries)
+        result = response.json()
+        if result.get('errors'):
+            print(f"{name:<26} error: {result['errors'][0]['message']}")
+            continue
+
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            client.post('/graphql/', body, content_type='application/json')
+        elapsed = (time.perf_counter() - started) / args.repeat
+
+        print(f"{name:<26} {count_rows(result['data']):>6} {sql_count:>5} "
+              f"{elapsed * 1000:>9.2f}")
+
+    stats = get_document_cache().stats()
+    print(f"document cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"parse {stats['mean_parse_ms']:.3f} ms + validate {stats['mean_validate_ms']:.3f} ms "
+          f"saved per hit")
+
+
+if __name__ == '__main__':
+    main()
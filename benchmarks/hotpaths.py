@@ -0,0 +1,209 @@
+"""
+Microbenchmarks of the calculator's hot paths on small, medium and large rate tables
+
+Usage:
+    python -m benchmarks.hotpaths [--profiles small medium large] [--output FILE]
+                                  [--baseline FILE] [--save-baseline] [--threshold 0.25]
+
+For each profile in calc.synthetic.PROFILES a throwaway test database is
+filled with generated rate tables and every path is timed in isolation
+with rotating, seeded inputs. Results are written as JSON (microseconds per
+call, median and best of several rounds) and compared with the baseline
+file: a median slower than the baseline by more than --threshold is
+reported as a regression and makes the exit status 1.
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from benchmarks import setup_django
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_OUTPUT = BASE_DIR / 'results' / 'hotpaths.json'
+DEFAULT_BASELINE = BASE_DIR / 'baselines' / 'hotpaths.json'
+INPUTS = 256
+
+
+def measure(fn, inputs, rounds: int = 7, min_round_seconds: float = 0.05):
+    """
+    Per-call timings of fn over a list of argument tuples
+
+    The number of calls per round grows until a round takes at least
+    min_round_seconds, as timeit.autorange does.
+
+    Returns:
+        Dict with median_us, best_us and calls per round
+    """
+    def run(calls):
+        started = time.perf_counter()
+        for i in range(calls):
+            fn(*inputs[i % len(inputs)])
+        return time.perf_counter() - started
+
+    calls = len(inputs)
+    while run(calls) < min_round_seconds:
+        calls *= 2
+    per_call = [run(calls) / calls * 1e6 for _ in range(rounds)]
+    return {
+        'median_us': round(statistics.median(per_call), 3),
+        'best_us': round(min(per_call), 3),
+        'calls': calls,
+    }
+
+
+def build_cases(seed: int):
+    """Path name -> (function, list of argument tuples)"""
+    from calc.forms import TaxCalculatorForm
+    from calc.helper import (calculate_penalty, find_cc_range_for_power, generate_calculation_summary,
+                             get_applicable_income_tax_rate, get_applicable_tax_rate,
+                             get_fiscal_years_in_range, parse_nepali_date, validate_nepali_date)
+    from calc.models import Category, Province, RegType
+    from calc.quoting import parse_quote_request, quote_batch
+    from calc.ratebook import get_rate_book
+    from calc.synthetic import iter_vehicles
+
+    rng = random.Random(seed)
+    book = get_rate_book()
+    vehicles = list(iter_vehicles(book, INPUTS, seed))
+    date_pairs = [(v['last_paid_date'], v['next_payment_date']) for v in vehicles]
+
+    ranges = rng.sample(sorted(book.cc_ranges.values(), key=lambda r: r.id), min(INPUTS, len(book.cc_ranges)))
+    categories = {c.id: c for c in Category.objects.all()}
+    reg_types = {r.id: r for r in RegType.objects.all()}
+    provinces = {p.id: p for p in Province.objects.all()}
+    # A power inside each range; open-ended ranges (to_cc 0) get one above from_cc
+    lookups = [(r, r.from_cc + (r.to_cc - r.from_cc if r.to_cc else 100) * Decimal(rng.randint(5, 95)) / 100)
+               for r in ranges]
+
+    summaries = [result for result in quote_batch([parse_quote_request(v) for v in vehicles], book,
+                                                  use_cache=False)
+                 if not isinstance(result, Exception)]
+    form_data = [{key: v[key] for key in ('reg_type', 'category', 'cc_power', 'last_paid_date',
+                                           'next_payment_date')} for v in vehicles]
+
+    def validate_form(data):
+        return TaxCalculatorForm(data).is_valid()
+
+    return {
+        'validate_nepali_date': (validate_nepali_date, [(start,) for start, _ in date_pairs]),
+        'parse_nepali_date': (parse_nepali_date, [(start,) for start, _ in date_pairs]),
+        'get_fiscal_years_in_range': (get_fiscal_years_in_range, [
+            (parse_nepali_date(start), parse_nepali_date(end)) for start, end in date_pairs]),
+        'find_cc_range_for_power': (find_cc_range_for_power, [
+            (categories[r.category_id], power, provinces[r.province_id], r.fiscal_year_id,
+             reg_types[r.reg_type_id]) for r, power in lookups]),
+        'get_applicable_tax_rate': (get_applicable_tax_rate, [
+            (r.reg_type_id, r.category_id, r, r.fiscal_year_id, r.province_id) for r in ranges]),
+        'get_applicable_income_tax_rate': (get_applicable_income_tax_rate, [
+            (r.category_id, r, r.fiscal_year_id) for r in ranges]),
+        'calculate_penalty': (calculate_penalty, [
+            (Decimal(rng.randrange(1000, 50000)), Decimal(rng.randrange(0, 5000)), rng.randint(0, 2000))
+            for _ in range(INPUTS)]),
+        'TaxCalculatorForm.is_valid': (validate_form, [(data,) for data in form_data]),
+        'generate_calculation_summary': (generate_calculation_summary, [(s,) for s in summaries]),
+    }
+
+
+def run_profile(name: str, seed: int):
+    from django.db import connection
+
+    from calc import ratebook
+    from calc.synthetic import PROFILES, generate
+
+    scale = PROFILES[name]
+    # A fresh file per profile; an in-memory test database can outlive destroy_test_db
+    workdir = tempfile.TemporaryDirectory()
+    connection.settings_dict.setdefault('TEST', {})['NAME'] = str(Path(workdir.name) / f"{name}.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        started = time.perf_counter()
+        counts = generate(scale, seed=seed)
+        loaded = time.perf_counter() - started
+        started = time.perf_counter()
+        ratebook.rebuild()
+        print(f"\n{name}: {counts['CCRange']} CC ranges, {counts['TaxRate']} tax rates, "
+              f"{counts['IncomeTaxRate']} income tax rates "
+              f"(loaded in {loaded:.1f}s, rate book built in {time.perf_counter() - started:.2f}s)")
+
+        results = {}
+        for path, (fn, inputs) in build_cases(seed).items():
+            results[path] = measure(fn, inputs)
+            print(f"  {path:<32} {results[path]['median_us']:>10.2f} us")
+        return {'scale': scale._asdict(), 'rows': counts, 'paths': results}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        workdir.cleanup()
+
+
+def compare(results, baseline, threshold: float) -> int:
+    """Print the change against the baseline; return the number of regressions"""
+    regressions = 0
+    print(f"\n{'profile':<8} {'path':<32} {'baseline us':>12} {'now us':>10} {'change':>8}")
+    for profile, data in results['profiles'].items():
+        base_paths = baseline.get('profiles', {}).get(profile, {}).get('paths', {})
+        for path, timing in data['paths'].items():
+            base = base_paths.get(path)
+            if base is None:
+                continue
+            change = timing['median_us'] / base['median_us'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"{profile:<8} {path:<32} {base['median_us']:>12.2f} {timing['median_us']:>10.2f} "
+                  f"{change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    setup_django()
+    import django
+
+    from calc.synthetic import PROFILES
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Also write the results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    results = {
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': f"{platform.system()} {platform.machine()}",
+        'seed': args.seed,
+        'profiles': {name: run_profile(name, args.seed) for name in args.profiles},
+    }
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2) + '\n', encoding='utf-8')
+    print(f"\nresults written to {args.output}")
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2) + '\n', encoding='utf-8')
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    regressions = compare(results, json.loads(args.baseline.read_text(encoding='utf-8')), args.threshold)
+    if regressions:
+        print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Rate lookups with and without the composite lookup indexes
+
+Usage:
+    python -m benchmarks.indexes [--profile medium --lookups 300]
+
+Creates a throwaway test database migrated to just before the lookup
+indexes, fills it with a calc.synthetic dataset, times the calculator's
+lookups (before), applies the index migration and times them again
+(after). Statements are compiled up front so the timings are the
+database's; the query plans of both runs are printed last.
+"""
+import argparse
+import random
+import time
+
+from benchmarks import setup_django
+
+BEFORE = '0021_ccrange_reg_type'
+AFTER = '0022_lookup_indexes'
+
+
+def lookups():
+    """Name -> queryset factory for each hot lookup, fed one CCRange"""
+    from calc.models import CCRange, IncomeTaxRate, TaxRate
+
+    return {
+        'TaxRate by tuple': lambda r: TaxRate.objects.filter(
+            province_id=r.province_id, fiscal_year_id=r.fiscal_year_id, reg_type_id=r.reg_type_id,
+            category_id=r.category_id, cc_range_id=r.id,
+        ).values_list('private_tax', 'public_tax', 'private_renewal', 'public_renewal'),
+        'IncomeTaxRate by tuple': lambda r: IncomeTaxRate.objects.filter(
+            category_id=r.category_id, fiscal_year_id=r.fiscal_year_id, cc_range_id=r.id, reg_type_id=r.reg_type_id,
+        ).values_list('income_tax'),
+        'CCRange candidates': lambda r: CCRange.objects.filter(
+            category_id=r.category_id, province_id=r.province_id, fiscal_year_id=r.fiscal_year_id,
+            reg_type_id=r.reg_type_id,
+        ).values_list('id', 'from_cc', 'to_cc'),
+        'CCRange for power': lambda r: CCRange.objects.filter(
+            category_id=r.category_id, province_id=r.province_id, fiscal_year_id=r.fiscal_year_id,
+            reg_type_id=r.reg_type_id, from_cc__lte=r.from_cc + 50, to_cc__gte=r.from_cc + 50,
+        ).values_list('id'),
+        'Categories for reg type': lambda r: TaxRate.objects.filter(
+            reg_type_id=r.reg_type_id,
+        ).values_list('category_id').distinct(),
+    }
+
+
+def time_lookups(sample):
+    """Name -> (mean seconds per lookup, query plan)"""
+    from django.db import connection
+
+    results = {}
+    with connection.cursor() as cursor:
+        for name, make in lookups().items():
+            statements = [make(cc_range).query.sql_with_params() for cc_range in sample]
+            started = time.perf_counter()
+            for sql, params in statements:
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            results[name] = ((time.perf_counter() - started) / len(statements), make(sample[0]).explain())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', choices=('small', 'medium', 'large'), default='medium')
+    parser.add_argument('--lookups', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+    from django.db import connection
+
+    from calc.models import CCRange
+    from calc.synthetic import PROFILES, generate
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        call_command('migrate', 'calc', BEFORE, verbosity=0)
+
+        started = time.perf_counter()
+        counts = generate(PROFILES[args.profile], seed=args.seed)
+        print(f"{counts['CCRange']} CC ranges, {counts['TaxRate']} tax rates, "
+              f"{counts['IncomeTaxRate']} income tax rates ({time.perf_counter() - started:.1f}s to load)")
+
+        range_ids = list(CCRange.objects.order_by('id').values_list('id', flat=True))
+        sampled = random.Random(args.seed).sample(range_ids, min(args.lookups, len(range_ids)))
+        sample = list(CCRange.objects.in_bulk(sampled).values())
+        before = time_lookups(sample)
+
+        started = time.perf_counter()
+        call_command('migrate', 'calc', AFTER, verbosity=0)
+        print(f"{AFTER} applied in {time.perf_counter() - started:.1f}s")
+        after = time_lookups(sample)
+
+        print(f"\n{'lookup':<24} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name in before:
+            print(f"{name:<24} {before[name][0] * 1000:>10.3f} {after[name][0] * 1000:>10.3f} "
+                  f"{before[name][0] / after[name][0]:>7.1f}x")
+
+        for name in before:
+            print(f"\n{name}\n  before: {before[name][1]}\n  after:  {after[name][1]}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Quote throughput of the batched quoting engine
+
+Usage:
+    python -m benchmarks.quote_throughput --quotes 100000 --batch 5000
+
+Builds requests with calc.synthetic.iter_vehicles, so every one can be
+priced against the configured rate data, and reports quotes per
+second for calc.quoting.quote_batch, i.e. what one taxQuotes call achieves
+once the rate book is warm.
+"""
+import argparse
+import time
+
+from benchmarks import setup_django
+
+
+def build_requests(book, count, seed):
+    from calc.quoting import parse_quote_request
+    from calc.synthetic import iter_vehicles
+
+    return [parse_quote_request(row) for row in iter_vehicles(book, count, seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quotes', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-cache', action='store_true', help="Bypass the quote cache")
+    args = parser.parse_args()
+
+    setup_django()
+    from calc.quote_cache import get_quote_cache
+    from calc.quoting import QuoteError, quote_batch
+    from calc.ratebook import get_rate_book
+
+    book = get_rate_book()
+    requests = build_requests(book, args.quotes, args.seed)
+
+    errors = 0
+    started = time.perf_counter()
+    for offset in range(0, len(requests), args.batch):
+        results = quote_batch(requests[offset:offset + args.batch], book,
+                              use_cache=not args.no_cache)
+        errors += sum(isinstance(result, QuoteError) for result in results)
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(requests)} quotes in {elapsed:.3f}s "
+          f"({len(requests) / elapsed:,.0f} quotes/s, batch={args.batch}, errors={errors})")
+    if not args.no_cache:
+        print(f"quote cache: {get_quote_cache().stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Rate cube vs rate book: load time, memory and batch lookups
+
+Usage:
+    python -m benchmarks.ratecube --lookups 100000
+
+Builds the cube from the current rate tables, writes it to a temporary
+file and maps it back, then resolves the CC ranges, tax rate and income tax
+rate of random vehicles two ways: one rate book call per vehicle, and one
+vectorized call per step on the cube. Every answer is compared, so a
+mismatch fails the run.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import setup_django
+from benchmarks.quote_throughput import build_requests
+
+
+def traced(function):
+    """Result of a call, its duration and the memory it left allocated"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from calc.penalties import to_paisa
+    from calc.ratebook import RateBook
+    from calc.ratecube import RATE_COLUMNS, RateCube
+
+    book, book_seconds, book_bytes = traced(RateBook.load)
+    print(f"rate book: loaded in {book_seconds:.3f}s, {book_bytes / 2 ** 20:.1f} MiB")
+
+    started = time.perf_counter()
+    built = RateCube.build(book)
+    print(f"rate cube: built in {time.perf_counter() - started:.3f}s, "
+          f"{built.nbytes / 2 ** 20:.1f} MiB of arrays")
+    with tempfile.TemporaryDirectory() as directory:
+        path = built.write(os.path.join(directory, 'ratecube.bin'))
+        cube, open_seconds, open_bytes = traced(lambda: RateCube.open(path))
+        print(f"rate cube: mapped in {open_seconds * 1000:.2f}ms, {open_bytes / 1024:.1f} KiB on the heap, "
+              f"{os.path.getsize(path) / 2 ** 20:.1f} MiB file")
+
+        # The fiscal year each vehicle last paid in, as the arrears engine looks it up
+        requests = build_requests(book, args.lookups, args.seed)
+        fiscal_years = [book.fiscal_index.fiscal_years[number % len(book.fiscal_index.fiscal_years)].id
+                        for number in range(len(requests))]
+
+        started = time.perf_counter()
+        expected = []
+        for request, fiscal_year in zip(requests, fiscal_years):
+            cc_range = book.range_index(request.province, fiscal_year, request.reg_type,
+                                        request.category).resolve(request.cc_power).cc_range
+            income_range = book.range_index(request.province, fiscal_year, request.reg_type, request.category,
+                                            for_income_tax=True).resolve(request.cc_power).cc_range
+            rate = book.tax_rate(request.reg_type, request.category, cc_range, fiscal_year, request.province)
+            income = book.income_tax_rate(request.category, income_range, fiscal_year)
+            expected.append((cc_range.id if cc_range else -1,
+                             [to_paisa(getattr(rate, name)) for name in RATE_COLUMNS] if rate else None,
+                             to_paisa(income.income_tax) if income else None))
+        book_lookup = time.perf_counter() - started
+
+        started = time.perf_counter()
+        province = np.array([r.province for r in requests], dtype=np.int64)
+        reg_type = np.array([r.reg_type for r in requests], dtype=np.int64)
+        category = np.array([r.category for r in requests], dtype=np.int64)
+        fiscal_year = np.array(fiscal_years, dtype=np.int64)
+        cc_power = np.array([np.nan if r.cc_power is None else float(r.cc_power) for r in requests])
+        positions, _statuses = cube.resolve(province, fiscal_year, reg_type, category, cc_power)
+        found, values = cube.tax_rates(province, fiscal_year, reg_type, category, positions)
+        income_positions, _statuses = cube.resolve(province, fiscal_year, reg_type, category, cc_power,
+                                                   for_income_tax=True)
+        income_found, income = cube.income_tax(fiscal_year, category, income_positions)
+        cube_lookup = time.perf_counter() - started
+
+        range_ids = np.where(positions >= 0, cube.range_id[np.maximum(positions, 0)], -1)
+        mismatches = sum(
+            (cc_range_id, rate, income_tax) != (int(range_ids[i]),
+                                                values[i].tolist() if found[i] else None,
+                                                int(income[i]) if income_found[i] else None)
+            for i, (cc_range_id, rate, income_tax) in enumerate(expected))
+        del cube
+
+    print(f"{len(requests)} lookups: rate book {book_lookup:.3f}s, rate cube {cube_lookup:.3f}s "
+          f"({book_lookup / cube_lookup:.1f}x), mismatches={mismatches}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,12 @@
 # vehicles/admin.py
-from django.contrib import admin
+from django.contrib import admin, messages
 from import_export import resources, fields
 from import_export.admin import ImportExportModelAdmin
 from import_export.widgets import ForeignKeyWidget
 
-from calc.models import FiscalYear, RegType, Category, CCRange, TaxRate, RegRule, Province
+from calc.integrity import analyze
+from calc.models import (FiscalYear, RegType, Category, CCRange, TaxRate, RegRule, Province,
+                         PenaltySchedule, PenaltyTier)
 
 # --- Resources ---
 
@@ -93,6 +95,15 @@ class ProvinceAdmin(ImportExportModelAdmin):
 class FiscalYearAdmin(ImportExportModelAdmin):
     resource_class = FiscalYearResource
     list_display = ('name', 'name_en', 'start_date', 'end_date', 'previous')
+    actions = ['check_rate_integrity']
+
+    @admin.action(description="Check rate data integrity")
+    def check_rate_integrity(self, request, queryset):
+        report = analyze(list(queryset.values_list('id', flat=True)), sample_size=5)
+        if report.ok:
+            self.message_user(request, f"Rate data is consistent ({report.elapsed:.2f}s)", messages.SUCCESS)
+        for finding in report.findings:
+            self.message_user(request, str(finding), messages.WARNING)
 
 
 # --- Inline for RegRule ---
@@ -142,3 +153,15 @@ class CCRangeAdmin(ImportExportModelAdmin):
 class TaxRateAdmin(ImportExportModelAdmin):
     resource_class = TaxRateResource
     list_display = ('province', 'fiscal_year', 'reg_type', 'category', 'cc_range', 'private_tax', 'public_tax', 'private_renewal', 'public_renewal')
+
+
+class PenaltyTierInline(admin.TabularInline):
+    model = PenaltyTier
+    extra = 1
+
+
+@admin.register(PenaltySchedule)
+class PenaltyScheduleAdmin(admin.ModelAdmin):
+    inlines = [PenaltyTierInline]
+    list_display = ('name', 'province', 'fiscal_year', 'minimum_penalty')
+    list_filter = ('province', 'fiscal_year')
@@ -0,0 +1,330 @@
+"""
+Arrears engine: what a vehicle owes from its last payment to the next one
+
+The unpaid span is split into one segment per fiscal year. Each segment
+gets the rates in effect for that year and a late payment penalty counted
+from the year's vehicle tax due date.
+"""
+from decimal import Decimal
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .helper import parse_nepali_ordinal
+from .intervals import RANGE_GAP
+from .penalties import PenaltyBand, apply_rates, from_paisa, to_paisa
+from .ratebook import RateBook, get_rate_book
+from .ratecube import RateCube, get_rate_cube
+from .timing import stage
+
+
+class QuoteRequest(NamedTuple):
+    province: int
+    reg_type: int
+    category: int
+    cc_power: Optional[Decimal]
+    last_paid_date: str
+    next_payment_date: str
+    is_public: bool = False
+
+
+class QuoteError(Exception):
+    """A single quote in a batch could not be computed"""
+
+
+class _Span(NamedTuple):
+    fiscal_year: Any
+    cc_range: Any
+    income_range: Any
+    days: int
+    penalty: Optional[PenaltyBand]
+
+
+class _Segment(NamedTuple):
+    fiscal_year: Any
+    cc_range: Any
+    tax: int
+    renewal: int
+    income_tax: int
+    penalty: Optional[PenaltyBand]
+    note: str
+
+
+def canonical_key(province, reg_type, category, is_public, segments) -> tuple:
+    """
+    Cache key of a quote: everything its amounts depend on and nothing else
+
+    cc_power is reduced to the tax and income tax CC ranges it falls in and
+    the dates to the owed fiscal years plus the penalty tier each falls in,
+    so e.g. 1499cc and 1500cc in the same ranges, or two payment dates in
+    the same penalty tier, share one entry. The penalty schedule itself follows from the
+    province and fiscal year.
+    """
+    return (province.id, reg_type.id, category.id, bool(is_public),
+            tuple((s.fiscal_year.id, s.cc_range.id if s.cc_range else None,
+                   s.income_range.id if s.income_range else None,
+                   s.penalty.tier if s.penalty else 0)
+                  for s in segments))
+
+
+class ArrearsEngine:
+    """
+    Multi-year arrears for vehicles against one rate book
+
+    A quote runs in three steps. ``plan`` splits the unpaid span into
+    fiscal-year segments. ``price_many`` resolves the rates of every
+    segment of many quotes in one pass, as array lookups on the rate cube
+    when one matches the book and over the book's in-memory indexes
+    otherwise. ``compute`` then does the money arithmetic for all of those
+    segments as one set of integer (paisa) array operations. No step
+    queries the database, so the cost grows with the number of segments.
+    """
+
+    def __init__(self, book: Optional[RateBook] = None):
+        self.book = book or get_rate_book()
+
+    def plan(self, request: QuoteRequest):
+        """
+        Split one request's unpaid span into owed fiscal-year segments
+
+        Each segment gets its CC range and the penalty band for how late it is
+        paid, counted from the fiscal year's vehicle_tax_due_date.
+
+        Returns:
+            (canonical key, (province, reg_type, category), list of spans)
+
+        Raises:
+            QuoteError: If the request cannot be quoted
+        """
+        book = self.book
+        province = book.provinces.get(int(request.province))
+        reg_type = book.reg_types.get(int(request.reg_type))
+        category = book.categories.get(int(request.category))
+        if province is None:
+            raise QuoteError(f"Unknown province {request.province}")
+        if reg_type is None:
+            raise QuoteError(f"Unknown registration type {request.reg_type}")
+        if category is None:
+            raise QuoteError(f"Unknown category {request.category}")
+
+        last_paid = parse_nepali_ordinal(request.last_paid_date)
+        next_payment = parse_nepali_ordinal(request.next_payment_date)
+        if last_paid is None:
+            raise QuoteError("Invalid last paid date")
+        if next_payment is None:
+            raise QuoteError("Invalid next payment date")
+        if next_payment <= last_paid:
+            raise QuoteError("Next payment date must be after last paid date")
+
+        cc_power = request.cc_power
+        if category.has_cc_range and (cc_power is None or cc_power <= 0):
+            raise QuoteError("CC/Power is required for this vehicle category")
+
+        with stage('fiscal_years'):
+            index = book.fiscal_index
+            if index.containing(next_payment) is None:
+                raise QuoteError("No fiscal year is configured for the next payment date")
+
+            # The fiscal year of the last payment is settled; dues start with the next one
+            paid_year = index.containing(last_paid)
+            spans = [span for span in index.overlapping(last_paid + 1, next_payment)
+                     if paid_year is None or span.fiscal_year.id != paid_year.id]
+
+        owed = []
+        with stage('range_lookup'):
+            for span in spans:
+                fiscal_year = span.fiscal_year
+                cc_range = income_range = None
+                if category.has_cc_range:
+                    hit = book.range_index(province, fiscal_year, reg_type, category).resolve(cc_power)
+                    if hit.status == RANGE_GAP:
+                        raise QuoteError(f"No CC range covers {cc_power} in {fiscal_year.name_en}")
+                    cc_range = hit.cc_range
+                    # Income tax ranges are a separate series; outside them the flat rate applies
+                    income_range = book.range_index(province, fiscal_year, reg_type, category,
+                                                    for_income_tax=True).resolve(cc_power).cc_range
+                schedule = book.penalty_schedule(province, fiscal_year)
+                owed.append(_Span(fiscal_year, cc_range, income_range, span.days,
+                                  schedule.band(next_payment - fiscal_year.vehicle_tax_due_date.toordinal())))
+
+        return canonical_key(province, reg_type, category, request.is_public, owed), \
+            (province, reg_type, category), owed
+
+    @staticmethod
+    def _segment(span: _Span, rule, tax: int, renewal: int, income_tax: int) -> _Segment:
+        """A priced segment, with the registration type's exemptions applied to paisa amounts"""
+        notes = []
+        if rule and rule.tax_exempted:
+            tax = 0
+            notes.append("Vehicle tax exempted")
+        if rule and rule.renewal_exempted:
+            renewal = 0
+            notes.append("Renewal fee exempted")
+        if rule and rule.income_tax_exempted:
+            income_tax = 0
+            notes.append("Income tax exempted")
+        return _Segment(span.fiscal_year, span.cc_range, tax, renewal, income_tax, span.penalty, "; ".join(notes))
+
+    def price(self, info, is_public: bool, spans: List[_Span]) -> List[_Segment]:
+        """Look up the rates and exemptions for the owed segments of one canonical quote"""
+        book = self.book
+        province, reg_type, category = info
+        segments = []
+        for span in spans:
+            fiscal_year, cc_range = span.fiscal_year, span.cc_range
+            rate = book.tax_rate(reg_type, category, cc_range, fiscal_year, province)
+            if rate is None:
+                raise QuoteError(f"No tax rate configured for {fiscal_year.name_en}")
+            income_rate = book.income_tax_rate(category, span.income_range, fiscal_year)
+            tax = rate.public_tax if is_public else rate.private_tax
+            renewal = rate.public_renewal if is_public else rate.private_renewal
+            income_tax = income_rate.income_tax if income_rate else Decimal('0')
+            segments.append(self._segment(span, book.reg_rule(province, fiscal_year, reg_type),
+                                          to_paisa(tax), to_paisa(renewal), to_paisa(income_tax)))
+        return segments
+
+    def _price_with_cube(self, cube: RateCube, groups: Mapping[tuple, tuple], priced: dict, failed: dict):
+        """Rates of every group at once, with one array lookup for all tax and income tax rates"""
+        flat = [(info, is_public, span) for info, is_public, spans in groups.values() for span in spans]
+        province = np.array([info[0].id for info, _, _ in flat], dtype=np.int64)
+        reg_type = np.array([info[1].id for info, _, _ in flat], dtype=np.int64)
+        category = np.array([info[2].id for info, _, _ in flat], dtype=np.int64)
+        fiscal_year = np.array([span.fiscal_year.id for _, _, span in flat], dtype=np.int64)
+        range_ids = np.array([span.cc_range.id if span.cc_range else -1 for _, _, span in flat], dtype=np.int64)
+        income_range_ids = np.array([span.income_range.id if span.income_range else -1 for _, _, span in flat],
+                                    dtype=np.int64)
+        is_public = np.array([public for _, public, _ in flat], dtype=np.bool_)
+
+        positions = cube.range_positions(range_ids)
+        found, values = cube.tax_rates(province, fiscal_year, reg_type, category, positions)
+        # A range the cube does not hold must not fall back to the flat (no range) rate
+        found &= (range_ids < 0) | (positions >= 0)
+        _, income_tax = cube.income_tax(fiscal_year, category, cube.range_positions(income_range_ids))
+        tax = np.where(is_public, values[:, 1], values[:, 0]).tolist()
+        renewal = np.where(is_public, values[:, 3], values[:, 2]).tolist()
+        income_tax = income_tax.tolist()
+        found = found.tolist()
+
+        book = self.book
+        start = 0
+        for key, (info, _, spans) in groups.items():
+            province_entry, reg_type_entry, _ = info
+            segments = []
+            for row, span in enumerate(spans, start):
+                if not found[row]:
+                    failed[key] = QuoteError(f"No tax rate configured for {span.fiscal_year.name_en}")
+                    break
+                segments.append(self._segment(span, book.reg_rule(province_entry, span.fiscal_year, reg_type_entry),
+                                              tax[row], renewal[row], income_tax[row]))
+            else:
+                priced[key] = segments
+            start += len(spans)
+
+    def price_many(self, groups: Mapping[tuple, tuple]) -> Tuple[Dict[tuple, List[_Segment]],
+                                                                Dict[tuple, QuoteError]]:
+        """
+        Rates for the segments of many planned quotes
+
+        With a rate cube for the engine's book, all segments are looked up
+        in one vectorized pass; otherwise one quote at a time from the book.
+
+        Args:
+            groups: Canonical key -> (info, is_public, spans) from plan
+
+        Returns:
+            (key -> priced segments, key -> QuoteError for quotes missing a rate)
+        """
+        priced, failed = {}, {}
+        with stage('rate_lookup'):
+            cube = get_rate_cube(self.book) if groups else None
+            if cube is not None:
+                self._price_with_cube(cube, groups, priced, failed)
+                return priced, failed
+            for key, (info, is_public, spans) in groups.items():
+                try:
+                    priced[key] = self.price(info, is_public, spans)
+                except QuoteError as e:
+                    failed[key] = e.with_traceback(None)
+        return priced, failed
+
+    @staticmethod
+    def compute(group_segments: List[List[_Segment]]) -> List[Dict[str, Any]]:
+        """Money arithmetic for many canonical quotes as one set of paisa array operations"""
+        flat = [segment for segments in group_segments for segment in segments]
+        owner = np.repeat(np.arange(len(group_segments)),
+                          [len(segments) for segments in group_segments]).astype(np.int64)
+        tax = np.array([s.tax for s in flat], dtype=np.int64)
+        renewal = np.array([s.renewal for s in flat], dtype=np.int64)
+        income_tax = np.array([s.income_tax for s in flat], dtype=np.int64)
+        with stage('penalty'):
+            rate_bp = np.array([s.penalty.rate_bp if s.penalty else 0 for s in flat], dtype=np.int64)
+            minimum = np.array([s.penalty.minimum if s.penalty else 0 for s in flat], dtype=np.int64)
+            penalty = apply_rates(tax + income_tax, rate_bp, minimum)
+
+        totals = np.zeros((len(group_segments), 4), dtype=np.int64)
+        np.add.at(totals, owner, np.stack([tax, renewal, income_tax, penalty], axis=1)
+                  if len(flat) else np.zeros((0, 4), dtype=np.int64))
+
+        computed = []
+        position = 0
+        for group, segments in enumerate(group_segments):
+            fiscal_years = []
+            for segment in segments:
+                notes = [segment.note] if segment.note else []
+                if penalty[position]:
+                    notes.append(segment.penalty.note)
+                fiscal_years.append({
+                    'fiscal_year': segment.fiscal_year.name,
+                    'fiscal_year_id': segment.fiscal_year.id,
+                    'cc_range': str(segment.cc_range) if segment.cc_range else None,
+                    'tax_amount': from_paisa(tax[position]),
+                    'renewal_fee': from_paisa(renewal[position]),
+                    'income_tax': from_paisa(income_tax[position]),
+                    'penalty': from_paisa(penalty[position]),
+                    'case_note': "; ".join(notes),
+                })
+                position += 1
+            group_tax, group_renewal, group_income, group_penalty = totals[group].tolist()
+            computed.append({
+                'fiscal_years': fiscal_years,
+                'total_tax': from_paisa(group_tax),
+                'total_renewal_fee': from_paisa(group_renewal),
+                'total_income_tax': from_paisa(group_income),
+                'total_penalty': from_paisa(group_penalty),
+                'grand_total': from_paisa(group_tax + group_renewal + group_income + group_penalty),
+            })
+        return computed
+
+    @staticmethod
+    def finish(request: QuoteRequest, info, spans: List[_Span],
+               computed: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the per-request fields (days per year, vehicle info) to a computed quote"""
+        province, reg_type, category = info
+        # Computed values may be shared through the quote cache, so this works on copies
+        result = dict(computed)
+        result['fiscal_years'] = [dict(entry, days=span.days)
+                                  for entry, span in zip(computed['fiscal_years'], spans)]
+        result['vehicle_info'] = {
+            'province': province.name,
+            'reg_type': reg_type.name,
+            'category': category.name,
+            'cc_power': request.cc_power,
+            'cc_range': str(spans[-1].cc_range) if spans and spans[-1].cc_range else None,
+        }
+        return result
+
+    def calculate(self, request: QuoteRequest) -> Dict[str, Any]:
+        """
+        Arrears of one vehicle, uncached
+
+        Returns:
+            Result dictionary in the shape generate_calculation_summary expects
+
+        Raises:
+            QuoteError: If the request cannot be quoted
+        """
+        key, info, spans = self.plan(request)
+        priced, failed = self.price_many({key: (info, request.is_public, spans)})
+        if failed:
+            raise failed[key]
+        return self.finish(request, info, spans, self.compute([priced[key]])[0])
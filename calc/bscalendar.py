@@ -0,0 +1,199 @@
+import unicodedata
+from bisect import bisect_right
+from typing import Optional, Tuple
+
+import nepali_datetime
+import numpy as np
+
+# Bikram Sambat years covered by the ordinal table
+MIN_YEAR = 2000
+MAX_YEAR = 2100
+
+# Ordinals are proleptic Gregorian ordinals (datetime.date.toordinal), so they
+# compare and subtract directly against FiscalYear DateFields
+
+
+def _last_month_length(year: int, month: int) -> int:
+    for day in range(32, 27, -1):
+        try:
+            nepali_datetime.date(year, month, day)
+            return day
+        except ValueError:
+            continue
+    raise ValueError(f"No valid days in {year}-{month}")
+
+
+def _build_month_starts() -> np.ndarray:
+    """Ordinal of the first day of every month, plus one past the last day"""
+    months = (MAX_YEAR - MIN_YEAR + 1) * 12
+    starts = np.empty(months + 1, dtype=np.int32)
+    for year in range(MIN_YEAR, MAX_YEAR + 1):
+        for month in range(1, 13):
+            starts[(year - MIN_YEAR) * 12 + month - 1] = \
+                nepali_datetime.date(year, month, 1).to_datetime_date().toordinal()
+    starts[months] = starts[months - 1] + _last_month_length(MAX_YEAR, 12)
+    return starts
+
+
+MONTH_STARTS = _build_month_starts()
+MONTH_LENGTHS = np.diff(MONTH_STARTS).astype(np.int8)
+
+# Plain lists for scalar lookups; indexing a list beats indexing a NumPy array
+_STARTS = MONTH_STARTS.tolist()
+_LENGTHS = MONTH_LENGTHS.tolist()
+
+MIN_ORDINAL = _STARTS[0]
+MAX_ORDINAL = _STARTS[-1] - 1
+
+
+def _month_index(year: int, month: int) -> int:
+    return (year - MIN_YEAR) * 12 + month - 1
+
+
+def is_valid(year: int, month: int, day: int) -> bool:
+    """True if (year, month, day) is a real BS date inside the table"""
+    if not (MIN_YEAR <= year <= MAX_YEAR and 1 <= month <= 12):
+        return False
+    return 1 <= day <= _LENGTHS[_month_index(year, month)]
+
+
+def days_in_month(year: int, month: int) -> int:
+    """Number of days in a BS month"""
+    return _LENGTHS[_month_index(year, month)]
+
+
+def to_ordinal(year: int, month: int, day: int) -> Optional[int]:
+    """
+    Convert a BS date to a day ordinal
+
+    Args:
+        year: BS year
+        month: BS month (1-12)
+        day: BS day of month
+
+    Returns:
+        Gregorian day ordinal or None if the date is invalid
+    """
+    if not is_valid(year, month, day):
+        return None
+    return _STARTS[_month_index(year, month)] + day - 1
+
+
+def from_ordinal(ordinal: int) -> Tuple[int, int, int]:
+    """
+    Convert a day ordinal back to a BS (year, month, day)
+
+    Raises:
+        ValueError: If the ordinal is outside the table
+    """
+    if not MIN_ORDINAL <= ordinal <= MAX_ORDINAL:
+        raise ValueError(f"Ordinal {ordinal} is outside BS {MIN_YEAR}-{MAX_YEAR}")
+    index = bisect_right(_STARTS, ordinal) - 1
+    year, month = divmod(index, 12)
+    return MIN_YEAR + year, month + 1, ordinal - _STARTS[index] + 1
+
+
+def split_date_string(date_string: str) -> Optional[Tuple[int, int, int]]:
+    """Split a strict YYYY-MM-DD string into integers, or None"""
+    if (not isinstance(date_string, str) or len(date_string) != 10
+            or date_string[4] != '-' or date_string[7] != '-'):
+        return None
+    year, month, day = date_string[:4], date_string[5:7], date_string[8:]
+    if not (year.isdecimal() and month.isdecimal() and day.isdecimal()):
+        return None
+    return int(year), int(month), int(day)
+
+
+def parse_ordinal(date_string: str) -> Optional[int]:
+    """Day ordinal of a YYYY-MM-DD BS date string, or None if invalid"""
+    parts = split_date_string(date_string)
+    if parts is None:
+        return None
+    return to_ordinal(*parts)
+
+
+def date_ordinal(bs_date) -> int:
+    """Day ordinal of a nepali_datetime.date (or anything with year/month/day)"""
+    ordinal = to_ordinal(bs_date.year, bs_date.month, bs_date.day)
+    if ordinal is None:
+        # Outside the table; fall back to the library conversion
+        return bs_date.to_datetime_date().toordinal()
+    return ordinal
+
+
+def to_ordinals(years, months, days) -> np.ndarray:
+    """
+    Convert arrays of BS dates to day ordinals without per-date objects
+
+    Args:
+        years: Array-like of BS years
+        months: Array-like of BS months
+        days: Array-like of BS days
+
+    Returns:
+        int32 array of ordinals, -1 where the date is invalid
+    """
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+
+    in_table = (years >= MIN_YEAR) & (years <= MAX_YEAR) & (months >= 1) & (months <= 12)
+    index = np.where(in_table, (years - MIN_YEAR) * 12 + months - 1, 0)
+    valid = in_table & (days >= 1) & (days <= MONTH_LENGTHS[index])
+    return np.where(valid, MONTH_STARTS[index] + days - 1, -1).astype(np.int32)
+
+
+def from_ordinals(ordinals) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert an array of day ordinals back to BS (years, months, days)
+
+    Out-of-table ordinals come back as zeros in all three arrays.
+    """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    valid = (ordinals >= MIN_ORDINAL) & (ordinals <= MAX_ORDINAL)
+    index = np.clip(np.searchsorted(MONTH_STARTS, ordinals, side='right') - 1, 0, len(MONTH_STARTS) - 2)
+    years = np.where(valid, MIN_YEAR + index // 12, 0)
+    months = np.where(valid, index % 12 + 1, 0)
+    days = np.where(valid, ordinals - MONTH_STARTS[index] + 1, 0)
+    return years, months, days
+
+
+def parse_ordinals(date_strings) -> np.ndarray:
+    """
+    Parse an array of YYYY-MM-DD BS date strings to day ordinals
+
+    The strings are viewed as a 2D code point matrix so digits are decoded
+    with array arithmetic instead of per-string Python calls. Like
+    split_date_string, any Unicode decimal digit is accepted, so Devanagari
+    dates such as '२०८०-०१-०१' parse too.
+
+    Returns:
+        int32 array of ordinals, -1 where a string is malformed or invalid
+    """
+    # One spare character so that over-long strings are caught instead of truncated
+    raw = np.asarray(date_strings, dtype='U11')
+    if raw.size == 0:
+        return np.empty(raw.shape, dtype=np.int32)
+    chars = raw.reshape(-1).view(np.uint32).reshape(-1, 11).astype(np.int64)
+
+    values = np.where((chars >= ord('0')) & (chars <= ord('9')), chars - ord('0'), -1)
+    # Other scripts' digits: one unicodedata call per distinct code point
+    wide = chars > 127
+    if wide.any():
+        code_points, inverse = np.unique(chars[wide], return_inverse=True)
+        decoded = np.array([unicodedata.decimal(chr(c), -1) for c in code_points.tolist()], dtype=np.int64)
+        values[wide] = decoded[inverse]
+
+    digit_columns = [0, 1, 2, 3, 5, 6, 8, 9]
+    digits = values[:, digit_columns]
+    well_formed = ((digits >= 0).all(axis=1)
+                   & (chars[:, 4] == ord('-'))
+                   & (chars[:, 7] == ord('-'))
+                   & (chars[:, 10] == 0))
+
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 4] * 10 + digits[:, 5]
+    days = digits[:, 6] * 10 + digits[:, 7]
+    ordinals = to_ordinals(years, months, days)
+    ordinals[~well_formed] = -1
+    return ordinals.reshape(raw.shape)
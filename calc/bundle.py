@@ -0,0 +1,276 @@
+"""
+Versioned rate bundles for quoting on the client
+
+A bundle holds everything needed to price a vehicle in one province:
+fiscal years, registration types, categories, the province's CC ranges,
+tax rates and exemption rules, the income tax rates that apply to them and
+the penalty schedules in effect, plus the built-in default penalty. Tables
+are columnar ({"columns": [...], "rows": [[...], ...]}) with the id first,
+decimals as strings, dates as ISO strings. Lookups follow the rate book:
+among duplicate keys the lowest id wins, tax and for_income_tax CC ranges
+are resolved as separate series, and a fiscal year without CC ranges of
+its own uses those of the latest earlier year that has some.
+
+A bundle's version is the hash of its content. Published bundles are kept
+as gzip files under CALC_RATE_BUNDLE['DIR'], so a client holding an older
+version can be sent only the rows that changed since.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import (Category, CCRange, FiscalYear, IncomeTaxRate, PenaltySchedule, PenaltyTier,
+                     RegRule, RegType, TaxRate)
+from .penalties import default_schedule, from_paisa
+from .ratebook import get_rate_book
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+
+# Table name -> (model, columns); 'id' first in every table
+TABLES = {
+    'fiscal_years': (FiscalYear, ('id', 'name', 'name_en', 'start_date', 'end_date',
+                                  'income_tax_due_date', 'vehicle_tax_due_date', 'previous_id')),
+    'reg_types': (RegType, ('id', 'name', 'name_en')),
+    'categories': (Category, ('id', 'name', 'name_en', 'has_cc_range')),
+    'cc_ranges': (CCRange, ('id', 'fiscal_year_id', 'reg_type_id', 'category_id',
+                            'from_cc', 'to_cc', 'for_income_tax')),
+    'tax_rates': (TaxRate, ('id', 'fiscal_year_id', 'reg_type_id', 'category_id', 'cc_range_id',
+                            'private_tax', 'public_tax', 'private_renewal', 'public_renewal')),
+    'income_tax_rates': (IncomeTaxRate, ('id', 'fiscal_year_id', 'reg_type_id', 'category_id',
+                                         'cc_range_id', 'income_tax')),
+    'reg_rules': (RegRule, ('id', 'fiscal_year_id', 'regtype_id',
+                            'tax_exempted', 'renewal_exempted', 'income_tax_exempted')),
+    'penalty_schedules': (PenaltySchedule, ('id', 'name', 'province_id', 'fiscal_year_id', 'minimum_penalty')),
+    'penalty_tiers': (PenaltyTier, ('id', 'schedule_id', 'from_day', 'rate')),
+}
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_RATE_BUNDLE', {}).get(key, default)
+
+
+def _scopes(province_id: int) -> Dict[str, Q]:
+    """Row filters limiting each table to what quoting in the province can use"""
+    in_province = Q(province_id=province_id)
+    schedules = Q(province_id=province_id) | Q(province__isnull=True)
+    return {
+        'cc_ranges': in_province,
+        'tax_rates': in_province,
+        'income_tax_rates': Q(cc_range__isnull=True) | Q(cc_range__province_id=province_id),
+        'reg_rules': in_province,
+        'penalty_schedules': schedules,
+        'penalty_tiers': Q(schedule__province_id=province_id) | Q(schedule__province__isnull=True),
+    }
+
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _default_penalty() -> Dict[str, Any]:
+    schedule = default_schedule()
+    return {
+        'minimum_penalty': str(from_paisa(schedule.minimum)),
+        'tiers': [[band.from_day, band.rate_bp] for band in schedule.bands[1:]],
+    }
+
+
+def _digest(content: Dict[str, Any]) -> str:
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def build_bundle(province_id: int) -> Dict[str, Any]:
+    """
+    Rate bundle of one province, one query per table
+
+    Penalty tier rates in the default schedule are basis points; the
+    penalty_tiers table keeps the stored fractions.
+    """
+    scopes = _scopes(province_id)
+    tables = {}
+    for name, (model, columns) in TABLES.items():
+        queryset = model.objects.filter(scopes.get(name, Q())).order_by('id').values_list(*columns)
+        tables[name] = {'columns': list(columns),
+                        'rows': [[_encode(value) for value in row] for row in queryset]}
+    content = {
+        'format': FORMAT,
+        'province': province_id,
+        'tables': tables,
+        'default_penalty': _default_penalty(),
+    }
+    return dict(content, version=_digest(content))
+
+
+def diff_bundles(base: Dict[str, Any], current: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Rows to upsert and ids to delete per table to turn base into current
+
+    Returns:
+        Delta document, or None when the bundles cannot be diffed (another
+        format, province or table layout)
+    """
+    if (base.get('format') != current['format'] or base.get('province') != current['province']
+            or base.get('tables', {}).keys() != current['tables'].keys()):
+        return None
+    tables = {}
+    for name, table in current['tables'].items():
+        old = base['tables'][name]
+        if old['columns'] != table['columns']:
+            return None
+        old_rows = {row[0]: row for row in old['rows']}
+        new_ids = {row[0] for row in table['rows']}
+        upsert = [row for row in table['rows'] if old_rows.get(row[0]) != row]
+        delete = [row_id for row_id in old_rows if row_id not in new_ids]
+        if upsert or delete:
+            tables[name] = {'columns': table['columns'], 'upsert': upsert, 'delete': delete}
+    return {
+        'format': current['format'],
+        'province': current['province'],
+        'base': base['version'],
+        'version': current['version'],
+        'delta': True,
+        'tables': tables,
+        'default_penalty': current['default_penalty'],
+    }
+
+
+class BundleStore:
+    """Published bundles as <directory>/<province>/<version>.json.gz"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path(self, province_id: int, version: str) -> Path:
+        return self.directory / str(int(province_id)) / f"{version}.json.gz"
+
+    def save(self, bundle: 'EncodedBundle') -> Path:
+        """
+        Write a bundle unless that version is already stored; the write is
+        atomic. Saving a stored version again marks it as the newest, so
+        pruning keeps it.
+        """
+        path = self.path(bundle.document['province'], bundle.version)
+        if path.exists():
+            try:
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                # Pruned by another worker in the meantime; write it again
+                pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(bundle.gzipped)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return path
+
+    def load(self, province_id: int, version: str) -> Optional[Dict[str, Any]]:
+        # Versions are hex digests; anything else never names a stored file
+        if not version.isalnum():
+            return None
+        try:
+            with gzip.open(self.path(province_id, version), 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def prune(self, province_id: int, keep: int) -> List[Path]:
+        """Delete all but the newest keep versions of a province"""
+        directory = self.directory / str(int(province_id))
+        if not directory.is_dir():
+            return []
+        stored = sorted(directory.glob('*.json.gz'), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in stored[keep:]:
+            path.unlink(missing_ok=True)
+        return stored[keep:]
+
+
+def get_store() -> Optional[BundleStore]:
+    directory = _config('DIR', None)
+    return BundleStore(directory) if directory else None
+
+
+def encode(document: Dict[str, Any]) -> bytes:
+    return json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class EncodedBundle:
+    """A bundle or delta document with its JSON and gzip bytes"""
+
+    def __init__(self, document: Dict[str, Any]):
+        self.document = document
+        self.version = document['version']
+        self.body = encode(document)
+        # mtime=0: the bytes depend on the content only, identical in every worker
+        self.gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+
+
+_bundles: Dict[int, Tuple[str, EncodedBundle]] = {}
+_deltas: 'OrderedDict[Tuple[int, str, str], Optional[EncodedBundle]]' = OrderedDict()
+_lock = threading.Lock()
+MAX_CACHED_DELTAS = 64
+
+
+def get_bundle(province_id: int) -> EncodedBundle:
+    """
+    Current bundle of a province, rebuilt when the rate book changes and
+    published to the store so later deltas can start from it. Publishing
+    prunes the province to the newest CALC_RATE_BUNDLE['KEEP'] versions,
+    so rate changes cannot fill the directory.
+    """
+    fingerprint = get_rate_book().fingerprint
+    cached = _bundles.get(province_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    with _lock:
+        cached = _bundles.get(province_id)
+        if cached is None or cached[0] != fingerprint:
+            bundle = EncodedBundle(build_bundle(province_id))
+            store = get_store()
+            if store is not None:
+                try:
+                    store.save(bundle)
+                    store.prune(province_id, _config('KEEP', 20))
+                except OSError as e:
+                    logger.warning("Could not publish rate bundle %s: %s", bundle.version, e)
+            cached = _bundles[province_id] = (fingerprint, bundle)
+    return cached[1]
+
+
+def get_delta(province_id: int, since: str, current: EncodedBundle) -> Optional[EncodedBundle]:
+    """Delta from a published version to the current bundle, None if that version is unknown"""
+    key = (province_id, since, current.version)
+    with _lock:
+        if key in _deltas:
+            _deltas.move_to_end(key)
+            return _deltas[key]
+    store = get_store()
+    base = store.load(province_id, since) if store is not None else None
+    delta = diff_bundles(base, current.document) if base is not None else None
+    encoded = EncodedBundle(delta) if delta is not None else None
+    with _lock:
+        _deltas[key] = encoded
+        while len(_deltas) > MAX_CACHED_DELTAS:
+            _deltas.popitem(last=False)
+    return encoded
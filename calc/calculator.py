@@ -1,25 +1,82 @@
-from calc.models import FiscalYear, CCRange, TaxRate
+from typing import Any, Dict
+
+from calc.arrears import ArrearsEngine, QuoteRequest
+from calc.helper import generate_calculation_summary
+from calc.lookups import LookupContext
+from calc.ratebook import get_rate_book
 
 
 class TaxCalculator():
-    def __init__(self, form):
-        self.province = form.cleaned_data['province']
-        self.reg_type = form.cleaned_data['reg_type']
-        self.cc_power = form.cleaned_data['cc_power']
-        self.last_payment_date = form.cleaned_data['last_payment_date']
-        self.next_payment_date = form.cleaned_data['next_payment_date']
+    """
+    Arrears for the vehicle described by a valid TaxCalculatorForm
+
+    The form has no province field, so the province is passed in, read from
+    cleaned_data if a form adds one, or taken from the rate book when
+    exactly one province is configured. The form's LookupContext is reused,
+    so validation and calculation share one rate book and its lookups.
+    """
+
+    def __init__(self, form, province=None, is_public: bool = False):
+        data = form.cleaned_data
+        self.lookups = getattr(form, 'lookups', None) or LookupContext()
+        self.rate_book = self.lookups.book
+        self.engine = ArrearsEngine(self.rate_book)
+        self.province = data.get('province') or province or self._only_province()
+        self.reg_type = data['reg_type']
+        self.category = data['category']
+        self.cc_power = data.get('cc_power')
+        self.last_paid_date = data['last_paid_date']
+        self.next_payment_date = data['next_payment_date']
+        self.is_public = is_public
+
+    def _only_province(self):
+        if len(self.rate_book.provinces) != 1:
+            raise ValueError("A province is required when several provinces are configured")
+        return next(iter(self.rate_book.provinces.values()))
 
     @staticmethod
     def find_fiscal_year(date):
-        return FiscalYear.objects.filter(start_date__lte=date, end_date__gte=date).first()
+        return get_rate_book().fiscal_year_for(date)
 
-    def find_cc_range(self):
-        return CCRange.objects.filter(province=self.province, fiscal_year=self.find_fiscal_year, from_cc__lte=self.cc_power, to_cc__gte=self.cc_power).first()
+    def find_cc_range(self, fiscal_year):
+        return self.rate_book.find_cc_range(
+            self.category, self.cc_power,
+            province=self.province,
+            fiscal_year=fiscal_year,
+            reg_type=self.reg_type
+        )
 
     def find_vehicle_tax(self, fiscal_year):
-        vehicle_tax = TaxRate.objects.filter(
-            province=self.province,
-            reg_type=self.reg_type,
-            cc_power=self.cc_power,
-            fiscal_year=fiscal_year
+        return self.rate_book.tax_rate(
+            self.reg_type,
+            self.category,
+            self.find_cc_range(fiscal_year),
+            fiscal_year,
+            province=self.province
         )
+
+    def quote_request(self) -> QuoteRequest:
+        return QuoteRequest(
+            province=self.province.id,
+            reg_type=self.reg_type.id,
+            category=self.category.id,
+            cc_power=self.cc_power if self.category.has_cc_range else None,
+            last_paid_date=self.last_paid_date,
+            next_payment_date=self.next_payment_date,
+            is_public=self.is_public,
+        )
+
+    def calculate(self) -> Dict[str, Any]:
+        """
+        Tax, renewal fee, income tax and penalty for every owed fiscal year
+
+        Returns:
+            Result dictionary in the shape generate_calculation_summary expects
+
+        Raises:
+            QuoteError: If a rate or CC range is missing for an owed year
+        """
+        return self.engine.calculate(self.quote_request())
+
+    def summary(self) -> str:
+        return generate_calculation_summary(self.calculate())
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends whose entries are not visible to other worker processes
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The rate book and reference registry notice other workers' changes only through a shared cache"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Warning(
+            "The default cache is process-local, so rate changes saved in one worker "
+            "are not picked up by the others.",
+            hint="Point CACHES['default'] at a shared backend (Redis, Memcached or the database cache) "
+                 "when running more than one worker.",
+            id='calc.W001',
+        )]
+    return []
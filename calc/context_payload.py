@@ -0,0 +1,93 @@
+"""
+Calculator context (reference tables and CC ranges per category) as a
+prebuilt JSON payload
+
+The context only changes with the rate data, so it is grouped and
+serialized once per data version: the reference registry's version plus
+the rate book's fingerprint. The JSON bytes, their gzip encoding and a
+content hash used as the ETag are kept in process, and every page render
+and API call reuses them.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .ratebook import RateBook, get_rate_book
+from .reference import ReferenceData, get_reference
+
+
+class ContextPayload(NamedTuple):
+    """One serialized version of the calculator context"""
+    key: Tuple[str, str]
+    data: Dict[str, Any]
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+
+def group_cc_ranges(book: RateBook, reference: ReferenceData) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    CC ranges of every category that has them, keyed by category id
+
+    One sort of the rate book's ranges by (category, from_cc, id) and one
+    pass to split it, instead of a query per category.
+    """
+    with_ranges = {category.id for category in reference.categories if category.has_cc_range}
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for cc_range in sorted(book.cc_ranges.values(), key=lambda r: (r.category_id, r.from_cc, r.id)):
+        if cc_range.category_id not in with_ranges:
+            continue
+        grouped.setdefault(str(cc_range.category_id), []).append({
+            'id': cc_range.id,
+            'from_cc': float(cc_range.from_cc),
+            'to_cc': float(cc_range.to_cc),
+            'for_income_tax': cc_range.for_income_tax,
+            'display': str(cc_range),
+        })
+    return grouped
+
+
+def build_context(book: RateBook, reference: ReferenceData) -> Dict[str, Any]:
+    """JSON-ready calculator context, tables in the order the form shows them"""
+    return {
+        'reg_types': [{'id': e.id, 'name': e.name, 'name_en': e.name_en}
+                      for e in reference.ordered('reg_types', 'name')],
+        'categories': [{'id': e.id, 'name': e.name, 'name_en': e.name_en, 'has_cc_range': e.has_cc_range}
+                       for e in reference.ordered('categories', 'name')],
+        'fiscal_years': [{'id': e.id, 'name': e.name, 'name_en': e.name_en,
+                          'start_date': e.start_date.isoformat(), 'end_date': e.end_date.isoformat()}
+                         for e in reference.ordered('fiscal_years', 'start_date', reverse=True)],
+        'cc_ranges_data': group_cc_ranges(book, reference),
+    }
+
+
+def serialize(key: Tuple[str, str], data: Dict[str, Any]) -> ContextPayload:
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # mtime=0 makes the gzip bytes depend on the content only, identical in every worker
+    gzipped = gzip.compress(body, compresslevel=6, mtime=0)
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    return ContextPayload(key, data, body, gzipped, etag)
+
+
+_payload: Optional[ContextPayload] = None
+_build_lock = threading.Lock()
+
+
+def get_context_payload() -> ContextPayload:
+    """
+    The calculator context for the current rate data, built on first use
+    after each change
+    """
+    global _payload
+    book, reference = get_rate_book(), get_reference()
+    key = (reference.version, book.fingerprint)
+    payload = _payload
+    if payload is not None and payload.key == key:
+        return payload
+    with _build_lock:
+        payload = _payload
+        if payload is None or payload.key != key:
+            payload = _payload = serialize(key, build_context(book, reference))
+    return payload
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from graphql import GraphQLError, parse, print_ast, validate
+from graphql.language import DocumentNode, OperationDefinitionNode
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY_FILE = Path(__file__).resolve().parent / 'persisted_queries.json'
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_GRAPHQL', {}).get(key, default)
+
+
+def query_hash(text: str) -> str:
+    """SHA-256 hex digest used as a persisted query id"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PersistedQueryRegistry:
+    """
+    Fixed set of query documents keyed by SHA-256 hash.
+
+    The registry file is generated from the frontend's queries by the
+    sync_persisted_queries command and maps hash -> {"name", "query"}.
+    """
+
+    def __init__(self, queries: Dict[str, Dict[str, str]]):
+        self.queries = queries
+
+    @classmethod
+    def load(cls, path=None) -> 'PersistedQueryRegistry':
+        path = Path(path or _config('PERSISTED_QUERIES_FILE', DEFAULT_REGISTRY_FILE))
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            logger.warning("Persisted query registry %s not found", path)
+            return cls({})
+
+    def __len__(self):
+        return len(self.queries)
+
+    def get(self, query_id: str) -> Optional[str]:
+        entry = self.queries.get(query_id)
+        return entry['query'] if entry else None
+
+
+class CachedDocument(NamedTuple):
+    document: Optional[DocumentNode]
+    errors: Tuple[GraphQLError, ...]
+    operations: Dict[Optional[str], str]
+
+
+class DocumentCache:
+    """
+    LRU of parsed and validated query documents.
+
+    A document and its validation result depend only on the query text and
+    the schema, so repeated queries skip both steps. Parse and validation
+    failures are cached as well.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[tuple, CachedDocument]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.parse_seconds = 0.0
+        self.validate_seconds = 0.0
+
+    def get(self, schema, query: str, rules: Optional[Sequence] = None,
+            max_errors: Optional[int] = None) -> CachedDocument:
+        """
+        Parsed document and validation errors for a query
+
+        Args:
+            schema: GraphQLSchema to validate against
+            query: Query text
+            rules: Validation rules, None for the specified rules
+            max_errors: Maximum number of validation errors to report
+
+        Returns:
+            CachedDocument; document is None when the query does not parse
+        """
+        key = (id(schema), query, tuple(rules) if rules else None)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        started = time.perf_counter()
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            parsed_at = time.perf_counter()
+            cached = CachedDocument(None, (e,), {})
+        else:
+            parsed_at = time.perf_counter()
+            errors = validate(schema, document, rules, max_errors)
+            operations = {
+                definition.name.value if definition.name else None: definition.operation.value
+                for definition in document.definitions
+                if isinstance(definition, OperationDefinitionNode)
+            }
+            cached = CachedDocument(document, tuple(errors), operations)
+        finished = time.perf_counter()
+
+        with self._lock:
+            self.misses += 1
+            self.parse_seconds += parsed_at - started
+            self.validate_seconds += finished - parsed_at
+            self._entries[key] = cached
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return cached
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and the parse/validate time avoided by cache hits"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            mean_parse = self.parse_seconds / self.misses if self.misses else 0.0
+            mean_validate = self.validate_seconds / self.misses if self.misses else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'mean_parse_ms': round(mean_parse * 1000, 4),
+                'mean_validate_ms': round(mean_validate * 1000, 4),
+                'saved_per_hit_ms': round((mean_parse + mean_validate) * 1000, 4),
+                'saved_total_ms': round((mean_parse + mean_validate) * self.hits * 1000, 2),
+            }
+
+
+_registry: Optional[PersistedQueryRegistry] = None
+_document_cache: Optional[DocumentCache] = None
+_lock = threading.Lock()
+
+
+def get_registry() -> PersistedQueryRegistry:
+    """Process-wide persisted query registry, loaded on first use"""
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = PersistedQueryRegistry.load()
+    return _registry
+
+
+def get_document_cache() -> DocumentCache:
+    """Process-wide document cache sized by CALC_GRAPHQL['DOCUMENT_CACHE_SIZE']"""
+    global _document_cache
+    if _document_cache is None:
+        with _lock:
+            if _document_cache is None:
+                _document_cache = DocumentCache(_config('DOCUMENT_CACHE_SIZE', 512))
+    return _document_cache
+
+
+def extract_queries(source: str) -> List[Tuple[str, str]]:
+    """
+    (operation name, normalized document) for every gql`...` block in a
+    JavaScript source file, printed in canonical form
+    """
+    queries = []
+    for text in re.findall(r'gql`(.*?)`', source, re.DOTALL):
+        document = parse(text)
+        names = [definition.name.value for definition in document.definitions
+                 if isinstance(definition, OperationDefinitionNode) and definition.name]
+        queries.append((names[0] if names else '', print_ast(document)))
+    return queries
@@ -0,0 +1,193 @@
+import csv
+import json
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+
+from .helper import get_current_nepali_date, iter_calculation_summary
+
+FORMATS = ('txt', 'csv', 'json', 'ndjson')
+
+CONTENT_TYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+# One row per result; the amount columns follow export_calculation_results
+CSV_COLUMNS = ['Row', 'Vehicle ID', 'Vehicle Type', 'Category', 'Total Vehicle Tax',
+               'Total Renewal Fee', 'Total Income Tax', 'Total Penalty', 'Grand Total', 'Error']
+CSV_TOTAL_KEYS = ('total_tax', 'total_renewal_fee', 'total_income_tax', 'total_penalty', 'grand_total')
+
+
+@lru_cache(maxsize=4096)
+def _decimal_text(value: Decimal) -> str:
+    # Rate tables repeat the same few amounts, so most conversions are cache hits
+    return str(value)
+
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Convert a result structure to plain JSON types up front
+
+    Decimals become their exact string form (as ``default=str`` produced),
+    so json.dumps never has to call back into Python per value.
+    """
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, Decimal):
+        return _decimal_text(value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    """File-like object whose write() returns the text, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def json_record(result: Dict[str, Any], indent=None) -> str:
+    """Serialize one result dictionary"""
+    return json.dumps(to_jsonable(result), indent=indent, ensure_ascii=False)
+
+
+def csv_record(result: Dict[str, Any]) -> List[Any]:
+    """Flatten one result (or error record) into a CSV_COLUMNS row"""
+    vehicle_info = result.get('vehicle_info', {})
+    return [
+        result.get('row', ''), result.get('vehicle_id', ''),
+        vehicle_info.get('reg_type', ''), vehicle_info.get('category', ''),
+        *[result.get(key, '') for key in CSV_TOTAL_KEYS],
+        result.get('error', ''),
+    ]
+
+
+def txt_record(result: Dict[str, Any], generated_on=None) -> Iterator[str]:
+    """Yield the text block for one result (or error record)"""
+    if 'row' in result:
+        vehicle_id = result.get('vehicle_id')
+        yield f"### Row {result['row']}" + (f" ({vehicle_id})" if vehicle_id else "") + "\n"
+    if result.get('error'):
+        yield f"Error: {result['error']}\n"
+    else:
+        for line in iter_calculation_summary(result, generated_on):
+            yield line + "\n"
+    yield "\n"
+
+
+def iter_txt(results: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Text summaries, one block per result"""
+    generated_on = get_current_nepali_date()
+    for result in results:
+        yield from txt_record(result, generated_on)
+
+
+def iter_csv(results: Iterable[Dict[str, Any]], header: bool = True) -> Iterator[str]:
+    """CSV with one row per result"""
+    writer = csv.writer(_Echo())
+    if header:
+        yield writer.writerow(CSV_COLUMNS)
+    for result in results:
+        yield writer.writerow(csv_record(result))
+
+
+def iter_json(results: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """A JSON array, emitted one element at a time"""
+    separator = "[\n"
+    for result in results:
+        yield separator + json_record(result)
+        separator = ",\n"
+    yield "[]\n" if separator == "[\n" else "\n]\n"
+
+
+def iter_ndjson(results: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Newline-delimited JSON, one result per line"""
+    for result in results:
+        yield json_record(result) + "\n"
+
+
+WRITERS = {
+    'txt': iter_txt,
+    'csv': iter_csv,
+    'json': iter_json,
+    'ndjson': iter_ndjson,
+}
+
+
+def iter_export(results: Iterable[Dict[str, Any]], format_type: str = 'txt') -> Iterator[str]:
+    """
+    Stream results in the requested format without building the whole output
+
+    Args:
+        results: Iterable of result dictionaries, consumed lazily
+        format_type: One of FORMATS
+
+    Returns:
+        Iterator of text chunks
+    """
+    try:
+        writer = WRITERS[format_type.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported export format: {format_type}")
+    return writer(results)
+
+
+def write_export(results: Iterable[Dict[str, Any]], stream, format_type: str = 'txt') -> None:
+    """Write streamed export chunks straight to an open text file"""
+    for chunk in iter_export(results, format_type):
+        stream.write(chunk)
+
+
+async def aiter_chunks(chunks: Iterable[str], batch: int = 64) -> AsyncIterator[str]:
+    """
+    Pull chunks from a sync iterator in a worker thread, a batch at a time
+
+    Under ASGI, Django drains a sync iterator with sync_to_async(list), which
+    buffers the whole export; an async iterator is sent as it is produced.
+    """
+    chunks = iter(chunks)
+
+    def take() -> List[str]:
+        return list(islice(chunks, batch))
+
+    while True:
+        part = await sync_to_async(take)()
+        if not part:
+            return
+        yield "".join(part)
+
+
+def streaming_export_response(results: Iterable[Dict[str, Any]], format_type: str = 'txt',
+                              filename: str = 'tax-calculation',
+                              asynchronous: bool = False) -> StreamingHttpResponse:
+    """
+    Serve results through StreamingHttpResponse
+
+    Args:
+        results: Iterable of result dictionaries, consumed while the response is sent
+        format_type: One of FORMATS
+        filename: Download file name without extension
+        asynchronous: Stream through an async iterator, for requests served under ASGI
+
+    Returns:
+        StreamingHttpResponse
+    """
+    format_type = format_type.lower()
+    chunks = iter_export(results, format_type)
+    response = StreamingHttpResponse(aiter_chunks(chunks) if asynchronous else chunks,
+                                     content_type=CONTENT_TYPES[format_type])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{format_type}"'
+    return response
@@ -0,0 +1,122 @@
+from typing import Dict, Iterator, List, NamedTuple, Sequence
+
+import numpy as np
+
+
+class FiscalYearSpan(NamedTuple):
+    fiscal_year: object
+    start: int
+    end: int
+    days: int
+
+
+class FiscalYearIndex:
+    """
+    Day-ordinal index over fiscal years.
+
+    A dense array covers every day from the earliest start_date to the latest
+    end_date and stores the position of the fiscal year containing it (-1
+    for days no year covers), so date -> fiscal year is one array read. A
+    second array stores, per day, the first year ending on or after it, so a
+    span query jumps straight to its first year and walks only the k years
+    it overlaps. Should two years overlap (bad data), the later one wins.
+    """
+
+    def __init__(self, fiscal_years: Sequence):
+        self.fiscal_years = tuple(sorted(fiscal_years, key=lambda fy: (fy.start_date, fy.id)))
+        self._starts = [fy.start_date.toordinal() for fy in self.fiscal_years]
+        self._ends = [fy.end_date.toordinal() for fy in self.fiscal_years]
+        self._by_id: Dict[int, object] = {fy.id: fy for fy in self.fiscal_years}
+
+        self._next: Dict[int, object] = {}
+        for fy in self.fiscal_years:
+            previous = self._by_id.get(fy.previous_id)
+            if previous is not None:
+                self._next[previous.id] = fy
+
+        if self.fiscal_years:
+            self.first_day = min(self._starts)
+            self.last_day = max(self._ends)
+            days = self.last_day - self.first_day + 1
+            slots = np.full(days, -1, dtype=np.int32)
+            for position, (start, end) in enumerate(zip(self._starts, self._ends)):
+                if end >= start:
+                    slots[start - self.first_day:end - self.first_day + 1] = position
+            self._slots = slots.tolist()
+
+            # Running max keeps the lookup valid if end dates are not monotonic
+            running_ends = np.maximum.accumulate(np.array(self._ends, dtype=np.int64))
+            all_days = np.arange(self.first_day, self.last_day + 1, dtype=np.int64)
+            self._first_from = np.searchsorted(running_ends, all_days, side='left').tolist()
+        else:
+            self.first_day, self.last_day = 0, -1
+            self._slots = []
+            self._first_from = []
+
+    def __len__(self):
+        return len(self.fiscal_years)
+
+    def get(self, fiscal_year_id: int):
+        return self._by_id.get(fiscal_year_id)
+
+    def containing(self, ordinal: int):
+        """
+        Fiscal year containing the day ordinal
+
+        Args:
+            ordinal: Gregorian day ordinal
+
+        Returns:
+            Fiscal year or None
+        """
+        if not self.first_day <= ordinal <= self.last_day:
+            return None
+        position = self._slots[ordinal - self.first_day]
+        return self.fiscal_years[position] if position >= 0 else None
+
+    def overlapping(self, start: int, end: int) -> List[FiscalYearSpan]:
+        """
+        Fiscal years overlapping the inclusive span [start, end], each clipped
+        to the span
+
+        Args:
+            start: First day ordinal of the span
+            end: Last day ordinal of the span
+
+        Returns:
+            List of FiscalYearSpan in date order
+        """
+        if end < start or end < self.first_day or start > self.last_day:
+            return []
+
+        if start >= self.first_day:
+            position = self._first_from[start - self.first_day]
+        else:
+            position = 0
+
+        spans = []
+        while position < len(self.fiscal_years) and self._starts[position] <= end:
+            fy_start, fy_end = self._starts[position], self._ends[position]
+            if fy_end >= start:
+                clipped_start, clipped_end = max(start, fy_start), min(end, fy_end)
+                spans.append(FiscalYearSpan(self.fiscal_years[position], clipped_start, clipped_end,
+                                            clipped_end - clipped_start + 1))
+            position += 1
+        return spans
+
+    def previous(self, fiscal_year):
+        """Fiscal year linked through ``previous``, or None"""
+        return self._by_id.get(fiscal_year.previous_id)
+
+    def next(self, fiscal_year):
+        """Fiscal year whose ``previous`` is the given one, or None"""
+        return self._next.get(fiscal_year.id)
+
+    def chain(self, fiscal_year) -> Iterator:
+        """Walk forward through the ``previous``/``next`` chain from a fiscal year"""
+        seen = set()
+        while fiscal_year is not None and fiscal_year.id not in seen:
+            seen.add(fiscal_year.id)
+            yield fiscal_year
+            fiscal_year = self._next.get(fiscal_year.id)
+
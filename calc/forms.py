@@ -2,14 +2,58 @@ from django import forms
 from django.core.exceptions import ValidationError
 import re
 import nepali_datetime
-from .models import RegType, Category, CCRange, FiscalYear
-from .helper import validate_nepali_date, parse_nepali_date, find_cc_range_for_power
+from .intervals import RANGE_GAP
+from .lookups import LookupContext
+from .reference import ReferenceData, aget_reference, get_reference
+from .timing import stage
+
+
+class RegistryChoiceField(forms.ChoiceField):
+    """
+    Choice field over a reference table of calc.reference
+
+    Choices come from the current registry snapshot whenever they are
+    rendered, and the cleaned value is the table's entry (a rate book
+    entry with id, name and name_en), so neither rendering nor validation
+    queries the database.
+
+    Args:
+        table: Registry table, e.g. 'reg_types' or 'categories'
+        order_by: Entry field the choices are sorted by
+        empty_label: Label of the blank choice
+    """
+
+    def __init__(self, table: str, order_by: str = 'name', empty_label: str = "---------", **kwargs):
+        self.table = table
+        self.order_by = order_by
+        self.empty_label = empty_label
+        super().__init__(choices=self._registry_choices, **kwargs)
+
+    def choices_from(self, reference: ReferenceData):
+        return [('', self.empty_label)] + [
+            (entry.id, str(entry)) for entry in reference.ordered(self.table, self.order_by)]
+
+    def _registry_choices(self):
+        return self.choices_from(get_reference())
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        entry = get_reference().get(self.table, value)
+        if entry is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                  params={'value': value})
+        return entry
+
+    def validate(self, value):
+        # to_python already rejected unknown ids
+        forms.Field.validate(self, value)
 
 
 class TaxCalculatorForm(forms.Form):
 
-    reg_type = forms.ModelChoiceField(
-        queryset=RegType.objects.all(),
+    reg_type = RegistryChoiceField(
+        'reg_types',
         empty_label="Select Registration Type",
         label="Registration Type",
         widget=forms.Select(attrs={
@@ -21,8 +65,8 @@ class TaxCalculatorForm(forms.Form):
         help_text="Select the appropriate registration category for your vehicle"
     )
 
-    category = forms.ModelChoiceField(
-        queryset=Category.objects.all(),
+    category = RegistryChoiceField(
+        'categories',
         empty_label="Select Vehicle Category",
         label="Vehicle Category",
         widget=forms.Select(attrs={
@@ -82,13 +126,16 @@ class TaxCalculatorForm(forms.Form):
         help_text="Nepali date format (e.g., 2081-04-15)"
     )
 
-    def __init__(self, *args, **kwargs):
-        """Initialize form with dynamic queryset ordering and additional setup"""
-        super().__init__(*args, **kwargs)
+    def __init__(self, *args, lookups: LookupContext = None, **kwargs):
+        """
+        Initialize form with dynamic queryset ordering and additional setup
 
-        # Order querysets for better UX
-        self.fields['reg_type'].queryset = RegType.objects.all().order_by('name')
-        self.fields['category'].queryset = Category.objects.all().order_by('name')
+        Args:
+            lookups: Context shared with the calculator for this submission;
+                a new one is created if not given
+        """
+        super().__init__(*args, **kwargs)
+        self.lookups = lookups or LookupContext()
 
         # Add CSS classes for better styling
         for field_name, field in self.fields.items():
@@ -98,6 +145,17 @@ class TaxCalculatorForm(forms.Form):
                 else:
                     field.widget.attrs['class'] = 'form-control'
 
+    async def aload_choices(self):
+        """
+        Fix the choices to the current reference data, loading it off the
+        event loop if needed, so an async view can render the form without
+        blocking queries
+        """
+        reference = await aget_reference()
+        for field_name in ('reg_type', 'category'):
+            field = self.fields[field_name]
+            field.choices = field.choices_from(reference)
+
     def clean_reg_type(self):
         """Validate registration type"""
         reg_type = self.cleaned_data.get('reg_type')
@@ -137,11 +195,10 @@ class TaxCalculatorForm(forms.Form):
                 raise ValidationError("CC/Power must be greater than 0.")
 
             # Check if the CC/Power value has a valid range defined
-            cc_range = find_cc_range_for_power(category, cc_power)
-            if not cc_range:
+            if self.lookups.resolve_power(category, cc_power).status == RANGE_GAP:
                 # Get available ranges for user guidance
-                available_ranges = CCRange.objects.filter(category=category).order_by('from_cc')
-                if available_ranges.exists():
+                available_ranges = self.lookups.range_index(category).ranges
+                if available_ranges:
                     ranges_text = ", ".join([f"{r.from_cc}-{r.to_cc}" for r in available_ranges])
                     raise ValidationError(
                         f"No tax range found for {cc_power} CC/Power. "
@@ -179,14 +236,14 @@ class TaxCalculatorForm(forms.Form):
                 "Date must be in YYYY-MM-DD format (e.g., 2080-04-15)."
             )
 
-        # Use helper function for validation
-        if not validate_nepali_date(date_str.strip()):
+        # Validated and parsed once; clean() and the summary reuse the result
+        if self.lookups.ordinal(date_str.strip()) is None:
             raise ValidationError(
                 "Invalid Nepali date. Please enter a valid date between 2070-2090 BS."
             )
 
         # Parse the date to ensure it's valid
-        parsed_date = parse_nepali_date(date_str.strip())
+        parsed_date = self.lookups.parse_date(date_str.strip())
         if not parsed_date:
             raise ValidationError("Unable to parse the provided date.")
 
@@ -215,19 +272,23 @@ class TaxCalculatorForm(forms.Form):
                 "Date must be in YYYY-MM-DD format (e.g., 2081-04-15)."
             )
 
-        # Use helper function for validation
-        if not validate_nepali_date(date_str.strip()):
+        # Validated and parsed once; clean() and the summary reuse the result
+        if self.lookups.ordinal(date_str.strip()) is None:
             raise ValidationError(
                 "Invalid Nepali date. Please enter a valid date between 2070-2090 BS."
             )
 
         # Parse the date to ensure it's valid
-        parsed_date = parse_nepali_date(date_str.strip())
+        parsed_date = self.lookups.parse_date(date_str.strip())
         if not parsed_date:
             raise ValidationError("Unable to parse the provided date.")
 
         return date_str.strip()
 
+    def full_clean(self):
+        with stage('form'):
+            super().full_clean()
+
     def clean(self):
         """Cross-field validation"""
         cleaned_data = super().clean()
@@ -239,8 +300,8 @@ class TaxCalculatorForm(forms.Form):
         # Date range validation
         if last_paid and next_payment:
             try:
-                last_paid_parsed = parse_nepali_date(last_paid)
-                next_payment_parsed = parse_nepali_date(next_payment)
+                last_paid_parsed = self.lookups.parse_date(last_paid)
+                next_payment_parsed = self.lookups.parse_date(next_payment)
 
                 if last_paid_parsed and next_payment_parsed:
                     if last_paid >= next_payment:
@@ -249,8 +310,7 @@ class TaxCalculatorForm(forms.Form):
                         })
 
                     # Check if the date range is reasonable (not more than 10 years)
-                    days_diff = (next_payment_parsed.to_datetime_date() -
-                                 last_paid_parsed.to_datetime_date()).days
+                    days_diff = self.lookups.days_between(last_paid, next_payment)
 
                     if days_diff > 365 * 10:  # 10 years
                         raise ValidationError(
@@ -269,15 +329,7 @@ class TaxCalculatorForm(forms.Form):
         # Registration type and category compatibility validation
         if reg_type and category:
             # Check if there are any tax rates defined for this combination
-            from .models import TaxRate
-
-            # Check if we have tax rates for this reg_type and category
-            tax_rates_exist = TaxRate.objects.filter(
-                reg_type=reg_type,
-                category=category
-            ).exists()
-
-            if not tax_rates_exist:
+            if not self.lookups.has_tax_rates(reg_type, category):
                 raise ValidationError(
                     f'No tax rates are configured for {reg_type.name} vehicles '
                     f'in {category.name} category. Please contact administrator.'
@@ -285,41 +337,37 @@ class TaxCalculatorForm(forms.Form):
 
         return cleaned_data
 
+    def _cc_range(self):
+        return self.lookups.cc_range(self.cleaned_data['category'], self.cleaned_data.get('cc_power'))
+
+    def _fiscal_years(self):
+        return self.lookups.fiscal_years(self.cleaned_data['last_paid_date'],
+                                         self.cleaned_data['next_payment_date'])
+
     def get_cc_range(self):
         """Get CC range for selected category and power"""
         if self.is_valid():
-            category = self.cleaned_data.get('category')
-            cc_power = self.cleaned_data.get('cc_power')
-
-            if category and category.has_cc_range and cc_power:
-                return find_cc_range_for_power(category, cc_power)
+            return self._cc_range()
         return None
 
     def get_applicable_fiscal_years(self):
         """Get fiscal years that will be affected by this calculation"""
         if self.is_valid():
-            from .helper import get_fiscal_years_in_range
-
-            last_paid = parse_nepali_date(self.cleaned_data.get('last_paid_date'))
-            next_payment = parse_nepali_date(self.cleaned_data.get('next_payment_date'))
-
-            if last_paid and next_payment:
-                return get_fiscal_years_in_range(last_paid, next_payment)
+            return self._fiscal_years()
         return []
 
     def get_calculation_summary(self):
         """Get a summary of what will be calculated"""
         if self.is_valid():
             data = self.cleaned_data
+            cc_range = self._cc_range()
             summary = {
                 'reg_type': data['reg_type'].name,
                 'category': data['category'].name,
                 'cc_power': data.get('cc_power'),
-                'cc_range': str(self.get_cc_range()) if self.get_cc_range() else None,
+                'cc_range': str(cc_range) if cc_range else None,
                 'date_range': f"{data['last_paid_date']} to {data['next_payment_date']}",
-                'fiscal_years': [fy.name for fy in self.get_applicable_fiscal_years()],
-                'needs_income_tax': data['reg_type'].needs_income_tax,
-                'tax_type': data['reg_type'].tax_type
+                'fiscal_years': [fy.name for fy in self._fiscal_years()],
             }
             return summary
         return None
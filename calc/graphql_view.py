@@ -0,0 +1,212 @@
+import json
+import time
+from inspect import isawaitable
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, specified_rules
+from graphql.type import validate_schema
+
+from .documents import get_document_cache, get_registry
+from .metrics import GRAPHQL_OPERATION_SECONDS
+from .query_cost import QueryCostRule
+from .timing import stage
+
+# Request attribute marking a response that may be cached by browsers and CDNs
+CACHEABLE_ATTRIBUTE = '_graphql_cacheable'
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_GRAPHQL', {}).get(key, default)
+
+
+class AsyncGraphQLView(GraphQLView):
+    """
+    GraphQLView running graphql-core's async executor.
+
+    Resolvers may be coroutines (the calc schema's use the async ORM), and
+    are awaited concurrently within a request. Under ASGI a request no
+    longer ties up a worker thread while it waits on the database; under
+    WSGI Django runs the view in a per-request event loop, so the same
+    view serves both. Batched requests and GraphiQL behave as in the
+    parent class.
+
+    Queries may also be sent by persisted id (``?id=<sha256>``, or Apollo's
+    ``extensions.persistedQuery.sha256Hash``) instead of text; successful
+    GET responses for those carry Cache-Control so CDNs can serve them.
+    Query documents are parsed and validated once and kept in an LRU.
+    Validation includes QueryCostRule, so over-budget queries are refused
+    before any resolver runs.
+    """
+
+    view_is_async = True
+    validation_rules = (*specified_rules, QueryCostRule)
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(["GET", "POST"], "GraphQL only supports GET and POST requests.")
+                )
+
+            data = self.parse_body(request)
+            show_graphiql = self.graphiql and self.can_display_graphiql(request, data)
+
+            if show_graphiql:
+                return self.render_graphiql(
+                    request,
+                    whatwg_fetch_version=self.whatwg_fetch_version,
+                    whatwg_fetch_sri=self.whatwg_fetch_sri,
+                    react_version=self.react_version,
+                    react_sri=self.react_sri,
+                    react_dom_sri=self.react_dom_sri,
+                    graphiql_version=self.graphiql_version,
+                    graphiql_sri=self.graphiql_sri,
+                    graphiql_css_sri=self.graphiql_css_sri,
+                    subscriptions_transport_ws_version=self.subscriptions_transport_ws_version,
+                    subscriptions_transport_ws_sri=self.subscriptions_transport_ws_sri,
+                    graphiql_plugin_explorer_version=self.graphiql_plugin_explorer_version,
+                    graphiql_plugin_explorer_sri=self.graphiql_plugin_explorer_sri,
+                    graphiql_plugin_explorer_css_sri=self.graphiql_plugin_explorer_css_sri,
+                    subscription_path=self.subscription_path,
+                    graphiql_header_editor_enabled=graphene_settings.GRAPHIQL_HEADER_EDITOR_ENABLED,
+                    graphiql_should_persist_headers=graphene_settings.GRAPHIQL_SHOULD_PERSIST_HEADERS,
+                    graphiql_input_value_deprecation=graphene_settings.GRAPHIQL_INPUT_VALUE_DEPRECATION,
+                )
+
+            if self.batch:
+                responses = [await self.get_response(request, entry) for entry in data]
+                result = "[{}]".format(",".join(response[0] for response in responses))
+                status_code = responses and max(response[1] for response in responses) or 200
+            else:
+                result, status_code = await self.get_response(request, data, show_graphiql)
+
+            response = HttpResponse(status=status_code, content=result, content_type="application/json")
+            if getattr(request, CACHEABLE_ATTRIBUTE, False) and not self.batch:
+                patch_cache_control(response, public=True, max_age=_config('CACHE_MAX_AGE', 300))
+                patch_vary_headers(response, ['Accept'])
+            return response
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(request, {"errors": [self.format_error(e)]})
+            return response
+
+    @staticmethod
+    def get_persisted_id(request, data, id):
+        """Persisted query id from ``id`` or Apollo's persistedQuery extension"""
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        if isinstance(extensions, dict) and isinstance(extensions.get("persistedQuery"), dict):
+            return extensions["persistedQuery"].get("sha256Hash")
+        return id
+
+    async def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        persisted = False
+        if not query:
+            query_id = self.get_persisted_id(request, data, id)
+            if query_id:
+                query = get_registry().get(str(query_id))
+                if query is None:
+                    result = self.json_encode(request, {"errors": [{"message": "PersistedQueryNotFound"}]})
+                    return result, 400
+                persisted = True
+        elif _config('PERSISTED_ONLY', False):
+            raise HttpError(HttpResponseBadRequest("Only persisted queries are accepted."))
+
+        execution_result = await self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                response["errors"] = [self.format_error(e) for e in execution_result.errors]
+
+            if execution_result.errors and any(not getattr(e, "path", None) for e in execution_result.errors):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            if persisted and request.method == "GET" and not execution_result.errors:
+                setattr(request, CACHEABLE_ATTRIBUTE, True)
+
+            with stage('render'):
+                result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    async def execute_graphql_request(self, request, data, query, variables, operation_name,
+                                      show_graphiql=False):
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        with stage('graphql_parse'):
+            cached = get_document_cache().get(schema, query, self.validation_rules,
+                                              graphene_settings.MAX_VALIDATION_ERRORS)
+        if cached.document is None:
+            return ExecutionResult(errors=list(cached.errors))
+        document = cached.document
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if operation_ast is not None and operation_ast.operation != OperationType.QUERY:
+            # The schema has no mutations; refuse rather than run them outside a transaction
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ["GET"], f"Can only perform a query operation, not {operation_ast.operation.value}."
+            ))
+
+        if cached.errors:
+            return ExecutionResult(data=None, errors=list(cached.errors))
+
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            started = time.perf_counter()
+            with stage('graphql_execute'):
+                result = execute(schema, document, **execute_options)
+                if isawaitable(result):
+                    result = await result
+            GRAPHQL_OPERATION_SECONDS.labels(
+                operation_ast.name.value if operation_ast is not None and operation_ast.name else 'anonymous',
+                'error' if result.errors else 'ok',
+            ).observe(time.perf_counter() - started)
+            return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
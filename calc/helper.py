@@ -1,11 +1,25 @@
 import decimal
+import logging
 
 import nepali_datetime
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 
-from .models import FiscalYear, TaxRate, IncomeTaxRate, CCRange
+from . import bscalendar
+from .metrics import HELPER_ERRORS
+from .penalties import CompiledSchedule, default_schedule, from_paisa, to_paisa
+from .models import FiscalYear
+from .ratebook import (CCRangeEntry, FiscalYearEntry, IncomeTaxRateEntry, TaxRateEntry,
+                       get_rate_book)
+
+logger = logging.getLogger(__name__)
+
+
+def _report_error(function: str, message: str, error: Exception) -> None:
+    """Log an exception a helper recovered from and count it per function"""
+    HELPER_ERRORS.labels(function).inc()
+    logger.warning("%s: %s", message, error)
 
 
 def validate_nepali_date(date_string: str) -> bool:
@@ -18,26 +32,29 @@ def validate_nepali_date(date_string: str) -> bool:
     Returns:
         bool: True if valid, False otherwise
     """
-    try:
-        if not date_string or len(date_string) != 10:
-            return False
+    return parse_nepali_ordinal(date_string) is not None
+
 
-        year, month, day = map(int, date_string.split('-'))
+def parse_nepali_ordinal(date_string: str) -> Optional[int]:
+    """
+    Parse Nepali date string to a day ordinal using the precomputed calendar table
 
-        # Validate ranges
-        if not (2070 <= year <= 2090):
-            return False
-        if not (1 <= month <= 12):
-            return False
-        if not (1 <= day <= 32):
-            return False
+    Args:
+        date_string: Date in YYYY-MM-DD format
+
+    Returns:
+        Gregorian day ordinal or None if invalid or outside the supported years
+    """
+    parts = bscalendar.split_date_string(date_string)
+    if parts is None:
+        return None
 
-        # Try to create actual nepali_datetime object
-        nepali_datetime.date(year, month, day)
-        return True
+    year, month, day = parts
+    if not (TAX_CALCULATION_CONSTANTS['MIN_NEPALI_YEAR'] <= year
+            <= TAX_CALCULATION_CONSTANTS['MAX_NEPALI_YEAR']):
+        return None
 
-    except (ValueError, TypeError):
-        return False
+    return bscalendar.to_ordinal(year, month, day)
 
 
 def parse_nepali_date(date_string: str) -> Optional[nepali_datetime.date]:
@@ -51,18 +68,17 @@ def parse_nepali_date(date_string: str) -> Optional[nepali_datetime.date]:
         nepali_datetime.date object or None if invalid
     """
     try:
-        if not validate_nepali_date(date_string):
+        if parse_nepali_ordinal(date_string) is None:
             return None
 
-        year, month, day = map(int, date_string.split('-'))
-        return nepali_datetime.date(year, month, day)
+        return nepali_datetime.date(*bscalendar.split_date_string(date_string))
 
     except Exception:
         return None
 
 
 def get_fiscal_years_in_range(start_date: nepali_datetime.date,
-                             end_date: nepali_datetime.date) -> List[FiscalYear]:
+                             end_date: nepali_datetime.date) -> List[FiscalYearEntry]:
     """
     Get all fiscal years that overlap with the given date range
 
@@ -71,29 +87,16 @@ def get_fiscal_years_in_range(start_date: nepali_datetime.date,
         end_date: End date in Nepali calendar
 
     Returns:
-        List of FiscalYear objects
+        List of FiscalYearEntry objects
     """
-    fiscal_years = []
-
     try:
-        all_fiscal_years = FiscalYear.objects.all().order_by('start_date')
-
-        for fy in all_fiscal_years:
-            # Parse fiscal year dates
-            fy_start = parse_nepali_date(str(fy.start_date))
-            fy_end = parse_nepali_date(str(fy.end_date))
-
-            if not fy_start or not fy_end:
-                continue
-
-            # Check if fiscal year overlaps with our date range
-            if (fy_start <= end_date and fy_end >= start_date):
-                fiscal_years.append(fy)
+        spans = get_rate_book().fiscal_index.overlapping(
+            bscalendar.date_ordinal(start_date), bscalendar.date_ordinal(end_date))
+        return [span.fiscal_year for span in spans]
 
     except Exception as e:
-        print(f"Error getting fiscal years: {e}")
-
-    return fiscal_years
+        _report_error("get_fiscal_years_in_range", "Error getting fiscal years", e)
+        return []
 
 
 def calculate_days_between_dates(start_date: nepali_datetime.date,
@@ -109,18 +112,14 @@ def calculate_days_between_dates(start_date: nepali_datetime.date,
         Number of days
     """
     try:
-        # Convert to English dates for calculation
-        start_eng = start_date.to_datetime_date()
-        end_eng = end_date.to_datetime_date()
-
-        delta = end_eng - start_eng
-        return delta.days
+        return bscalendar.date_ordinal(end_date) - bscalendar.date_ordinal(start_date)
 
     except Exception:
         return 0
 
 
-def get_applicable_tax_rate(reg_type, category, cc_range, fiscal_year) -> Optional[TaxRate]:
+def get_applicable_tax_rate(reg_type, category, cc_range, fiscal_year,
+                            province=None) -> Optional[TaxRateEntry]:
     """
     Find the applicable tax rate for given parameters
 
@@ -129,31 +128,20 @@ def get_applicable_tax_rate(reg_type, category, cc_range, fiscal_year) -> Option
         category: Category object
         cc_range: CCRange object or None
         fiscal_year: FiscalYear object
+        province: Province object or None to match any province
 
     Returns:
-        TaxRate object or None
+        TaxRateEntry or None
     """
     try:
-        query = TaxRate.objects.filter(
-            reg_type=reg_type,
-            category=category,
-            fiscal_year=fiscal_year,
-            tax_type=reg_type.tax_type
-        )
-
-        if cc_range:
-            query = query.filter(cc_range=cc_range)
-        else:
-            query = query.filter(cc_range__isnull=True)
-
-        return query.first()
+        return get_rate_book().tax_rate(reg_type, category, cc_range, fiscal_year, province)
 
     except Exception as e:
-        print(f"Error finding tax rate: {e}")
+        _report_error("get_applicable_tax_rate", "Error finding tax rate", e)
         return None
 
 
-def get_applicable_income_tax_rate(category, cc_range, fiscal_year) -> Optional[IncomeTaxRate]:
+def get_applicable_income_tax_rate(category, cc_range, fiscal_year) -> Optional[IncomeTaxRateEntry]:
     """
     Find the applicable income tax rate for given parameters
 
@@ -163,34 +151,20 @@ def get_applicable_income_tax_rate(category, cc_range, fiscal_year) -> Optional[
         fiscal_year: FiscalYear object
 
     Returns:
-        IncomeTaxRate object or None
+        IncomeTaxRateEntry or None
     """
     try:
-        query = IncomeTaxRate.objects.filter(
-            category=category,
-            fiscal_year=fiscal_year
-        )
-
-        if cc_range:
-            # First try to find CC range specific income tax
-            income_tax = query.filter(
-                cc_range=cc_range,
-                cc_range__for_income_tax=True
-            ).first()
-
-            if income_tax:
-                return income_tax
-
-        # Fall back to general income tax for category
-        return query.filter(cc_range__isnull=True).first()
+        # CC range specific income tax first, then the general category rate
+        return get_rate_book().income_tax_rate(category, cc_range, fiscal_year)
 
     except Exception as e:
-        print(f"Error finding income tax rate: {e}")
+        _report_error("get_applicable_income_tax_rate", "Error finding income tax rate", e)
         return None
 
 
 def calculate_penalty(tax_amount: Decimal, income_tax: Decimal,
-                     days_late: int, penalty_rules: Dict[str, Any] = None) -> Tuple[Decimal, str]:
+                      days_late: int, penalty_rules: Dict[str, Any] = None,
+                      schedule: Optional[CompiledSchedule] = None) -> Tuple[Decimal, str]:
     """
     Calculate penalty for late payment
 
@@ -198,7 +172,10 @@ def calculate_penalty(tax_amount: Decimal, income_tax: Decimal,
         tax_amount: Vehicle tax amount
         income_tax: Income tax amount
         days_late: Number of days past due
-        penalty_rules: Custom penalty calculation rules
+        penalty_rules: Custom monthly rule (rate_per_month, minimum_penalty, maximum_rate)
+        schedule: Compiled schedule to apply, e.g. from
+            get_rate_book().penalty_schedule(province, fiscal_year); defaults
+            to the built-in monthly rule
 
     Returns:
         Tuple of (penalty_amount, penalty_note)
@@ -207,60 +184,47 @@ def calculate_penalty(tax_amount: Decimal, income_tax: Decimal,
         return Decimal('0'), ''
 
     try:
-        # Default penalty rules (can be customized)
-        if not penalty_rules:
-            penalty_rules = {
-                'rate_per_month': Decimal('0.10'),  # 10% per month
-                'minimum_penalty': Decimal('50'),    # Minimum Rs. 50
-                'maximum_rate': Decimal('1.00'),     # Maximum 100% of tax
-            }
-
-        # Calculate monthly penalty
-        months_late = max(1, days_late // 30)  # At least 1 month
-        penalty_rate = penalty_rules['rate_per_month'] * months_late
-
-        # Cap at maximum rate
-        penalty_rate = min(penalty_rate, penalty_rules['maximum_rate'])
-
-        # Calculate penalty amount
-        taxable_amount = tax_amount + income_tax
-        penalty_amount = taxable_amount * penalty_rate
-
-        # Apply minimum penalty
-        penalty_amount = max(penalty_amount, penalty_rules['minimum_penalty'])
-
-        penalty_note = f"Late payment penalty: {penalty_rate*100:.1f}% ({months_late} month(s) late)"
-
-        return penalty_amount, penalty_note
+        if penalty_rules:
+            schedule = CompiledSchedule.monthly(penalty_rules['rate_per_month'],
+                                                penalty_rules['maximum_rate'],
+                                                penalty_rules['minimum_penalty'])
+        elif schedule is None:
+            schedule = default_schedule()
+
+        band = schedule.band(days_late)
+        penalty = band.penalty(to_paisa(tax_amount + income_tax)) if band else 0
+        if not penalty:
+            return Decimal('0'), ''
+        return from_paisa(penalty), band.note
 
     except Exception as e:
-        print(f"Error calculating penalty: {e}")
+        _report_error("calculate_penalty", "Error calculating penalty", e)
         return Decimal('0'), f'Penalty calculation error: {str(e)}'
 
 
-def find_cc_range_for_power(category, cc_power: Decimal) -> Optional[CCRange]:
+def find_cc_range_for_power(category, cc_power: Decimal, province=None, fiscal_year=None,
+                            reg_type=None) -> Optional[CCRangeEntry]:
     """
     Find the appropriate CC range for given category and power
 
     Args:
         category: Category object
         cc_power: Engine capacity or power value
+        province: Optional Province to narrow the search
+        fiscal_year: Optional FiscalYear to narrow the search
+        reg_type: Optional RegType to narrow the search
 
     Returns:
-        CCRange object or None
+        CCRangeEntry or None
     """
     try:
         if not category.has_cc_range or not cc_power:
             return None
 
-        return CCRange.objects.filter(
-            category=category,
-            from_cc__lte=cc_power,
-            to_cc__gte=cc_power
-        ).first()
+        return get_rate_book().find_cc_range(category, cc_power, province, fiscal_year, reg_type)
 
     except Exception as e:
-        print(f"Error finding CC range: {e}")
+        _report_error("find_cc_range_for_power", "Error finding CC range", e)
         return None
 
 
@@ -351,6 +315,61 @@ def validate_calculation_input(data: Dict[str, Any]) -> Tuple[bool, List[str]]:
         return False, [f"Validation error: {str(e)}"]
 
 
+def iter_calculation_summary(results: Dict[str, Any], generated_on=None) -> Iterator[str]:
+    """
+    Yield the lines of the text summary of the calculation results
+
+    Args:
+        results: Dictionary containing calculation results
+        generated_on: Date shown in the footer, defaults to today's Nepali date
+
+    Yields:
+        Summary lines without trailing newlines
+    """
+    # Header
+    yield "=== VEHICLE TAX CALCULATION SUMMARY ==="
+    yield ""
+
+    # Vehicle info
+    vehicle_info = results.get('vehicle_info', {})
+    yield "VEHICLE INFORMATION:"
+    yield f"Registration Type: {vehicle_info.get('reg_type', 'N/A')}"
+    yield f"Category: {vehicle_info.get('category', 'N/A')}"
+    if vehicle_info.get('cc_power'):
+        yield f"CC/Power: {vehicle_info.get('cc_power')} CC/KW"
+    if vehicle_info.get('cc_range'):
+        yield f"CC Range: {vehicle_info.get('cc_range')}"
+    yield ""
+
+    # Fiscal year details
+    fiscal_years = results.get('fiscal_years', [])
+    if fiscal_years:
+        yield "FISCAL YEAR BREAKDOWN:"
+        for fy in fiscal_years:
+            yield f"  {fy.get('fiscal_year', 'Unknown Year')}:"
+            yield f"    Vehicle Tax: {format_currency(Decimal(str(fy.get('tax_amount', 0))))}"
+            yield f"    Renewal Fee: {format_currency(Decimal(str(fy.get('renewal_fee', 0))))}"
+            yield f"    Income Tax: {format_currency(Decimal(str(fy.get('income_tax', 0))))}"
+            yield f"    Penalty: {format_currency(Decimal(str(fy.get('penalty', 0))))}"
+            if fy.get('case_note'):
+                yield f"    Note: {fy.get('case_note')}"
+            yield ""
+
+    # Totals
+    yield "TOTAL SUMMARY:"
+    yield f"Total Vehicle Tax: {format_currency(Decimal(str(results.get('total_tax', 0))))}"
+    yield f"Total Renewal Fee: {format_currency(Decimal(str(results.get('total_renewal_fee', 0))))}"
+    yield f"Total Income Tax: {format_currency(Decimal(str(results.get('total_income_tax', 0))))}"
+    yield f"Total Penalty: {format_currency(Decimal(str(results.get('total_penalty', 0))))}"
+    yield "-" * 40
+    yield f"GRAND TOTAL: {format_currency(Decimal(str(results.get('grand_total', 0))))}"
+
+    # Footer
+    yield ""
+    yield f"Generated on: {generated_on or get_current_nepali_date()}"
+    yield "Gandaki Province Vehicle Tax Calculator"
+
+
 def generate_calculation_summary(results: Dict[str, Any]) -> str:
     """
     Generate a text summary of the calculation results
@@ -362,52 +381,7 @@ def generate_calculation_summary(results: Dict[str, Any]) -> str:
         Formatted text summary
     """
     try:
-        summary_lines = []
-
-        # Header
-        summary_lines.append("=== VEHICLE TAX CALCULATION SUMMARY ===")
-        summary_lines.append("")
-
-        # Vehicle info
-        vehicle_info = results.get('vehicle_info', {})
-        summary_lines.append("VEHICLE INFORMATION:")
-        summary_lines.append(f"Registration Type: {vehicle_info.get('reg_type', 'N/A')}")
-        summary_lines.append(f"Category: {vehicle_info.get('category', 'N/A')}")
-        if vehicle_info.get('cc_power'):
-            summary_lines.append(f"CC/Power: {vehicle_info.get('cc_power')} CC/KW")
-        if vehicle_info.get('cc_range'):
-            summary_lines.append(f"CC Range: {vehicle_info.get('cc_range')}")
-        summary_lines.append("")
-
-        # Fiscal year details
-        fiscal_years = results.get('fiscal_years', [])
-        if fiscal_years:
-            summary_lines.append("FISCAL YEAR BREAKDOWN:")
-            for fy in fiscal_years:
-                summary_lines.append(f"  {fy.get('fiscal_year', 'Unknown Year')}:")
-                summary_lines.append(f"    Vehicle Tax: {format_currency(Decimal(str(fy.get('tax_amount', 0))))}")
-                summary_lines.append(f"    Renewal Fee: {format_currency(Decimal(str(fy.get('renewal_fee', 0))))}")
-                summary_lines.append(f"    Income Tax: {format_currency(Decimal(str(fy.get('income_tax', 0))))}")
-                summary_lines.append(f"    Penalty: {format_currency(Decimal(str(fy.get('penalty', 0))))}")
-                if fy.get('case_note'):
-                    summary_lines.append(f"    Note: {fy.get('case_note')}")
-                summary_lines.append("")
-
-        # Totals
-        summary_lines.append("TOTAL SUMMARY:")
-        summary_lines.append(f"Total Vehicle Tax: {format_currency(Decimal(str(results.get('total_tax', 0))))}")
-        summary_lines.append(f"Total Renewal Fee: {format_currency(Decimal(str(results.get('total_renewal_fee', 0))))}")
-        summary_lines.append(f"Total Income Tax: {format_currency(Decimal(str(results.get('total_income_tax', 0))))}")
-        summary_lines.append(f"Total Penalty: {format_currency(Decimal(str(results.get('total_penalty', 0))))}")
-        summary_lines.append("-" * 40)
-        summary_lines.append(f"GRAND TOTAL: {format_currency(Decimal(str(results.get('grand_total', 0))))}")
-
-        # Footer
-        summary_lines.append("")
-        summary_lines.append(f"Generated on: {get_current_nepali_date()}")
-        summary_lines.append("Gandaki Province Vehicle Tax Calculator")
-
-        return "\n".join(summary_lines)
+        return "\n".join(iter_calculation_summary(results))
 
     except Exception as e:
         return f"Error generating summary: {str(e)}"
@@ -417,41 +391,32 @@ def get_tax_calculation_context() -> Dict[str, Any]:
     """
     Get context data needed for tax calculation forms and display
 
+    reg_types, categories and fiscal_years are the immutable entries of the
+    reference registry (calc.reference) in display order, and
+    cc_ranges_data is the prebuilt context payload's grouping
+    (calc.context_payload). Both are built once per data version and
+    shared by every caller, so they must not be modified.
+
     Returns:
         Dictionary containing context data
     """
     try:
-        from .models import RegType, Category, FiscalYear
+        from .context_payload import get_context_payload
+        from .reference import get_reference
 
-        context = {
-            'reg_types': RegType.objects.all().order_by('name'),
-            'categories': Category.objects.all().order_by('name'),
-            'fiscal_years': FiscalYear.objects.all().order_by('-start_date'),
+        reference = get_reference()
+        payload = get_context_payload()
+        return {
+            'reg_types': reference.ordered('reg_types', 'name'),
+            'categories': reference.ordered('categories', 'name'),
+            'fiscal_years': reference.ordered('fiscal_years', 'start_date', reverse=True),
+            'cc_ranges_data': payload.data['cc_ranges_data'],
             'current_nepali_date': get_current_nepali_date(),
+            'context_etag': payload.etag,
         }
 
-        # Get CC ranges for categories
-        cc_ranges_data = {}
-        for category in context['categories']:
-            if category.has_cc_range:
-                ranges = CCRange.objects.filter(category=category).order_by('from_cc')
-                cc_ranges_data[str(category.id)] = [
-                    {
-                        'id': range_obj.id,
-                        'from_cc': float(range_obj.from_cc),
-                        'to_cc': float(range_obj.to_cc),
-                        'for_income_tax': range_obj.for_income_tax,
-                        'display': f"{range_obj.from_cc} - {range_obj.to_cc}"
-                    }
-                    for range_obj in ranges
-                ]
-
-        context['cc_ranges_data'] = cc_ranges_data
-
-        return context
-
     except Exception as e:
-        print(f"Error getting context: {e}")
+        _report_error("get_tax_calculation_context", "Error getting context", e)
         return {}
 
 
@@ -524,8 +489,8 @@ def export_calculation_results(results: Dict[str, Any], format_type: str = 'txt'
             return output.getvalue()
 
         elif format_type.lower() == 'json':
-            import json
-            return json.dumps(results, indent=2, default=str)
+            from .exporters import json_record
+            return json_record(results, indent=2)
 
         else:
             return generate_calculation_summary(results)
@@ -544,6 +509,7 @@ def validate_fiscal_year_data() -> Tuple[bool, List[str]]:
     errors = []
 
     try:
+        from .integrity import tax_rates_missing_cc_range
         from .models import FiscalYear, RegType, Category, TaxRate
 
         # Check if we have fiscal years
@@ -566,10 +532,10 @@ def validate_fiscal_year_data() -> Tuple[bool, List[str]]:
         if not tax_rates.exists():
             errors.append("No tax rates defined in database")
 
-        # Check for orphaned records
-        for tax_rate in TaxRate.objects.all():
-            if tax_rate.category.has_cc_range and not tax_rate.cc_range:
-                errors.append(f"Tax rate {tax_rate.id} missing CC range for category requiring it")
+        # Check for orphaned records; one query however many rates there are
+        missing = tax_rates_missing_cc_range()
+        if missing:
+            errors.append(str(missing))
 
         return len(errors) == 0, errors
 
@@ -598,7 +564,7 @@ def handle_calculation_errors(func):
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            print(f"Calculation error in {func.__name__}: {e}")
+            _report_error(func.__name__, f"Calculation error in {func.__name__}", e)
             return None
     return wrapper
 
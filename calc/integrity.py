@@ -0,0 +1,304 @@
+"""
+Rate table integrity analysis that scales to million-row tables
+
+Reference and coverage checks are single set-based queries (NOT EXISTS
+and joins) that return a count and a few sample rows, so nothing is
+loaded per row and no table is held in memory. CC range overlaps and
+gaps are found with one sweep over the ranges streamed in
+(key, from_cc) order, which the database sorts along the
+calc_ccrange_unique_bounds index: O(n log n) for the sort and O(n) for
+the sweep.
+"""
+import logging
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Q, QuerySet
+
+from .models import (Category, CCRange, FiscalYear, IncomeTaxRate, Province, RegRule, RegType,
+                     TaxRate)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 20
+
+RANGE_OVERLAP = 'overlap'
+RANGE_GAP = 'gap'
+RANGE_INVERTED = 'inverted'
+
+
+class Finding(NamedTuple):
+    """Result of one check: how many rows fail it and a few examples"""
+    check: str
+    count: int
+    message: str
+    samples: Tuple[str, ...] = ()
+
+    def __str__(self):
+        text = f"{self.message}: {self.count}"
+        if self.samples:
+            more = f", ... ({self.count - len(self.samples)} more)" if self.count > len(self.samples) else ''
+            text += f" ({'; '.join(self.samples)}{more})"
+        return text
+
+
+class RangeProblem(NamedTuple):
+    kind: str
+    key: Tuple[int, int, int, int, bool]
+    low: Decimal
+    high: Optional[Decimal]
+    range_ids: Tuple[int, ...]
+
+    def __str__(self):
+        province_id, fiscal_year_id, reg_type_id, category_id, for_income_tax = self.key
+        high = 'open' if self.high is None else self.high
+        scope = (f"province {province_id}, fiscal year {fiscal_year_id}, reg type {reg_type_id}, "
+                 f"category {category_id}{', income tax' if for_income_tax else ''}")
+        return f"{self.kind} {self.low}-{high} in {scope} (ranges {', '.join(map(str, self.range_ids))})"
+
+
+class IntegrityReport(NamedTuple):
+    findings: List[Finding]
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return not self.findings
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            'ok': self.ok,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'findings': [f._asdict() for f in self.findings],
+        }
+
+
+def _finding(check: str, message: str, queryset: QuerySet, describe: Callable = None,
+             sample_size: int = SAMPLE_SIZE) -> Optional[Finding]:
+    """Count a failing queryset and describe its first rows, or None when it is empty"""
+    count = queryset.count()
+    if not count:
+        return None
+    rows = queryset.order_by('pk')[:sample_size]
+    return Finding(check, count, message, tuple((describe or (lambda row: f"id {row.pk}"))(row) for row in rows))
+
+
+def _scoped(queryset: QuerySet, fiscal_years: Optional[Sequence[int]]) -> QuerySet:
+    return queryset if fiscal_years is None else queryset.filter(fiscal_year_id__in=fiscal_years)
+
+
+def _missing(model, field: str) -> Q:
+    """Rows whose foreign key points at no row of model"""
+    return ~Exists(model.objects.filter(pk=OuterRef(field)))
+
+
+def dangling_references(fiscal_years=None, sample_size=SAMPLE_SIZE) -> List[Finding]:
+    """
+    Rows referencing rows that do not exist
+
+    Foreign keys prevent these on a healthy database, but SQLite can have
+    enforcement off and raw imports bypass it.
+    """
+    checks = [
+        (TaxRate, 'Tax rates', (('category_id', Category), ('reg_type_id', RegType),
+                                ('province_id', Province), ('fiscal_year_id', FiscalYear),
+                                ('cc_range_id', CCRange))),
+        (IncomeTaxRate, 'Income tax rates', (('category_id', Category), ('reg_type_id', RegType),
+                                             ('fiscal_year_id', FiscalYear), ('cc_range_id', CCRange))),
+        (CCRange, 'CC ranges', (('category_id', Category), ('reg_type_id', RegType),
+                                ('province_id', Province), ('fiscal_year_id', FiscalYear))),
+        (RegRule, 'Registration rules', (('regtype_id', RegType), ('province_id', Province),
+                                         ('fiscal_year_id', FiscalYear))),
+    ]
+    findings = []
+    for model, label, references in checks:
+        for field, target in references:
+            condition = _missing(target, field)
+            if model._meta.get_field(field[:-3]).null:
+                condition &= Q(**{f'{field}__isnull': False})
+            finding = _finding(f'dangling_{model._meta.model_name}_{field[:-3]}',
+                               f"{label} referencing a missing {target._meta.verbose_name}",
+                               _scoped(model.objects.filter(condition), fiscal_years),
+                               sample_size=sample_size)
+            if finding:
+                findings.append(finding)
+    return findings
+
+
+def tax_rates_missing_cc_range(fiscal_years=None, sample_size=SAMPLE_SIZE) -> Optional[Finding]:
+    """Tax rates without a CC range for a category that is priced by range"""
+    return _finding('tax_rate_missing_cc_range', "Tax rates missing a CC range for a category requiring it",
+                    _scoped(TaxRate.objects.filter(category__has_cc_range=True, cc_range__isnull=True),
+                            fiscal_years),
+                    sample_size=sample_size)
+
+
+def inconsistent_references(fiscal_years=None, sample_size=SAMPLE_SIZE) -> List[Finding]:
+    """Rates whose CC range belongs to another category, province or registration type"""
+    findings = [
+        tax_rates_missing_cc_range(fiscal_years, sample_size),
+        _finding('tax_rate_unexpected_cc_range', "Tax rates with a CC range for a category without ranges",
+                 _scoped(TaxRate.objects.filter(category__has_cc_range=False, cc_range__isnull=False),
+                         fiscal_years),
+                 sample_size=sample_size),
+        _finding('tax_rate_foreign_cc_range',
+                 "Tax rates whose CC range is for another category, province or registration type",
+                 _scoped(TaxRate.objects.filter(cc_range__isnull=False).filter(
+                     ~Q(cc_range__category_id=F('category_id'))
+                     | ~Q(cc_range__province_id=F('province_id'))
+                     | ~Q(cc_range__reg_type_id=F('reg_type_id'))), fiscal_years),
+                 sample_size=sample_size),
+        _finding('income_tax_rate_foreign_cc_range',
+                 "Income tax rates whose CC range is for another category or registration type",
+                 _scoped(IncomeTaxRate.objects.filter(cc_range__isnull=False).filter(
+                     ~Q(cc_range__category_id=F('category_id'))
+                     | ~Q(cc_range__reg_type_id=F('reg_type_id'))), fiscal_years),
+                 sample_size=sample_size),
+    ]
+    return [finding for finding in findings if finding]
+
+
+def missing_coverage(fiscal_years=None, sample_size=SAMPLE_SIZE) -> List[Finding]:
+    """
+    Rate data that quoting cannot reach or needs but lacks
+
+    - CC ranges no rate uses: unpriced ranges make quotes fail for powers
+      inside them
+    - fiscal years without tax rates between the first and last fiscal year
+      a (province, registration type, category) has rates for
+    """
+    findings = [
+        _finding('cc_range_without_rates', "CC ranges no tax or income tax rate uses",
+                 _scoped(CCRange.objects.filter(
+                     ~Exists(TaxRate.objects.filter(cc_range_id=OuterRef('pk'))),
+                     ~Exists(IncomeTaxRate.objects.filter(cc_range_id=OuterRef('pk')))), fiscal_years),
+                 describe=lambda r: f"id {r.pk} ({r.from_cc}-{r.to_cc or 'open'})",
+                 sample_size=sample_size),
+    ]
+
+    quote = connection.ops.quote_name
+    tax_rate, fiscal_year = quote(TaxRate._meta.db_table), quote(FiscalYear._meta.db_table)
+    scope, params = '', []
+    if fiscal_years is not None:
+        if not fiscal_years:
+            return [finding for finding in findings if finding]
+        scope = f"AND fy.id IN ({', '.join(['%s'] * len(fiscal_years))})"
+        params = list(fiscal_years)
+    holes = f"""
+        FROM (SELECT t.province_id, t.reg_type_id, t.category_id,
+                     MIN(f.start_date) AS first_start, MAX(f.start_date) AS last_start
+              FROM {tax_rate} t JOIN {fiscal_year} f ON f.id = t.fiscal_year_id
+              GROUP BY t.province_id, t.reg_type_id, t.category_id) c
+        JOIN {fiscal_year} fy ON fy.start_date BETWEEN c.first_start AND c.last_start {scope}
+        WHERE NOT EXISTS (SELECT 1 FROM {tax_rate} t
+                          WHERE t.reg_type_id = c.reg_type_id AND t.category_id = c.category_id
+                            AND t.province_id = c.province_id AND t.fiscal_year_id = fy.id)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) {holes}", params)
+        count = cursor.fetchone()[0]
+        if count:
+            cursor.execute(f"SELECT c.province_id, fy.name_en, c.reg_type_id, c.category_id {holes} "
+                           f"ORDER BY c.province_id, fy.start_date, c.reg_type_id, c.category_id "
+                           f"LIMIT %s", params + [sample_size])
+            findings.append(Finding(
+                'fiscal_year_without_rates', count,
+                "Fiscal years without tax rates inside a rated span",
+                tuple(f"province {p}, {fy}, reg type {r}, category {c}" for p, fy, r, c in cursor.fetchall())))
+    return [finding for finding in findings if finding]
+
+
+def sweep_ranges(rows: Iterable[tuple]) -> Iterator[RangeProblem]:
+    """
+    Overlaps, gaps and inverted bounds in sorted CC range rows
+
+    Ranges are closed intervals that may share a boundary ("0-125" and
+    "125-150" touch, they do not overlap); a to_cc of 0 is open-ended. The
+    sweep keeps, per key, the range reaching furthest so far: a range
+    starting before that reach overlaps it, one starting after it leaves a
+    gap. Coverage is expected to start at 0.
+
+    Args:
+        rows: (province_id, fiscal_year_id, reg_type_id, category_id,
+            for_income_tax, id, from_cc, to_cc) tuples ordered by the first
+            five fields, then from_cc
+
+    Yields:
+        RangeProblem
+    """
+    key = None
+    reach, reach_id = None, None  # reach None: an open-ended range covers the rest
+    for province_id, fiscal_year_id, reg_type_id, category_id, for_income_tax, range_id, low, high in rows:
+        row_key = (province_id, fiscal_year_id, reg_type_id, category_id, bool(for_income_tax))
+        high = high or None
+        if high is not None and high < low:
+            yield RangeProblem(RANGE_INVERTED, row_key, low, high, (range_id,))
+            continue
+
+        if row_key != key:
+            if low > 0:
+                yield RangeProblem(RANGE_GAP, row_key, Decimal(0), low, (range_id,))
+            key, reach, reach_id = row_key, high, range_id
+            continue
+
+        if reach is None or low < reach:
+            overlap_high = reach if reach is not None and (high is None or high > reach) else high
+            yield RangeProblem(RANGE_OVERLAP, key, low, overlap_high, (reach_id, range_id))
+        elif low > reach:
+            yield RangeProblem(RANGE_GAP, key, reach, low, (reach_id, range_id))
+
+        if reach is not None and (high is None or high > reach):
+            reach, reach_id = high, range_id
+
+
+def range_problems(fiscal_years=None, chunk_size: int = 5000) -> Iterator[RangeProblem]:
+    """
+    Overlapping, gapped and inverted CC ranges per (province, fiscal year,
+    registration type, category), income tax ranges swept separately
+
+    Rows are streamed, so memory stays flat however large the table is.
+    """
+    queryset = _scoped(CCRange.objects.all(), fiscal_years).order_by(
+        'province_id', 'fiscal_year_id', 'reg_type_id', 'category_id', 'for_income_tax', 'from_cc', 'to_cc')
+    rows = queryset.values_list('province_id', 'fiscal_year_id', 'reg_type_id', 'category_id',
+                                'for_income_tax', 'id', 'from_cc', 'to_cc')
+    return sweep_ranges(rows.iterator(chunk_size=chunk_size))
+
+
+def range_findings(fiscal_years=None, sample_size=SAMPLE_SIZE) -> List[Finding]:
+    messages = {
+        RANGE_OVERLAP: "Overlapping CC ranges",
+        RANGE_GAP: "Gaps between CC ranges",
+        RANGE_INVERTED: "CC ranges ending before they start",
+    }
+    counts: Dict[str, int] = {}
+    samples: Dict[str, List[str]] = {}
+    for problem in range_problems(fiscal_years):
+        counts[problem.kind] = counts.get(problem.kind, 0) + 1
+        kind_samples = samples.setdefault(problem.kind, [])
+        if len(kind_samples) < sample_size:
+            kind_samples.append(str(problem))
+    return [Finding(f'cc_range_{kind}', counts[kind], message, tuple(samples[kind]))
+            for kind, message in messages.items() if kind in counts]
+
+
+def analyze(fiscal_years: Optional[Sequence[int]] = None, sample_size: int = SAMPLE_SIZE) -> IntegrityReport:
+    """
+    Run every integrity check
+
+    Args:
+        fiscal_years: FiscalYear ids to restrict row checks to, None for all
+        sample_size: Example rows kept per failing check
+
+    Returns:
+        IntegrityReport; ok when no check found anything
+    """
+    started = time.perf_counter()
+    findings: List[Finding] = []
+    for check in (dangling_references, inconsistent_references, missing_coverage, range_findings):
+        check_started = time.perf_counter()
+        findings.extend(check(fiscal_years, sample_size))
+        logger.debug("%s took %.3fs", check.__name__, time.perf_counter() - check_started)
+    return IntegrityReport(findings, time.perf_counter() - started)
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Resolution status codes, shared by scalar and vectorized lookups
+RANGE_HIT = 0
+RANGE_AMBIGUOUS = 1
+RANGE_GAP = 2
+
+RANGE_STATUS_NAMES = {
+    RANGE_HIT: 'hit',
+    RANGE_AMBIGUOUS: 'ambiguous',
+    RANGE_GAP: 'gap',
+}
+
+
+class RangeHit(NamedTuple):
+    status: int
+    cc_range: Optional[object]
+    candidates: Tuple[object, ...]
+
+    @property
+    def status_name(self) -> str:
+        return RANGE_STATUS_NAMES[self.status]
+
+
+def range_bounds(cc_range) -> Tuple[float, float]:
+    """
+    Closed [low, high] bounds of a CC range; a to_cc of 0 marks an open-ended
+    top range (e.g. "650 and above")
+    """
+    low = float(cc_range.from_cc)
+    high = float('inf') if not cc_range.to_cc else float(cc_range.to_cc)
+    return low, high
+
+
+class IntervalIndex:
+    """
+    Sorted interval index over the CC ranges of one lookup key.
+
+    All range endpoints are collected into a sorted array of breakpoints.
+    Each breakpoint and each open gap between two breakpoints forms a slot,
+    and the covering range count and winning range of every slot is
+    precomputed, so a lookup is one bisect plus two array reads. Building
+    the slot arrays takes O(n log n) time and O(n) memory for n ranges.
+
+    When several ranges cover a value (shared boundaries or overlapping
+    range sets) the one with the lowest from_cc wins, then the lowest id, so
+    "0-125" and "125-150" resolve 125 to the first range. Such hits are
+    reported as RANGE_AMBIGUOUS rather than silently picked.
+    """
+
+    def __init__(self, ranges: Sequence):
+        usable = []
+        for cc_range in ranges:
+            low, high = range_bounds(cc_range)
+            if high >= low:
+                usable.append(cc_range)
+        usable.sort(key=lambda r: (r.from_cc, r.id))
+        self.ranges = tuple(usable)
+
+        lows = np.array([range_bounds(r)[0] for r in usable], dtype=np.float64)
+        highs = np.array([range_bounds(r)[1] for r in usable], dtype=np.float64)
+        self._bounds = np.unique(np.concatenate([lows, highs[np.isfinite(highs)]]))
+        self._bounds_list = self._bounds.tolist()
+
+        if not usable:
+            self._count = np.zeros(1, dtype=np.int32)
+            self._slot_range = np.full(1, -1, dtype=np.int64)
+        else:
+            # Slot 2i is the gap before breakpoint i, slot 2i + 1 is the breakpoint
+            # itself; each range covers the contiguous slots from its low to its high
+            slots = 2 * len(self._bounds) + 1
+            first = 2 * np.searchsorted(self._bounds, lows) + 1
+            last = np.where(np.isfinite(highs), 2 * np.searchsorted(self._bounds, highs) + 1, slots - 1)
+
+            coverage = np.zeros(slots + 1, dtype=np.int32)
+            np.add.at(coverage, first, 1)
+            np.add.at(coverage, last + 1, -1)
+            self._count = np.cumsum(coverage[:-1]).astype(np.int32)
+
+            # Ranges are sorted by low, so those starting at or before a slot are
+            # a prefix; the winner is the first of them reaching the slot, which
+            # is where the running maximum of the last slots first reaches it
+            slot = np.arange(slots)
+            winner = np.searchsorted(np.maximum.accumulate(last), slot, side='left')
+            started = np.searchsorted(first, slot, side='right')
+            self._slot_range = np.where((self._count > 0) & (winner < started), winner, -1).astype(np.int64)
+
+        # Trailing -1 so that position -1 (no range) maps to id -1
+        self._ids = np.array([r.id for r in usable] + [-1], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def slot_table(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The precomputed lookup arrays: sorted breakpoints, covering range
+        count per slot and the position in ``ranges`` of each slot's winner
+        (-1 for none)
+        """
+        return self._bounds, self._count, self._slot_range
+
+    def _slot(self, value: float) -> int:
+        position = bisect_left(self._bounds_list, value)
+        if position < len(self._bounds_list) and self._bounds_list[position] == value:
+            return 2 * position + 1
+        return 2 * position
+
+    def resolve(self, value) -> RangeHit:
+        """
+        Resolve a single power value
+
+        Args:
+            value: Engine capacity or power value
+
+        Returns:
+            RangeHit with status, winning range and all covering ranges
+        """
+        if value is None or not self.ranges:
+            return RangeHit(RANGE_GAP, None, ())
+
+        value = float(value)
+        slot = self._slot(value)
+        count = int(self._count[slot])
+        if count == 0:
+            return RangeHit(RANGE_GAP, None, ())
+
+        winner = self.ranges[int(self._slot_range[slot])]
+        if count == 1:
+            return RangeHit(RANGE_HIT, winner, (winner,))
+
+        candidates = tuple(
+            r for r in self.ranges
+            if range_bounds(r)[0] <= value <= range_bounds(r)[1]
+        )
+        return RangeHit(RANGE_AMBIGUOUS, winner, candidates)
+
+    def resolve_many(self, values) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resolve an array of power values in one vectorized pass
+
+        Args:
+            values: Array-like of power values
+
+        Returns:
+            Tuple of (cc_range_ids, statuses); gaps carry id -1
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not self.ranges:
+            return (np.full(values.shape, -1, dtype=np.int64),
+                    np.full(values.shape, RANGE_GAP, dtype=np.int8))
+
+        bounds = self._bounds
+        positions = np.searchsorted(bounds, values, side='left')
+        exact = (positions < len(bounds)) & (bounds[np.minimum(positions, len(bounds) - 1)] == values)
+        slots = 2 * positions + exact
+
+        counts = self._count[slots]
+        ids = self._ids[self._slot_range[slots]]
+        statuses = np.where(counts == 0, RANGE_GAP,
+                            np.where(counts == 1, RANGE_HIT, RANGE_AMBIGUOUS)).astype(np.int8)
+
+        missing = np.isnan(values)
+        if missing.any():
+            ids[missing] = -1
+            statuses[missing] = RANGE_GAP
+        return ids, statuses
@@ -0,0 +1,94 @@
+"""
+Request-scoped lookups shared by the form, the calculator and the summary
+
+One submission asks the same questions several times: the form parses
+each date in three places, resolves the CC range while validating and
+again for the summary, and the summary and calculator both look up the
+fiscal years in the payment period. A LookupContext answers each question
+once and remembers the answer, and pins one rate book for the whole
+submission so every step sees the same rate data.
+"""
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import nepali_datetime
+
+from . import bscalendar
+from .helper import parse_nepali_ordinal
+from .intervals import IntervalIndex, RangeHit
+from .ratebook import CCRangeEntry, FiscalYearEntry, RateBook, _id, get_rate_book
+
+
+class LookupContext:
+    """
+    Memoized lookups for one submission
+
+    Args:
+        book: Rate book to answer from; the current one is taken on first use,
+            so creating a context (e.g. for an unbound form) costs nothing
+    """
+
+    def __init__(self, book: Optional[RateBook] = None):
+        self._book = book
+        self._memo: Dict[Hashable, Any] = {}
+
+    @property
+    def book(self) -> RateBook:
+        if self._book is None:
+            self._book = get_rate_book()
+        return self._book
+
+    def _once(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = compute()
+            return value
+
+    def ordinal(self, date_string: str) -> Optional[int]:
+        """Day ordinal of a BS date string in the supported years, or None"""
+        return self._once(('ordinal', date_string), lambda: parse_nepali_ordinal(date_string))
+
+    def parse_date(self, date_string: str) -> Optional[nepali_datetime.date]:
+        """nepali_datetime.date for a valid BS date string, or None"""
+        def parse():
+            if self.ordinal(date_string) is None:
+                return None
+            try:
+                return nepali_datetime.date(*bscalendar.split_date_string(date_string))
+            except Exception:
+                return None
+        return self._once(('date', date_string), parse)
+
+    def days_between(self, start: str, end: str) -> Optional[int]:
+        """Days from one BS date string to another, None if either is invalid"""
+        start_ordinal, end_ordinal = self.ordinal(start), self.ordinal(end)
+        if start_ordinal is None or end_ordinal is None:
+            return None
+        return end_ordinal - start_ordinal
+
+    def fiscal_years(self, start: str, end: str) -> List[FiscalYearEntry]:
+        """Fiscal years overlapping the period between two BS date strings"""
+        def overlapping():
+            start_ordinal, end_ordinal = self.ordinal(start), self.ordinal(end)
+            if start_ordinal is None or end_ordinal is None:
+                return []
+            return [span.fiscal_year for span in self.book.fiscal_index.overlapping(start_ordinal, end_ordinal)]
+        return self._once(('fiscal_years', start, end), overlapping)
+
+    def range_index(self, category) -> IntervalIndex:
+        """CC ranges of a category across provinces, fiscal years and reg types"""
+        return self._once(('range_index', _id(category)), lambda: self.book.range_index(category=category))
+
+    def resolve_power(self, category, cc_power) -> RangeHit:
+        """Where cc_power falls among the category's CC ranges"""
+        return self._once(('resolve', _id(category), cc_power),
+                          lambda: self.range_index(category).resolve(cc_power))
+
+    def cc_range(self, category, cc_power) -> Optional[CCRangeEntry]:
+        """CC range containing cc_power, or None"""
+        if not category.has_cc_range or not cc_power:
+            return None
+        return self.resolve_power(category, cc_power).cc_range
+
+    def has_tax_rates(self, reg_type, category) -> bool:
+        return self.book.has_tax_rates(reg_type, category)
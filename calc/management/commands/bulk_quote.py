@@ -0,0 +1,157 @@
+import csv
+import json
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from calc.exporters import FORMATS, iter_csv, iter_ndjson, json_record, txt_record
+from calc.helper import get_current_nepali_date
+
+_worker_book = None
+
+
+def _init_worker():
+    """Load the rate data once per worker process"""
+    global _worker_book
+    # Ctrl-C is handled by the parent, which lets in-flight chunks finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+    from calc.ratebook import RateBook
+    _worker_book = RateBook.load()
+    connections.close_all()
+
+
+def _quote_chunk(chunk, id_column):
+    """Quote one chunk of (row_number, row) pairs inside a worker"""
+    from calc.quoting import iter_quotes
+
+    records = list(iter_quotes((row for _, row in chunk), _worker_book,
+                               batch_size=len(chunk), id_key=id_column))
+    for (row_number, _), record in zip(chunk, records):
+        record['row'] = row_number
+    return records
+
+
+class ResultWriter:
+    """Appends quote records to an output file using the streaming exporters"""
+
+    def __init__(self, stream, format_type, first):
+        self.stream = stream
+        self.format_type = format_type
+        self.first = first
+        self.generated_on = get_current_nepali_date()
+
+    def begin(self):
+        if self.format_type == 'csv':
+            self.stream.write(next(iter_csv([])))
+        elif self.format_type == 'json':
+            self.stream.write('[')
+
+    def write(self, record):
+        if self.format_type == 'csv':
+            self.stream.writelines(iter_csv([record], header=False))
+        elif self.format_type == 'json':
+            self.stream.write(('\n' if self.first else ',\n') + json_record(record))
+        elif self.format_type == 'ndjson':
+            self.stream.writelines(iter_ndjson([record]))
+        else:
+            self.stream.writelines(txt_record(record, self.generated_on))
+        self.first = False
+
+    def end(self):
+        if self.format_type == 'json':
+            self.stream.write('\n]\n')
+
+
+class Command(BaseCommand):
+    help = ("Compute arrears for every vehicle in a CSV with a process pool, "
+            "streaming results to a txt/csv/json/ndjson file with resumable checkpoints")
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="CSV with province, reg_type, category, cc_power, "
+                                          "last_paid_date, next_payment_date[, is_public]")
+        parser.add_argument('output', help="Output file")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--id-column', default='vehicle_id',
+                            help="Input column copied to the output to identify vehicles")
+        parser.add_argument('--checkpoint', help="Checkpoint file (default: <output>.checkpoint)")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continue an interrupted run from its checkpoint")
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint'] or f"{options['output']}.checkpoint"
+        state = {'rows_done': 0, 'output_offset': 0, 'first': True}
+
+        if options['resume']:
+            if not os.path.exists(checkpoint_path):
+                raise CommandError(f"No checkpoint found at {checkpoint_path}")
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            if saved.get('input') != os.path.abspath(options['input']) or saved.get('format') != options['format']:
+                raise CommandError("Checkpoint belongs to a different input file or format")
+            state.update(saved)
+
+        # Forked workers must not inherit the parent's database connections
+        connections.close_all()
+
+        mode = 'r+' if options['resume'] else 'w'
+        with open(options['input'], newline='', encoding='utf-8') as source, \
+                open(options['output'], mode, newline='', encoding='utf-8') as output, \
+                ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            output.seek(state['output_offset'])
+            output.truncate()
+
+            writer = ResultWriter(output, options['format'], state['first'])
+            if not options['resume']:
+                writer.begin()
+
+            rows = enumerate(csv.DictReader(source), start=1)
+            rows = islice(rows, state['rows_done'], None)
+
+            # Keep a bounded window of chunks in flight so memory stays flat
+            pending = deque()
+            max_pending = options['workers'] * 2
+            while True:
+                while len(pending) < max_pending:
+                    chunk = list(islice(rows, options['chunk_size']))
+                    if not chunk:
+                        break
+                    pending.append(pool.submit(_quote_chunk, chunk, options['id_column']))
+                if not pending:
+                    break
+
+                for record in pending.popleft().result():
+                    writer.write(record)
+                    state['rows_done'] = record['row']
+                output.flush()
+                state['output_offset'] = output.tell()
+                state['first'] = writer.first
+                self._save_checkpoint(checkpoint_path, options, state)
+                self.stdout.write(f"{state['rows_done']} rows done", ending='\r')
+
+            writer.end()
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Quoted {state['rows_done']} rows into {options['output']}"))
+
+    @staticmethod
+    def _save_checkpoint(path, options, state):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(dict(state, input=os.path.abspath(options['input']),
+                           format=options['format']), f)
+        os.replace(temp_path, path)
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.integrity import SAMPLE_SIZE, analyze
+from calc.models import FiscalYear
+
+
+class Command(BaseCommand):
+    help = "Check rate tables for dangling references, missing coverage and overlapping or gapped CC ranges"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fiscal-year', action='append', dest='fiscal_years', metavar='NAME_EN',
+                            help="Only check this fiscal year (name_en, e.g. 081/82); repeatable")
+        parser.add_argument('--samples', type=int, default=SAMPLE_SIZE,
+                            help="Example rows shown per failing check")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        fiscal_years = None
+        if options['fiscal_years']:
+            found = dict(FiscalYear.objects.filter(name_en__in=options['fiscal_years']).values_list('name_en', 'id'))
+            unknown = sorted(set(options['fiscal_years']) - set(found))
+            if unknown:
+                raise CommandError(f"Unknown fiscal year(s): {', '.join(unknown)}")
+            fiscal_years = list(found.values())
+
+        report = analyze(fiscal_years, options['samples'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report.as_dict(), indent=2, default=str))
+        else:
+            for finding in report.findings:
+                self.stdout.write(self.style.WARNING(f"{finding.message}: {finding.count}"))
+                for sample in finding.samples:
+                    self.stdout.write(f"  {sample}")
+                if finding.count > len(finding.samples):
+                    self.stdout.write(f"  ... {finding.count - len(finding.samples)} more")
+
+        if not report.ok:
+            raise CommandError(f"{len(report.findings)} integrity check(s) failed in {report.elapsed:.2f}s")
+        if not options['json']:
+            self.stdout.write(self.style.SUCCESS(f"Rate tables are consistent ({report.elapsed:.2f}s)"))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.models import Province
+from calc.ratebook import RateBook
+from calc.signals import HANDLERS
+from calc.synthetic import PROFILES, clear_rate_tables, generate, write_vehicles_csv
+
+
+class Command(BaseCommand):
+    help = ("Generate a deterministic synthetic rate dataset (provinces, fiscal years, CC ranges, "
+            "tax and income tax rates) and optionally a matching vehicle CSV for bulk_quote")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=sorted(PROFILES), default='small',
+                            help="Preset sizes; the options below override single dimensions")
+        parser.add_argument('--provinces', type=int)
+        parser.add_argument('--fiscal-years', type=int)
+        parser.add_argument('--reg-types', type=int)
+        parser.add_argument('--categories', type=int)
+        parser.add_argument('--ranges', type=int, help="CC ranges per category")
+        parser.add_argument('--revise-every', type=int, help="Fiscal years between CC range revisions")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--clear', action='store_true', help="Delete all existing rate data first")
+        parser.add_argument('--vehicles', type=int, default=0, help="Number of vehicle rows to write")
+        parser.add_argument('--vehicles-csv', default='vehicles.csv', help="Vehicle CSV path")
+
+    def handle(self, *args, **options):
+        overrides = {field: options[field] for field in PROFILES[options['profile']]._fields
+                     if options.get(field) is not None}
+        scale = PROFILES[options['profile']]._replace(**overrides)
+
+        if options['clear']:
+            clear_rate_tables()
+        elif Province.objects.exists():
+            raise CommandError("The database already has rate data; use --clear to replace it")
+
+        started = time.perf_counter()
+        counts = generate(scale, seed=options['seed'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        for model, count in counts.items():
+            self.stdout.write(f"{model:<14} {count:>10}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {sum(counts.values())} rows in {elapsed:.1f}s ({scale})"))
+
+        if options['vehicles']:
+            with open(options['vehicles_csv'], 'w', encoding='utf-8', newline='') as f:
+                written = write_vehicles_csv(f, RateBook.load(), options['vehicles'], seed=options['seed'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} vehicles to {options['vehicles_csv']}"))
+
+        # Rows were inserted without signals; let the rate book and derived caches catch up
+        for _name, handler, _models in HANDLERS:
+            handler(sender=None)
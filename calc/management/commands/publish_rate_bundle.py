@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.bundle import BundleStore, EncodedBundle, build_bundle
+from calc.models import Province
+
+
+class Command(BaseCommand):
+    help = "Publish the current offline rate bundle of each province and prune old versions"
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'CALC_RATE_BUNDLE', {})
+        parser.add_argument('--province', type=int, action='append', dest='provinces',
+                            help="Province id to publish; repeatable (default: all)")
+        parser.add_argument('--output', help="Bundle directory (default: CALC_RATE_BUNDLE['DIR'])")
+        parser.add_argument('--keep', type=int, default=config.get('KEEP', 20),
+                            help="Versions kept per province")
+
+    def handle(self, *args, **options):
+        directory = options['output'] or getattr(settings, 'CALC_RATE_BUNDLE', {}).get('DIR')
+        if not directory:
+            raise CommandError("No bundle directory: pass --output or set CALC_RATE_BUNDLE['DIR']")
+        store = BundleStore(directory)
+
+        provinces = Province.objects.order_by('id')
+        if options['provinces']:
+            provinces = provinces.filter(id__in=options['provinces'])
+            missing = set(options['provinces']) - set(provinces.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown province(s): {', '.join(map(str, sorted(missing)))}")
+
+        for province in provinces:
+            bundle = EncodedBundle(build_bundle(province.id))
+            path = store.save(bundle)
+            pruned = store.prune(province.id, options['keep'])
+            rows = sum(len(table['rows']) for table in bundle.document['tables'].values())
+            self.stdout.write(f"{province.name_en:<20} {bundle.version} {rows:>9} rows "
+                              f"{len(bundle.body) / 1024:>9.1f} KiB json {len(bundle.gzipped) / 1024:>8.1f} KiB gzip"
+                              + (f", pruned {len(pruned)}" if pruned else ''))
+            self.stdout.write(f"  {path}")
+        self.stdout.write(self.style.SUCCESS(f"Published bundles to {directory}"))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.ratebook import RateBook
+from calc.ratecube import RateCube
+
+
+class Command(BaseCommand):
+    help = "Build the memory-mappable rate cube from the current rate tables and publish it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Cube file (default: CALC_RATE_CUBE['PATH'])")
+
+    def handle(self, *args, **options):
+        path = options['output'] or getattr(settings, 'CALC_RATE_CUBE', {}).get('PATH')
+        if not path:
+            raise CommandError("No cube file: pass --output or set CALC_RATE_CUBE['PATH']")
+
+        started = time.perf_counter()
+        cube = RateCube.build(RateBook.load())
+        built = time.perf_counter() - started
+        path = cube.write(path)
+
+        provinces, fiscal_years, reg_types, categories = cube.shape
+        self.stdout.write(f"{provinces} provinces x {fiscal_years} fiscal years x {reg_types} reg types "
+                          f"x {categories} categories, {len(cube.range_id)} CC ranges, "
+                          f"{len(cube.tax_key)} tax rates, {len(cube.income_key)} income tax rates")
+        self.stdout.write(f"{cube.nbytes / 1024:.1f} KiB of arrays, built in {built:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"Published rate cube {cube.fingerprint} to {path}"))
@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.documents import DEFAULT_REGISTRY_FILE, extract_queries, query_hash
+
+
+class Command(BaseCommand):
+    help = "Rebuild the persisted GraphQL query registry from the frontend's query definitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(Path(settings.BASE_DIR) / 'useri' / 'queries.js'),
+                            help="JavaScript file holding gql`...` documents")
+        parser.add_argument('--output', help="Registry file (default: CALC_GRAPHQL['PERSISTED_QUERIES_FILE'])")
+        parser.add_argument('--check', action='store_true',
+                            help="Exit with an error if the registry is out of date instead of writing it")
+
+    def handle(self, *args, **options):
+        output = Path(options['output'] or getattr(settings, 'CALC_GRAPHQL', {}).get(
+            'PERSISTED_QUERIES_FILE', DEFAULT_REGISTRY_FILE))
+        with open(options['source'], encoding='utf-8') as f:
+            queries = extract_queries(f.read())
+
+        registry = {query_hash(query): {'name': name, 'query': query} for name, query in queries}
+        text = json.dumps(registry, indent=2, sort_keys=True) + "\n"
+
+        if options['check']:
+            current = output.read_text(encoding='utf-8') if output.exists() else ''
+            if current != text:
+                raise CommandError(f"{output} is out of date; run sync_persisted_queries")
+            self.stdout.write(self.style.SUCCESS(f"{output} is up to date"))
+            return
+
+        output.write_text(text, encoding='utf-8')
+        for query_id, entry in sorted(registry.items(), key=lambda item: item[1]['name']):
+            self.stdout.write(f"{entry['name']:<20} {query_id}")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(registry)} persisted queries to {output}"))
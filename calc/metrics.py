@@ -0,0 +1,433 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Counters and histograms are updated without locks: every thread writes to
+its own shard and shards are only summed when the metrics are scraped. A
+lock is taken once per thread (to register its shard) and once per new
+label set, never per update. The shards of threads that have exited are
+merged into one set of totals and dropped, so short-lived threads do not
+accumulate.
+
+Each worker process keeps its own registry. With
+CALC_METRICS['MULTIPROCESS_DIR'] set, workers periodically write a
+snapshot to <dir>/metrics-<pid>.json and the /metrics/ endpoint sums the
+snapshots of all workers, so any worker can answer a scrape. Like
+prometheus_client's multiprocess mode, the directory should be emptied
+when the service is (re)started.
+"""
+import abc
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .timing import install_query_timer
+
+logger = logging.getLogger(__name__)
+
+# Seconds; request latencies from well under a millisecond to a slow export
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Label sets per metric before new ones are folded into "other"
+MAX_SERIES = 1000
+OVERFLOW_LABEL = 'other'
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_METRICS', {}).get(key, default)
+
+
+class _Child:
+    """A metric bound to one set of label values"""
+
+    __slots__ = ('registry', 'key')
+
+    def __init__(self, registry: 'Registry', key: tuple):
+        self.registry = registry
+        self.key = key
+
+
+class _CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1) -> None:
+        shard = self.registry.shard()
+        shard[self.key] = shard.get(self.key, 0) + amount
+
+
+class _HistogramChild(_Child):
+    __slots__ = ('buckets',)
+
+    def __init__(self, registry: 'Registry', key: tuple, buckets: Tuple[float, ...]):
+        super().__init__(registry, key)
+        self.buckets = buckets
+
+    def observe(self, value: float) -> None:
+        shard = self.registry.shard()
+        cells = shard.get(self.key)
+        if cells is None:
+            # One count per bucket plus +Inf, then sum and count
+            cells = shard[self.key] = [0] * (len(self.buckets) + 3)
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, registry: 'Registry', name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+
+class _ShardedMetric(Metric, abc.ABC):
+    """A metric whose values are updated through children in the per-thread shards"""
+
+    def __init__(self, registry: 'Registry', name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self._children: Dict[tuple, _Child] = {}
+        self._lock = threading.Lock()
+        super().__init__(registry, name, documentation, labelnames)
+
+    def labels(self, *values) -> _Child:
+        """The metric for one set of label values, in labelnames order"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._add_child(values)
+        return child
+
+    def _add_child(self, values: tuple) -> _Child:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                if len(self._children) >= MAX_SERIES:
+                    # Not cached, so unbounded label values cannot grow memory either
+                    return self._make_child((self.name, (OVERFLOW_LABEL,) * len(values)))
+                child = self._children[values] = self._make_child(
+                    (self.name, tuple(str(value) for value in values)))
+            return child
+
+    @abc.abstractmethod
+    def _make_child(self, key: tuple) -> _Child:
+        """A child updating the shard entry under key"""
+
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def _make_child(self, key):
+        return _CounterChild(self.registry, key)
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Histogram(_ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, documentation, labelnames)
+
+    def _make_child(self, key):
+        return _HistogramChild(self.registry, key, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+class CallbackCounter(Metric):
+    """
+    Counter read from existing statistics when the metrics are collected
+
+    Args:
+        callback: Returns {label values tuple: value}; errors are logged
+            and the metric is skipped for that scrape
+    """
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames, callback: Callable[[], Dict[tuple, float]]):
+        self.callback = callback
+        super().__init__(registry, name, documentation, labelnames)
+
+    def collect(self) -> Dict[tuple, float]:
+        try:
+            return {(self.name, tuple(str(v) for v in labels)): value
+                    for labels, value in self.callback().items()}
+        except Exception:
+            logger.exception("Collecting %s failed", self.name)
+            return {}
+
+
+class Registry:
+    """Metric definitions and the per-thread shards holding their values"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        # Values of threads that have exited, merged out of their shards
+        self._retired: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def shard(self) -> dict:
+        """The calling thread's shard, created on its first update"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_threads()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_dead_threads(self) -> None:
+        """Merge the shards of exited threads into the retired totals; call with the lock held"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            # The thread is gone, so nothing writes to its shard any more
+            for key, value in shard.items():
+                _add_value(self._retired, key, list(value) if isinstance(value, list) else value)
+        self._shards = live
+
+    def snapshot(self) -> Dict[tuple, object]:
+        """Current values of this process, summed over threads"""
+        with self._lock:
+            self._retire_dead_threads()
+            shards = [shard for _thread, shard in self._shards]
+            totals: Dict[tuple, object] = {key: list(value) if isinstance(value, list) else value
+                                           for key, value in self._retired.items()}
+        for shard in shards:
+            # dict.copy is atomic under the GIL; the owning thread may keep writing
+            for key, value in shard.copy().items():
+                _add_value(totals, key, list(value) if isinstance(value, list) else value)
+        for metric in self.metrics.values():
+            if isinstance(metric, CallbackCounter):
+                for key, value in metric.collect().items():
+                    _add_value(totals, key, value)
+        return totals
+
+    # Multi-process aggregation
+
+    def _snapshot_path(self, directory: Path) -> Path:
+        return directory / f"metrics-{os.getpid()}.json"
+
+    def flush(self) -> None:
+        """Write this process's snapshot for the other workers to read"""
+        directory = _config('MULTIPROCESS_DIR', None)
+        if not directory:
+            return
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = self._snapshot_path(directory)
+        samples = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(samples), encoding='utf-8')
+        os.replace(temporary, path)
+        self._flushed_at = time.monotonic()
+
+    def maybe_flush(self) -> None:
+        """Flush if FLUSH_INTERVAL seconds have passed since the last flush"""
+        if time.monotonic() - self._flushed_at >= _config('FLUSH_INTERVAL', 5):
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Writing the metrics snapshot failed")
+
+    def collect(self) -> Dict[tuple, object]:
+        """This process's live values plus the last snapshots of all other workers"""
+        totals = self.snapshot()
+        directory = _config('MULTIPROCESS_DIR', None)
+        if not directory:
+            return totals
+        own = self._snapshot_path(Path(directory))
+        for path in Path(directory).glob('metrics-*.json'):
+            if path == own:
+                continue
+            try:
+                samples = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable metrics snapshot %s", path)
+                continue
+            for name, labels, value in samples:
+                _add_value(totals, (name, tuple(labels)), value)
+        return totals
+
+    def exposition(self) -> str:
+        """All metrics in the Prometheus text format (version 0.0.4)"""
+        by_metric: Dict[str, List[Tuple[tuple, object]]] = {}
+        for (name, labels), value in self.collect().items():
+            by_metric.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_metric.get(name, ()), key=lambda item: item[0]):
+                pairs = list(zip(metric.labelnames, labels))
+                if isinstance(metric, Histogram):
+                    lines.extend(_histogram_lines(name, pairs, metric.buckets, value))
+                else:
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _add_value(totals: dict, key: tuple, value) -> None:
+    current = totals.get(key)
+    if current is None:
+        totals[key] = value
+    elif isinstance(current, list):
+        for i, cell in enumerate(value):
+            current[i] += cell
+    else:
+        totals[key] = current + value
+
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    rendered = ','.join(
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in pairs)
+    return '{' + rendered + '}' if rendered else ''
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name: str, pairs, buckets: Tuple[float, ...], cells: List[float]) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*buckets, float('inf')), cells):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(float(bound))
+        lines.append(f"{name}_bucket{_format_labels([*pairs, ('le', le)])} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(float(cells[-2]))}")
+    lines.append(f"{name}_count{_format_labels(pairs)} {cells[-1]}")
+    return lines
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+
+def _quote_cache_lookups():
+    from .quote_cache import get_quote_cache
+    quote_cache = get_quote_cache()
+    if quote_cache is None:
+        return {}
+    stats = quote_cache.stats()
+    return {('l1_hit',): stats['l1_hits'], ('l2_hit',): stats['l2_hits'], ('miss',): stats['misses']}
+
+
+def _quote_cache_evictions():
+    from .quote_cache import get_quote_cache
+    quote_cache = get_quote_cache()
+    return {(): quote_cache.stats()['evictions']} if quote_cache is not None else {}
+
+
+def _document_cache_lookups():
+    from .documents import get_document_cache
+    stats = get_document_cache().stats()
+    return {('hit',): stats['hits'], ('miss',): stats['misses']}
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    REGISTRY, 'calc_http_request_duration_seconds', "Request latency by URL route",
+    ('route', 'method', 'status'))
+GRAPHQL_OPERATION_SECONDS = Histogram(
+    REGISTRY, 'calc_graphql_operation_duration_seconds', "GraphQL execution time by operation",
+    ('operation', 'outcome'))
+QUOTES = Counter(
+    REGISTRY, 'calc_quotes_total', "Vehicles quoted by calc.quoting.quote_batch", ('outcome',))
+QUOTE_BATCH_SECONDS = Histogram(
+    REGISTRY, 'calc_quote_batch_duration_seconds', "Duration of quote_batch calls")
+HELPER_ERRORS = Counter(
+    REGISTRY, 'calc_helper_errors_total', "Exceptions caught in calc.helper functions", ('function',))
+DB_QUERIES = Counter(
+    REGISTRY, 'calc_db_queries_total', "SQL queries executed", ('alias',))
+DB_QUERY_SECONDS = Counter(
+    REGISTRY, 'calc_db_query_seconds_total', "Time spent executing SQL queries", ('alias',))
+QUOTE_CACHE_LOOKUPS = CallbackCounter(
+    REGISTRY, 'calc_quote_cache_lookups_total', "Quote cache lookups by result", ('result',),
+    _quote_cache_lookups)
+QUOTE_CACHE_EVICTIONS = CallbackCounter(
+    REGISTRY, 'calc_quote_cache_evictions_total', "Entries evicted from the L1 quote cache", (),
+    _quote_cache_evictions)
+DOCUMENT_CACHE_LOOKUPS = CallbackCounter(
+    REGISTRY, 'calc_graphql_document_cache_lookups_total', "Parsed GraphQL document cache lookups",
+    ('result',), _document_cache_lookups)
+
+
+def _count_query(alias: str, seconds: float) -> None:
+    DB_QUERIES.labels(alias).inc()
+    DB_QUERY_SECONDS.labels(alias).inc(seconds)
+
+
+class MetricsMiddleware:
+    """
+    Record request latency per URL route and count SQL queries
+
+    Routes are the URL patterns (e.g. "/export/<str:format_type>/"), so the
+    number of series stays bounded; unresolved paths are "unmatched".
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not _config('ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_query_timer(_count_query)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, seconds: float) -> None:
+        match = request.resolver_match
+        route = '/' + match.route if match is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(seconds)
+        REGISTRY.maybe_flush()
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:21
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+# Rows that must be unique per key once the constraints below are added
+UNIQUE_LOOKUPS = (
+    ('CCRange', ('category_id', 'province_id', 'fiscal_year_id', 'reg_type_id', 'from_cc', 'to_cc', 'for_income_tax')),
+    ('IncomeTaxRate', ('category_id', 'fiscal_year_id', 'cc_range_id')),
+    ('TaxRate', ('reg_type_id', 'category_id', 'province_id', 'fiscal_year_id', 'cc_range_id')),
+)
+MAX_REPORTED = 20
+
+
+def check_unique_lookups(apps, schema_editor):
+    """
+    Abort before adding the constraints if existing rows conflict
+
+    The conflicting rows have to be merged or removed by hand: which of them
+    holds the right rate is not something a migration can decide.
+    """
+    problems = []
+    for model_name, fields in UNIQUE_LOOKUPS:
+        model = apps.get_model('calc', model_name)
+        groups = defaultdict(list)
+        for row_id, *key in model.objects.order_by('id').values_list('id', *fields).iterator():
+            groups[tuple(key)].append(row_id)
+        conflicts = [(key, ids) for key, ids in groups.items() if len(ids) > 1]
+        for key, ids in conflicts[:MAX_REPORTED]:
+            problems.append(f"  {model_name} {dict(zip(fields, key))}: ids {ids}")
+        if len(conflicts) > MAX_REPORTED:
+            problems.append(f"  ... and {len(conflicts) - MAX_REPORTED} more {model_name} conflicts")
+    if problems:
+        raise RuntimeError("Rows conflict with the new unique constraints; resolve them and migrate again:\n"
+                           + "\n".join(problems))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calc', '0021_ccrange_reg_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_unique_lookups, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='taxrate',
+            index=models.Index(fields=['reg_type', 'category'], name='calc_taxrate_regtype_category'),
+        ),
+        migrations.AddConstraint(
+            model_name='ccrange',
+            constraint=models.UniqueConstraint(fields=('category', 'province', 'fiscal_year', 'reg_type', 'from_cc', 'to_cc', 'for_income_tax'), name='calc_ccrange_unique_bounds'),
+        ),
+        migrations.AddConstraint(
+            model_name='incometaxrate',
+            constraint=models.UniqueConstraint(condition=models.Q(('cc_range__isnull', False)), fields=('category', 'fiscal_year', 'cc_range'), name='calc_incometaxrate_unique_range'),
+        ),
+        migrations.AddConstraint(
+            model_name='incometaxrate',
+            constraint=models.UniqueConstraint(condition=models.Q(('cc_range__isnull', True)), fields=('category', 'fiscal_year'), name='calc_incometaxrate_unique_flat'),
+        ),
+        migrations.AddConstraint(
+            model_name='taxrate',
+            constraint=models.UniqueConstraint(condition=models.Q(('cc_range__isnull', False)), fields=('reg_type', 'category', 'province', 'fiscal_year', 'cc_range'), name='calc_taxrate_unique_range'),
+        ),
+        migrations.AddConstraint(
+            model_name='taxrate',
+            constraint=models.UniqueConstraint(condition=models.Q(('cc_range__isnull', True)), fields=('reg_type', 'category', 'province', 'fiscal_year'), name='calc_taxrate_unique_flat'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:49
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calc', '0022_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PenaltySchedule',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('minimum_penalty', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('fiscal_year', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='calc.fiscalyear')),
+                ('province', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='calc.province')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PenaltyTier',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('from_day', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='From days late')),
+                ('rate', models.DecimalField(decimal_places=4, help_text='Fraction of tax plus income tax, e.g. 0.1000 for 10%', max_digits=6)),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiers', to='calc.penaltyschedule')),
+            ],
+            options={
+                'ordering': ['schedule', 'from_day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='penaltyschedule',
+            constraint=models.UniqueConstraint(condition=models.Q(('fiscal_year__isnull', False), ('province__isnull', False)), fields=('province', 'fiscal_year'), name='calc_penaltyschedule_unique_scope'),
+        ),
+        migrations.AddConstraint(
+            model_name='penaltyschedule',
+            constraint=models.UniqueConstraint(condition=models.Q(('fiscal_year__isnull', True), ('province__isnull', False)), fields=('province',), name='calc_penaltyschedule_unique_province'),
+        ),
+        migrations.AddConstraint(
+            model_name='penaltyschedule',
+            constraint=models.UniqueConstraint(condition=models.Q(('fiscal_year__isnull', False), ('province__isnull', True)), fields=('fiscal_year',), name='calc_penaltyschedule_unique_fiscal_year'),
+        ),
+        migrations.AddConstraint(
+            model_name='penaltytier',
+            constraint=models.UniqueConstraint(fields=('schedule', 'from_day'), name='calc_penaltytier_unique_day'),
+        ),
+    ]
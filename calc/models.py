@@ -1,3 +1,4 @@
+from django.core.validators import MinValueValidator
 from django.db import models
 
 class Province(models.Model):
@@ -61,6 +62,14 @@ class CCRange(models.Model):
     province = models.ForeignKey(Province, on_delete=models.PROTECT)
     fiscal_year = models.ForeignKey('FiscalYear', on_delete=models.PROTECT)
 
+    class Meta:
+        constraints = [
+            # Also the lookup index: equality on the first four columns, from_cc/to_cc in range order
+            models.UniqueConstraint(
+                fields=['category', 'province', 'fiscal_year', 'reg_type', 'from_cc', 'to_cc', 'for_income_tax'],
+                name='calc_ccrange_unique_bounds',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.category.name} ({self.from_cc} - {self.to_cc})"
@@ -77,6 +86,26 @@ class TaxRate(models.Model):
     public_renewal = models.DecimalField(max_digits=10, decimal_places=2)
     province = models.ForeignKey(Province, on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [
+            # Covers "which categories have rates for this registration type"
+            models.Index(fields=['reg_type', 'category'], name='calc_taxrate_regtype_category'),
+        ]
+        constraints = [
+            # The lookup index. NULLs never collide in a unique index, so rates
+            # without a CC range get their own constraint.
+            models.UniqueConstraint(
+                fields=['reg_type', 'category', 'province', 'fiscal_year', 'cc_range'],
+                condition=models.Q(cc_range__isnull=False),
+                name='calc_taxrate_unique_range',
+            ),
+            models.UniqueConstraint(
+                fields=['reg_type', 'category', 'province', 'fiscal_year'],
+                condition=models.Q(cc_range__isnull=True),
+                name='calc_taxrate_unique_flat',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.category.name} ({self.fiscal_year} - {self.cc_range})"
 
@@ -89,5 +118,72 @@ class IncomeTaxRate(models.Model):
     fiscal_year = models.ForeignKey(FiscalYear, on_delete=models.CASCADE)
     income_tax = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        # Income tax is looked up by (category, fiscal_year, cc_range); the
+        # registration type does not take part, so it is not in the key
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'fiscal_year', 'cc_range'],
+                condition=models.Q(cc_range__isnull=False),
+                name='calc_incometaxrate_unique_range',
+            ),
+            models.UniqueConstraint(
+                fields=['category', 'fiscal_year'],
+                condition=models.Q(cc_range__isnull=True),
+                name='calc_incometaxrate_unique_flat',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.category.name} ({self.fiscal_year} - {self.cc_range})"
+
+
+class PenaltySchedule(models.Model):
+    """Tiered late payment penalty; a blank province or fiscal year applies to all of them"""
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    province = models.ForeignKey(Province, on_delete=models.PROTECT, blank=True, null=True)
+    fiscal_year = models.ForeignKey(FiscalYear, on_delete=models.PROTECT, blank=True, null=True)
+    minimum_penalty = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # One schedule per scope; NULLs never collide in a unique index. Of
+            # several catch-all schedules the rate book uses the lowest id.
+            models.UniqueConstraint(
+                fields=['province', 'fiscal_year'],
+                condition=models.Q(province__isnull=False, fiscal_year__isnull=False),
+                name='calc_penaltyschedule_unique_scope',
+            ),
+            models.UniqueConstraint(
+                fields=['province'],
+                condition=models.Q(province__isnull=False, fiscal_year__isnull=True),
+                name='calc_penaltyschedule_unique_province',
+            ),
+            models.UniqueConstraint(
+                fields=['fiscal_year'],
+                condition=models.Q(province__isnull=True, fiscal_year__isnull=False),
+                name='calc_penaltyschedule_unique_fiscal_year',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class PenaltyTier(models.Model):
+    id = models.AutoField(primary_key=True)
+    schedule = models.ForeignKey(PenaltySchedule, on_delete=models.CASCADE, related_name='tiers')
+    from_day = models.PositiveIntegerField(validators=[MinValueValidator(1)],
+                                           verbose_name="From days late")
+    rate = models.DecimalField(max_digits=6, decimal_places=4,
+                               help_text="Fraction of tax plus income tax, e.g. 0.1000 for 10%")
+
+    class Meta:
+        ordering = ['schedule', 'from_day']
+        constraints = [
+            models.UniqueConstraint(fields=['schedule', 'from_day'], name='calc_penaltytier_unique_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.schedule.name}: {self.rate * 100:.1f}% from day {self.from_day}"
@@ -0,0 +1,146 @@
+"""
+Late payment penalty schedules compiled into arrays indexed by days late
+
+A schedule is a list of tiers, each a rate that applies from a number of
+days late onwards, plus a minimum penalty. Compiling turns it into two
+small arrays: days late -> tier, and tier -> rate in basis points, so a
+whole batch of (days late, taxable amount) pairs is evaluated with a few
+NumPy operations. Amounts are integer paisa throughout.
+"""
+from decimal import Decimal, ROUND_CEILING, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+
+def to_paisa(amount) -> int:
+    """Convert a rupee amount to integer paisa"""
+    return int((Decimal(amount) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_paisa(paisa) -> Decimal:
+    """Convert integer paisa back to a two-place Decimal rupee amount"""
+    return Decimal(int(paisa)).scaleb(-2)
+
+
+def apply_rates(taxable: np.ndarray, rate_bp: np.ndarray,
+                minimum: Union[int, np.ndarray]) -> np.ndarray:
+    """
+    Penalties for taxable amounts at already resolved rates
+
+    Args:
+        taxable: int64 array of taxable amounts (tax plus income tax) in paisa
+        rate_bp: int64 array of penalty rates in basis points, 0 for none
+        minimum: Minimum penalty in paisa, a scalar or one per amount
+
+    Returns:
+        int64 array of penalties in paisa, rounded half up; 0 where the
+        rate or the taxable amount is 0
+    """
+    penalty = np.maximum((taxable * rate_bp + 5000) // 10000, minimum)
+    return np.where((rate_bp > 0) & (taxable > 0), penalty, 0)
+
+
+class PenaltyBand(NamedTuple):
+    """One compiled tier: the rate charged for a span of days late"""
+    tier: int
+    rate_bp: int
+    minimum: int
+    from_day: int
+    to_day: Optional[int]
+
+    @property
+    def note(self) -> str:
+        days = f"{self.from_day}-{self.to_day}" if self.to_day is not None else f"{self.from_day}+"
+        return f"Late payment penalty: {self.rate_bp / 100:.1f}% ({days} days late)"
+
+    def penalty(self, taxable: int) -> int:
+        """Penalty in paisa for one taxable amount in paisa"""
+        if not self.rate_bp or taxable <= 0:
+            return 0
+        return max((taxable * self.rate_bp + 5000) // 10000, self.minimum)
+
+
+class CompiledSchedule:
+    """
+    Penalty tiers compiled for lookup by days late
+
+    Args:
+        tiers: (from_day, rate) pairs; rate is a fraction of the taxable
+            amount (Decimal('0.10') for 10%) charged from from_day days late
+            until the next tier starts. Days before the first tier are free.
+        minimum_penalty: Rupee floor for any non-zero penalty
+        id: Primary key of the PenaltySchedule row, None for built-in ones
+        name: Display name
+    """
+
+    def __init__(self, tiers: Iterable[Tuple[int, Decimal]], minimum_penalty=Decimal('0'),
+                 id: Optional[int] = None, name: str = ''):
+        tiers = sorted((int(from_day), Decimal(rate)) for from_day, rate in tiers)
+        if any(from_day < 1 for from_day, _ in tiers):
+            raise ValueError("Penalty tiers must start at 1 day late or later")
+        if len({from_day for from_day, _ in tiers}) != len(tiers):
+            raise ValueError("Penalty tiers must start on different days")
+        self.id = id
+        self.name = name
+        self.minimum = to_paisa(minimum_penalty)
+        self.bands: List[Optional[PenaltyBand]] = [None]
+        for tier, (from_day, rate) in enumerate(tiers, 1):
+            to_day = tiers[tier][0] - 1 if tier < len(tiers) else None
+            rate_bp = int((rate * 10000).to_integral_value(rounding=ROUND_HALF_UP))
+            self.bands.append(PenaltyBand(tier, rate_bp, self.minimum, from_day, to_day))
+
+        # Days past the last tier's start all map to the last tier
+        self.last_day = tiers[-1][0] if tiers else 0
+        self.band_by_day = np.zeros(self.last_day + 1, dtype=np.int64)
+        for band in self.bands[1:]:
+            self.band_by_day[band.from_day:] = band.tier
+        self.rate_by_band = np.array([band.rate_bp if band else 0 for band in self.bands], dtype=np.int64)
+        self._band_by_day = self.band_by_day.tolist()
+
+    @classmethod
+    def monthly(cls, rate_per_month: Decimal, maximum_rate: Decimal, minimum_penalty: Decimal,
+                **kwargs) -> 'CompiledSchedule':
+        """
+        The classic rule as tiers: rate_per_month for every 30 days late
+        (at least one month), capped at maximum_rate
+        """
+        months = int((maximum_rate / rate_per_month).to_integral_value(rounding=ROUND_CEILING))
+        tiers = [(1 if month == 1 else 30 * month, min(rate_per_month * month, maximum_rate))
+                 for month in range(1, months + 1)]
+        return cls(tiers, minimum_penalty, **kwargs)
+
+    def band(self, days_late: int) -> Optional[PenaltyBand]:
+        """Tier charged at days_late, None when on time or in a free period"""
+        if days_late <= 0:
+            return None
+        return self.bands[self._band_by_day[min(days_late, self.last_day)]]
+
+    def evaluate(self, days_late: np.ndarray, taxable: np.ndarray) -> np.ndarray:
+        """
+        Penalties for many (days late, taxable amount) pairs in one pass
+
+        Args:
+            days_late: int array of days past the due date, <= 0 if on time
+            taxable: int64 array of taxable amounts in paisa
+
+        Returns:
+            int64 array of penalties in paisa
+        """
+        days = np.clip(np.asarray(days_late, dtype=np.int64), 0, self.last_day)
+        return apply_rates(np.asarray(taxable, dtype=np.int64),
+                           self.rate_by_band[self.band_by_day[days]], self.minimum)
+
+    def __repr__(self):
+        return f"<CompiledSchedule {self.name or self.id}: {len(self.bands) - 1} tiers>"
+
+
+@lru_cache(maxsize=None)
+def default_schedule() -> CompiledSchedule:
+    """Schedule used where none is configured, from TAX_CALCULATION_CONSTANTS"""
+    from .helper import TAX_CALCULATION_CONSTANTS
+    return CompiledSchedule.monthly(TAX_CALCULATION_CONSTANTS['DEFAULT_PENALTY_RATE'],
+                                    TAX_CALCULATION_CONSTANTS['MAXIMUM_PENALTY_RATE'],
+                                    TAX_CALCULATION_CONSTANTS['MINIMUM_PENALTY'],
+                                    name='default')
@@ -0,0 +1,148 @@
+from typing import Dict, List, NamedTuple, Sequence
+
+from django.core.exceptions import FieldDoesNotExist
+from graphene import Dynamic, List as ListType, NonNull
+from graphene.utils.str_converters import to_camel_case
+from graphene_django.types import DjangoObjectType
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+class Projection(NamedTuple):
+    columns: List[str]
+    select_related: List[str]
+    flat: bool
+
+
+class ProjectedObjectType(DjangoObjectType):
+    """
+    DjangoObjectType that can be fed rows from ``values_list(named=True)``
+    as well as model instances.
+
+    ``field_requirements`` names the model columns a computed field reads,
+    so projections include them.
+    """
+
+    field_requirements: Dict[str, Sequence[str]] = {}
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        # Named rows (see project()) stand in for instances of the model
+        if isinstance(root, tuple) and hasattr(root, '_fields'):
+            return True
+        return super().is_type_of(root, info)
+
+    def resolve_id(self, info):
+        return self.id
+
+
+def _unwrap(field):
+    if isinstance(field, Dynamic):
+        field = field.get_type()
+    graphene_type = field.type
+    while isinstance(graphene_type, (NonNull, ListType)):
+        graphene_type = graphene_type.of_type
+    return graphene_type
+
+
+def _selections(selection_set, fragments, into: Dict[str, list]):
+    """Collect field nodes by field name, expanding fragments"""
+    for selection in selection_set.selections if selection_set else ():
+        if isinstance(selection, FieldNode):
+            into.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            _selections(selection.selection_set, fragments, into)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                _selections(fragment.selection_set, fragments, into)
+    return into
+
+
+def _selected_fields(field_nodes, fragments) -> Dict[str, list]:
+    selected: Dict[str, list] = {}
+    for node in field_nodes:
+        _selections(node.selection_set, fragments, selected)
+    return selected
+
+
+def _collect(object_type, field_nodes, fragments, prefix: str, projection: Projection) -> None:
+    model = object_type._meta.model
+    graphql_names = {getattr(field, 'name', None) or to_camel_case(name): name
+                     for name, field in object_type._meta.fields.items()}
+    projection.columns.append(prefix + 'id')
+
+    for graphql_name, nodes in _selected_fields(field_nodes, fragments).items():
+        name = graphql_names.get(graphql_name)
+        if name is None:
+            continue
+        for required in object_type.field_requirements.get(name, ()):
+            projection.columns.append(prefix + required)
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.concrete:
+            continue
+        if model_field.many_to_one or model_field.one_to_one:
+            related_type = _unwrap(object_type._meta.fields[name])
+            projection.columns.append(prefix + model_field.attname)
+            if hasattr(related_type, '_meta') and getattr(related_type._meta, 'model', None):
+                projection.select_related.append(prefix + name)
+                _collect(related_type, nodes, fragments, f"{prefix}{name}__", projection)
+        else:
+            projection.columns.append(prefix + model_field.attname)
+
+
+def projection_for(info, object_type) -> Projection:
+    """
+    Work out which columns and relations the current field's selection needs
+
+    Args:
+        info: GraphQL resolve info of a field returning object_type
+        object_type: ProjectedObjectType the rows are resolved as
+
+    Returns:
+        Projection with the columns to load, the relations to join, and
+        whether plain rows (no relations) are enough
+    """
+    projection = Projection([], [], False)
+    _collect(object_type, info.field_nodes, info.fragments, '', projection)
+    columns = list(dict.fromkeys(projection.columns))
+    return Projection(columns, projection.select_related, not projection.select_related)
+
+
+def project(queryset, info, object_type, extra: Sequence[str] = ()):
+    """
+    Restrict a queryset to what the query selects
+
+    Selections that touch only the model's own columns come back as named
+    rows without instantiating models; selections that follow foreign keys
+    load instances with ``select_related`` and ``only``.
+
+    Args:
+        queryset: Base queryset of object_type's model
+        info: GraphQL resolve info
+        object_type: ProjectedObjectType the rows are resolved as
+        extra: Additional columns or annotations to keep
+
+    Returns:
+        Projected queryset
+    """
+    projection = projection_for(info, object_type)
+    if projection.flat:
+        return queryset.values_list(*projection.columns, *extra, named=True)
+    return queryset.select_related(*projection.select_related).only(*projection.columns)
+
+
+async def fetch_projected(queryset, info, object_type, extra: Sequence[str] = ()) -> list:
+    """Evaluate project(...) with the async ORM"""
+    return [row async for row in project(queryset, info, object_type, extra)]
+
+
+def projection_key(info, object_type) -> tuple:
+    """Hashable identity of a projection, for keying per-request loaders"""
+    projection = projection_for(info, object_type)
+    return tuple(projection.columns), tuple(projection.select_related)
@@ -0,0 +1,201 @@
+from typing import Any, Dict, Optional, Set, Tuple
+
+from django.conf import settings
+from graphql import (GraphQLError, GraphQLList, GraphQLNonNull, GraphQLObjectType, GraphQLResolveInfo,
+                     TypeInfo, ValidationContext, ValidationRule, get_named_type)
+from graphql.language import (DocumentNode, FieldNode, FragmentSpreadNode, InlineFragmentNode, ListValueNode,
+                              OperationDefinitionNode, SelectionSetNode, VariableNode)
+
+DEFAULTS = {
+    'MAX_COST': 5000,
+    'MAX_DEPTH': 6,
+    # Weight of a field returning an object; scalar fields default to 0
+    'DEFAULT_FIELD_COST': 1,
+    # Rows assumed for a list field without a configured size
+    'DEFAULT_LIST_SIZE': 20,
+    # "Type.field" -> weight per returned item
+    'FIELD_COSTS': {
+        'Query.taxQuotes': 2,
+        'Query.ccRangeForPower': 2,
+    },
+    # "Type.field" -> expected number of items
+    'LIST_SIZES': {
+        'Query.provinces': 10,
+        'Query.regTypes': 10,
+        'Query.fiscalYears': 20,
+        'Query.categories': 30,
+        'Query.ccRanges': 20,
+        'RegTypeType.categories': 30,
+        'QuoteResultType.fiscalYears': 10,
+        'Query.taxQuotes': 100,
+    },
+    # "Type.field" -> list argument whose length is the item count; when it is
+    # passed as a variable, the resolver re-checks the cost with enforce_cost
+    'SIZE_ARGUMENTS': {
+        'Query.taxQuotes': 'inputs',
+    },
+}
+
+
+def cost_settings() -> Dict[str, Any]:
+    """DEFAULTS overlaid with settings.CALC_GRAPHQL['COST']"""
+    configured = getattr(settings, 'CALC_GRAPHQL', {}).get('COST', {})
+    return {**DEFAULTS, **configured}
+
+
+def _rejection(cost: int, depth: int, config: Dict[str, Any], node) -> Optional[GraphQLError]:
+    """The QUERY_TOO_EXPENSIVE error for an over-budget operation, None within budget"""
+    max_cost, max_depth = config['MAX_COST'], config['MAX_DEPTH']
+    if cost <= max_cost and depth <= max_depth:
+        return None
+
+    problems = []
+    if cost > max_cost:
+        problems.append(f"cost {cost} exceeds the limit of {max_cost}")
+    if depth > max_depth:
+        problems.append(f"depth {depth} exceeds the limit of {max_depth}")
+    return GraphQLError(
+        f"Query rejected: {' and '.join(problems)}.",
+        node,
+        extensions={
+            'code': 'QUERY_TOO_EXPENSIVE',
+            'cost': cost,
+            'max_cost': max_cost,
+            'depth': depth,
+            'max_depth': max_depth,
+        },
+    )
+
+
+class QueryCostRule(ValidationRule):
+    """
+    Reject operations whose static cost or depth exceeds the budget.
+
+    The cost of a field is its weight plus the cost of its selections,
+    multiplied by the expected item count when the field returns a list,
+    so nested lists multiply. Item counts come from the length of a size
+    argument when there is one, otherwise from LIST_SIZES. The check runs
+    with the other validation rules, before any resolver, and the error's
+    extensions carry the computed cost and depth.
+    Introspection fields are free and do not count towards depth.
+
+    Validation is cached per query text, so a size argument passed as a
+    variable is estimated from LIST_SIZES there; resolvers taking such an
+    argument call enforce_cost, which runs the rule again with the
+    variable values.
+
+    Args:
+        variables: Variable values of the execution, if known
+    """
+
+    def __init__(self, context, variables: Optional[Dict[str, Any]] = None):
+        super().__init__(context)
+        self.config = cost_settings()
+        self.variables = variables
+
+    def enter_operation_definition(self, node: OperationDefinitionNode, *_args):
+        error = self.operation_error(node)
+        if error is not None:
+            self.report_error(error)
+
+    def operation_error(self, node: OperationDefinitionNode) -> Optional[GraphQLError]:
+        root_type = self.context.schema.get_root_type(node.operation)
+        if root_type is None:
+            return None
+        cost, depth = self.selection_cost(node.selection_set, root_type, 1, set())
+        return _rejection(cost, depth, self.config, node)
+
+    def selection_cost(self, selection_set: Optional[SelectionSetNode], parent_type, depth: int,
+                       fragments_seen: Set[str]) -> Tuple[int, int]:
+        """(cost, deepest field level) of a selection set"""
+        if selection_set is None:
+            return 0, depth - 1
+
+        total, deepest = 0, depth - 1
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                cost, field_depth = self.field_cost(selection, parent_type, depth, fragments_seen)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.context.schema.get_type(selection.type_condition.name.value)
+                cost, field_depth = self.selection_cost(selection.selection_set, fragment_type or parent_type,
+                                                        depth, fragments_seen)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.context.get_fragment(name)
+                if fragment is None or name in fragments_seen:
+                    continue
+                fragment_type = self.context.schema.get_type(fragment.type_condition.name.value)
+                cost, field_depth = self.selection_cost(fragment.selection_set, fragment_type or parent_type,
+                                                        depth, fragments_seen | {name})
+            else:
+                continue
+            total += cost
+            deepest = max(deepest, field_depth)
+        return total, deepest
+
+    def field_cost(self, node: FieldNode, parent_type, depth: int,
+                   fragments_seen: Set[str]) -> Tuple[int, int]:
+        name = node.name.value
+        if name.startswith('__') or not isinstance(parent_type, GraphQLObjectType):
+            return 0, depth - 1
+        field = parent_type.fields.get(name)
+        if field is None:
+            # Unknown fields are reported by the standard rules
+            return 0, depth
+
+        key = f"{parent_type.name}.{name}"
+        named_type = get_named_type(field.type)
+        default_weight = self.config['DEFAULT_FIELD_COST'] if isinstance(named_type, GraphQLObjectType) else 0
+        weight = self.config['FIELD_COSTS'].get(key, default_weight)
+
+        child_cost, deepest = self.selection_cost(node.selection_set, named_type, depth + 1, fragments_seen)
+        cost = weight + child_cost
+        if self.is_list(field.type):
+            cost *= self.list_size(node, key)
+        return cost, max(depth, deepest)
+
+    @staticmethod
+    def is_list(field_type) -> bool:
+        if isinstance(field_type, GraphQLNonNull):
+            field_type = field_type.of_type
+        return isinstance(field_type, GraphQLList)
+
+    def list_size(self, node: FieldNode, key: str) -> int:
+        argument_name = self.config['SIZE_ARGUMENTS'].get(key)
+        if argument_name:
+            for argument in node.arguments or ():
+                if argument.name.value != argument_name:
+                    continue
+                if isinstance(argument.value, ListValueNode):
+                    return max(1, len(argument.value.values))
+                if isinstance(argument.value, VariableNode) and self.variables is not None:
+                    value = self.variables.get(argument.value.name.value)
+                    if isinstance(value, (list, tuple)):
+                        return max(1, len(value))
+        return self.config['LIST_SIZES'].get(key, self.config['DEFAULT_LIST_SIZE'])
+
+
+def enforce_cost(info: GraphQLResolveInfo):
+    """
+    Re-check the operation's cost with the variable values of this execution
+
+    Called by resolvers whose size argument may arrive as a variable, so a
+    client cannot pass a long list under the LIST_SIZES estimate.
+
+    Raises:
+        GraphQLError: QUERY_TOO_EXPENSIVE when the operation is over budget
+    """
+    config = cost_settings()
+    key = f"{info.parent_type.name}.{info.field_name}"
+    argument_name = config['SIZE_ARGUMENTS'].get(key)
+    if not any(argument.name.value == argument_name and isinstance(argument.value, VariableNode)
+               for node in info.field_nodes for argument in node.arguments or ()):
+        # Literal lists were counted exactly during validation
+        return
+    document = DocumentNode(definitions=(info.operation, *info.fragments.values()))
+    context = ValidationContext(info.schema, document, TypeInfo(info.schema), lambda error: None)
+    error = QueryCostRule(context, variables=info.variable_values).operation_error(info.operation)
+    if error is not None:
+        raise error
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'calc:quote'
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_QUOTE_CACHE', {}).get(key, default)
+
+
+class QuoteCache:
+    """
+    Two-tier cache of computed quotes.
+
+    L1 is a per-process LRU dictionary; L2 is a Django cache backend shared
+    between workers. Keys are canonical quote shapes (see
+    calc.arrears.canonical_key) scoped by the rate book fingerprint, so an
+    entry can only ever be read back against the exact rate data it was
+    computed from. Rate changes therefore never need to find and delete
+    old L2 entries; they simply stop being addressed and expire.
+    """
+
+    def __init__(self, max_entries: int = 10000, timeout: Optional[int] = 3600,
+                 cache_alias: str = 'default'):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self._entries: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(fingerprint: str, canonical: Hashable) -> str:
+        digest = hashlib.blake2b(repr(canonical).encode(), digest_size=16).hexdigest()
+        return f"{KEY_PREFIX}:{fingerprint}:{digest}"
+
+    def _store_local(self, key: str, value: Any) -> None:
+        # Caller holds the lock
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, fingerprint: str, canonical_keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Look up quotes by canonical key, L1 first, then one L2 round trip
+
+        Args:
+            fingerprint: Fingerprint of the rate book the quotes belong to
+            canonical_keys: Canonical quote keys
+
+        Returns:
+            Dictionary of canonical key -> cached value for the hits
+        """
+        found: Dict[Hashable, Any] = {}
+        remote: Dict[str, Hashable] = {}
+        with self._lock:
+            for canonical in canonical_keys:
+                key = self.make_key(fingerprint, canonical)
+                value = self._entries.get(key)
+                if value is None:
+                    remote[key] = canonical
+                else:
+                    self._entries.move_to_end(key)
+                    found[canonical] = value
+                    self.l1_hits += 1
+
+        if not remote:
+            return found
+
+        try:
+            shared = caches[self.cache_alias].get_many(list(remote))
+        except Exception as e:
+            logger.warning("Quote cache read failed: %s", e)
+            shared = {}
+
+        with self._lock:
+            for key, canonical in remote.items():
+                value = shared.get(key)
+                if value is None:
+                    self.misses += 1
+                    continue
+                found[canonical] = value
+                self.l2_hits += 1
+                self._store_local(key, value)
+        return found
+
+    def set_many(self, fingerprint: str, values: Dict[Hashable, Any]) -> None:
+        """Store computed quotes in both tiers"""
+        if not values:
+            return
+        keyed = {self.make_key(fingerprint, canonical): value for canonical, value in values.items()}
+        with self._lock:
+            for key, value in keyed.items():
+                self._store_local(key, value)
+        try:
+            caches[self.cache_alias].set_many(keyed, timeout=self.timeout)
+        except Exception as e:
+            logger.warning("Quote cache write failed: %s", e)
+
+    def clear_local(self) -> None:
+        """Drop every L1 entry"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for this process since start-up"""
+        with self._lock:
+            lookups = self.l1_hits + self.l2_hits + self.misses
+            return {
+                'l1_hits': self.l1_hits,
+                'l2_hits': self.l2_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.l1_hits + self.l2_hits) / lookups, 4) if lookups else 0.0,
+                'l1_hit_ratio': round(self.l1_hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'l1_size': len(self._entries),
+                'l1_max_entries': self.max_entries,
+            }
+
+
+_quote_cache: Optional[QuoteCache] = None
+_quote_cache_lock = threading.Lock()
+
+
+def get_quote_cache() -> Optional[QuoteCache]:
+    """
+    Process-wide quote cache configured from settings.CALC_QUOTE_CACHE
+
+    Returns:
+        QuoteCache, or None when caching is disabled
+    """
+    global _quote_cache
+    if not _config('ENABLED', True):
+        return None
+    if _quote_cache is None:
+        with _quote_cache_lock:
+            if _quote_cache is None:
+                _quote_cache = QuoteCache(
+                    max_entries=_config('L1_MAX_ENTRIES', 10000),
+                    timeout=_config('TIMEOUT', 3600),
+                    cache_alias=_config('CACHE_ALIAS', 'default'),
+                )
+    return _quote_cache
+
+
+def invalidate_quotes(**kwargs):
+    """
+    Signal handler: drop this process's L1 entries when rate data changes
+
+    L2 entries are keyed by rate book fingerprint and are never served
+    against different rate data, so they are left to expire.
+    """
+    if _quote_cache is not None:
+        _quote_cache.clear_local()
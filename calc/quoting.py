@@ -0,0 +1,163 @@
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+
+from .arrears import ArrearsEngine, QuoteError, QuoteRequest
+from .metrics import QUOTE_BATCH_SECONDS, QUOTES
+from .quote_cache import get_quote_cache
+from .ratebook import RateBook, get_rate_book
+from .timing import stage
+
+MAX_BATCH_SIZE = 10000
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+def parse_quote_request(data: Mapping[str, Any]) -> QuoteRequest:
+    """
+    Build a QuoteRequest from loosely typed input (a CSV row or JSON object)
+
+    Raises:
+        QuoteError: If a required field is missing or malformed
+    """
+    try:
+        cc_power = str(data.get('cc_power') or '').strip()
+        is_public = data.get('is_public')
+        if not isinstance(is_public, bool):
+            is_public = str(is_public or '').strip().lower() in TRUE_VALUES
+        return QuoteRequest(
+            province=int(data['province']),
+            reg_type=int(data['reg_type']),
+            category=int(data['category']),
+            cc_power=Decimal(cc_power) if cc_power else None,
+            last_paid_date=str(data.get('last_paid_date') or '').strip(),
+            next_payment_date=str(data.get('next_payment_date') or '').strip(),
+            is_public=is_public,
+        )
+    except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+        raise QuoteError(f"Invalid row: {e}")
+
+
+def quote_batch(requests: Sequence[QuoteRequest], book: Optional[RateBook] = None,
+                use_cache: bool = True) -> List[Union[Dict[str, Any], QuoteError]]:
+    """
+    Compute arrears quotes for many vehicles in one pass
+
+    Batch layer over calc.arrears.ArrearsEngine: identical requests are
+    computed once, requests with the same canonical key share one
+    computation, canonical keys already in the quote cache skip rate lookups
+    and arithmetic entirely, and the money arithmetic for the rest runs as
+    a single set of integer (paisa) array operations.
+
+    Args:
+        requests: Sequence of QuoteRequest
+        book: Rate book to quote against, defaults to the current one
+        use_cache: Read and fill the two-tier quote cache
+
+    Returns:
+        List aligned with requests holding either a result dictionary in
+        the shape generate_calculation_summary expects, or a QuoteError
+    """
+    started = time.perf_counter()
+    engine = ArrearsEngine(book)
+    book = engine.book
+    cache = get_quote_cache() if use_cache else None
+
+    unique: Dict[QuoteRequest, int] = {}
+    order = [unique.setdefault(request, len(unique)) for request in requests]
+
+    groups: Dict[tuple, tuple] = {}
+    planned = []
+    for request in unique:
+        try:
+            key, info, spans = engine.plan(request)
+        except QuoteError as e:
+            # Drop the traceback so kept errors do not pin the frames (and batch) alive
+            planned.append(e.with_traceback(None))
+            continue
+        groups.setdefault(key, (info, request.is_public, spans))
+        planned.append((key, info, spans))
+
+    results: Dict[tuple, Union[Dict[str, Any], QuoteError]] = {}
+    if cache:
+        with stage('quote_cache'):
+            results = cache.get_many(book.fingerprint, groups)
+    # Missing rates are as deterministic as amounts, so they are cached too
+    priced, computed = engine.price_many({key: group for key, group in groups.items()
+                                          if key not in results})
+    if priced:
+        computed.update(zip(priced, engine.compute(list(priced.values()))))
+    if cache:
+        with stage('quote_cache'):
+            cache.set_many(book.fingerprint, computed)
+    results.update(computed)
+
+    unique_results = []
+    for request, plan in zip(unique, planned):
+        if isinstance(plan, QuoteError):
+            unique_results.append(plan)
+            continue
+        key, info, spans = plan
+        result = results[key]
+        unique_results.append(result if isinstance(result, QuoteError)
+                              else engine.finish(request, info, spans, result))
+
+    quoted = [unique_results[position] for position in order]
+    errors = sum(1 for result in quoted if isinstance(result, QuoteError))
+    QUOTES.labels('ok').inc(len(quoted) - errors)
+    QUOTES.labels('error').inc(errors)
+    QUOTE_BATCH_SECONDS.observe(time.perf_counter() - started)
+    return quoted
+
+
+def iter_quotes(rows: Iterable[Mapping[str, Any]], book: Optional[RateBook] = None,
+                batch_size: int = 1000, id_key: str = 'vehicle_id',
+                max_rows: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily quote an iterable of raw input rows, batch_size rows at a time
+
+    Args:
+        rows: Iterable of mappings accepted by parse_quote_request
+        book: Rate book to quote against, defaults to the current one
+        batch_size: Rows quoted per quote_batch call
+        id_key: Input key copied to each record as vehicle_id
+        max_rows: Rows quoted at most; the first row past the limit becomes
+            an error record and the rest of the input is not read
+
+    Yields:
+        Result dictionaries with 'row' and 'vehicle_id' added, or error
+        records of the form {'row', 'vehicle_id', 'error'}
+    """
+    book = book or get_rate_book()
+    numbered = enumerate(rows, start=1)
+    while True:
+        chunk = list(islice(numbered, batch_size))
+        if not chunk:
+            return
+        excess = None
+        if max_rows is not None and chunk[-1][0] > max_rows:
+            excess = next(item for item in chunk if item[0] > max_rows)
+            chunk = chunk[:max_rows - chunk[0][0] + 1]
+
+        parsed = []
+        for _, row in chunk:
+            try:
+                parsed.append(parse_quote_request(row))
+            except QuoteError as e:
+                parsed.append(e.with_traceback(None))
+        quoted = iter(quote_batch([p for p in parsed if not isinstance(p, QuoteError)], book))
+
+        for (row_number, row), request in zip(chunk, parsed):
+            result = request if isinstance(request, QuoteError) else next(quoted)
+            record = {'row': row_number, 'vehicle_id': row.get(id_key, '')}
+            if isinstance(result, QuoteError):
+                record['error'] = str(result)
+            else:
+                record.update(result)
+            yield record
+        if excess is not None:
+            row_number, row = excess
+            yield {'row': row_number, 'vehicle_id': row.get(id_key, ''),
+                   'error': f"At most {max_rows} rows are quoted per request; this and later rows were not"}
+            return
@@ -0,0 +1,529 @@
+import hashlib
+import logging
+import threading
+import time
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .fiscal import FiscalYearIndex
+from .intervals import IntervalIndex
+from .models import (Category, CCRange, FiscalYear, IncomeTaxRate, PenaltySchedule, PenaltyTier,
+                     Province, RegRule, RegType, TaxRate)
+from .penalties import CompiledSchedule, default_schedule
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CACHE_KEY = 'calc:ratebook:generation'
+
+
+class ProvinceEntry(NamedTuple):
+    id: int
+    name: str
+    name_en: str
+
+
+class RegTypeEntry(NamedTuple):
+    id: int
+    name: str
+    name_en: str
+
+    def __str__(self):
+        return self.name
+
+
+class CategoryEntry(NamedTuple):
+    id: int
+    name: str
+    name_en: str
+    has_cc_range: bool
+
+    def __str__(self):
+        return self.name
+
+
+class FiscalYearEntry(NamedTuple):
+    id: int
+    name: str
+    name_en: str
+    start_date: date
+    end_date: date
+    income_tax_due_date: date
+    vehicle_tax_due_date: date
+    previous_id: Optional[int]
+
+    def __str__(self):
+        return self.name
+
+
+class CCRangeEntry(NamedTuple):
+    id: int
+    province_id: int
+    fiscal_year_id: int
+    reg_type_id: int
+    category_id: int
+    from_cc: Decimal
+    to_cc: Decimal
+    for_income_tax: bool
+
+    def __str__(self):
+        return f"{self.from_cc} - {self.to_cc}"
+
+
+class TaxRateEntry(NamedTuple):
+    id: int
+    province_id: int
+    fiscal_year_id: int
+    reg_type_id: int
+    category_id: int
+    cc_range_id: Optional[int]
+    private_tax: Decimal
+    public_tax: Decimal
+    private_renewal: Decimal
+    public_renewal: Decimal
+
+
+class IncomeTaxRateEntry(NamedTuple):
+    id: int
+    reg_type_id: int
+    category_id: int
+    cc_range_id: Optional[int]
+    fiscal_year_id: int
+    income_tax: Decimal
+
+
+class RegRuleEntry(NamedTuple):
+    id: int
+    province_id: int
+    fiscal_year_id: int
+    regtype_id: int
+    tax_exempted: bool
+    renewal_exempted: bool
+    income_tax_exempted: bool
+
+
+class PenaltyScheduleEntry(NamedTuple):
+    id: int
+    name: str
+    province_id: Optional[int]
+    fiscal_year_id: Optional[int]
+    minimum_penalty: Decimal
+
+
+class PenaltyTierEntry(NamedTuple):
+    id: int
+    schedule_id: int
+    from_day: int
+    rate: Decimal
+
+
+def _id(obj) -> Optional[int]:
+    """Accept a model instance, a rate book entry or a raw primary key"""
+    if obj is None or isinstance(obj, int):
+        return obj
+    return obj.id
+
+
+def _fingerprint(*tables) -> str:
+    """Digest of the rate data, identical across processes holding the same rows"""
+    digest = hashlib.blake2b(digest_size=12)
+    for rows in tables:
+        digest.update(repr(sorted(rows, key=lambda row: row.id)).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+class RateBook:
+    """
+    Immutable, in-process snapshot of all rate tables.
+
+    Every lookup is a dict hit or a bisect over pre-sorted lists. A book is
+    never mutated after construction; new data produces a new book which
+    replaces the current one with a single reference assignment.
+    """
+
+    def __init__(self, provinces: List[ProvinceEntry], fiscal_years: List[FiscalYearEntry],
+                 cc_ranges: List[CCRangeEntry], tax_rates: List[TaxRateEntry],
+                 income_tax_rates: List[IncomeTaxRateEntry], reg_rules: List[RegRuleEntry],
+                 reg_types: List[RegTypeEntry] = (), categories: List[CategoryEntry] = (),
+                 penalty_schedules: List[PenaltyScheduleEntry] = (),
+                 penalty_tiers: List[PenaltyTierEntry] = (), generation: int = 0):
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.fingerprint = _fingerprint(provinces, fiscal_years, cc_ranges, tax_rates,
+                                        income_tax_rates, reg_rules, reg_types, categories,
+                                        penalty_schedules, penalty_tiers)
+
+        self.provinces: Dict[int, ProvinceEntry] = {p.id: p for p in provinces}
+        self.reg_types: Dict[int, RegTypeEntry] = {r.id: r for r in reg_types}
+        self.categories: Dict[int, CategoryEntry] = {c.id: c for c in categories}
+        self.fiscal_years: Dict[int, FiscalYearEntry] = {fy.id: fy for fy in fiscal_years}
+        self.cc_ranges: Dict[int, CCRangeEntry] = {r.id: r for r in cc_ranges}
+
+        self.fiscal_index = FiscalYearIndex(fiscal_years)
+
+        # CC ranges grouped by lookup key into interval indexes. Tax ranges and
+        # for_income_tax ranges of one key are separate series that may
+        # overlap each other, so the flag is part of the key.
+        grouped: Dict[Tuple[int, int, int, int, bool], List[CCRangeEntry]] = {}
+        for cc_range in cc_ranges:
+            key = (cc_range.province_id, cc_range.fiscal_year_id,
+                   cc_range.reg_type_id, cc_range.category_id, bool(cc_range.for_income_tax))
+            grouped.setdefault(key, []).append(cc_range)
+        self._range_indexes: Dict[Tuple[int, int, int, int, bool], IntervalIndex] = {
+            key: IntervalIndex(ranges) for key, ranges in grouped.items()
+        }
+        # Fiscal years that define ranges per (province, reg_type, category,
+        # for_income_tax), ordered by start date, so later years can inherit
+        # earlier ranges
+        self._range_years: Dict[Tuple[int, int, int, bool], List[Tuple[date, int]]] = {}
+        for province_id, fiscal_year_id, reg_type_id, category_id, for_income_tax in grouped:
+            fiscal_year = self.fiscal_years.get(fiscal_year_id)
+            if fiscal_year is not None:
+                self._range_years.setdefault((province_id, reg_type_id, category_id, for_income_tax), []).append(
+                    (fiscal_year.start_date, fiscal_year_id))
+        for years in self._range_years.values():
+            years.sort()
+        self._partial_indexes: Dict[Tuple, IntervalIndex] = {}
+        self._all_ranges = sorted(cc_ranges, key=lambda r: r.id)
+
+        # Lowest id wins on duplicates, mirroring ``.first()`` on the old queries
+        self._tax_rates: Dict[Tuple, TaxRateEntry] = {}
+        self._tax_rates_any_province: Dict[Tuple, TaxRateEntry] = {}
+        self._tax_rate_pairs = set()
+        for rate in sorted(tax_rates, key=lambda r: r.id):
+            self._tax_rates.setdefault(
+                (rate.province_id, rate.fiscal_year_id, rate.reg_type_id,
+                 rate.category_id, rate.cc_range_id), rate)
+            self._tax_rates_any_province.setdefault(
+                (rate.fiscal_year_id, rate.reg_type_id, rate.category_id, rate.cc_range_id), rate)
+            self._tax_rate_pairs.add((rate.reg_type_id, rate.category_id))
+
+        self._income_tax_rates: Dict[Tuple, IncomeTaxRateEntry] = {}
+        for rate in sorted(income_tax_rates, key=lambda r: r.id):
+            self._income_tax_rates.setdefault(
+                (rate.category_id, rate.fiscal_year_id, rate.cc_range_id), rate)
+
+        self._reg_rules: Dict[Tuple[int, int, int], RegRuleEntry] = {}
+        for rule in sorted(reg_rules, key=lambda r: r.id):
+            self._reg_rules.setdefault((rule.province_id, rule.fiscal_year_id, rule.regtype_id), rule)
+
+        # Penalty schedules compiled once, keyed by scope; None in a scope matches any value
+        tiers_by_schedule: Dict[int, List[Tuple[int, Decimal]]] = {}
+        for tier in penalty_tiers:
+            tiers_by_schedule.setdefault(tier.schedule_id, []).append((tier.from_day, tier.rate))
+        self._penalty_schedules: Dict[Tuple[Optional[int], Optional[int]], CompiledSchedule] = {}
+        for schedule in sorted(penalty_schedules, key=lambda s: s.id):
+            key = (schedule.province_id, schedule.fiscal_year_id)
+            if key not in self._penalty_schedules:
+                self._penalty_schedules[key] = CompiledSchedule(
+                    tiers_by_schedule.get(schedule.id, ()), schedule.minimum_penalty,
+                    id=schedule.id, name=schedule.name)
+
+    @classmethod
+    def load(cls, generation: int = 0) -> 'RateBook':
+        """
+        Build a rate book from the database using one query per table
+
+        Args:
+            generation: Shared change counter the snapshot corresponds to
+
+        Returns:
+            RateBook instance
+        """
+        return cls(
+            provinces=[ProvinceEntry(*row) for row in
+                       Province.objects.values_list('id', 'name', 'name_en')],
+            fiscal_years=[FiscalYearEntry(*row) for row in FiscalYear.objects.values_list(
+                'id', 'name', 'name_en', 'start_date', 'end_date',
+                'income_tax_due_date', 'vehicle_tax_due_date', 'previous_id')],
+            cc_ranges=[CCRangeEntry(*row) for row in CCRange.objects.values_list(
+                'id', 'province_id', 'fiscal_year_id', 'reg_type_id', 'category_id',
+                'from_cc', 'to_cc', 'for_income_tax')],
+            tax_rates=[TaxRateEntry(*row) for row in TaxRate.objects.values_list(
+                'id', 'province_id', 'fiscal_year_id', 'reg_type_id', 'category_id', 'cc_range_id',
+                'private_tax', 'public_tax', 'private_renewal', 'public_renewal')],
+            income_tax_rates=[IncomeTaxRateEntry(*row) for row in IncomeTaxRate.objects.values_list(
+                'id', 'reg_type_id', 'category_id', 'cc_range_id', 'fiscal_year_id', 'income_tax')],
+            reg_rules=[RegRuleEntry(*row) for row in RegRule.objects.values_list(
+                'id', 'province_id', 'fiscal_year_id', 'regtype_id',
+                'tax_exempted', 'renewal_exempted', 'income_tax_exempted')],
+            reg_types=[RegTypeEntry(*row) for row in
+                       RegType.objects.values_list('id', 'name', 'name_en')],
+            categories=[CategoryEntry(*row) for row in
+                        Category.objects.values_list('id', 'name', 'name_en', 'has_cc_range')],
+            penalty_schedules=[PenaltyScheduleEntry(*row) for row in PenaltySchedule.objects.values_list(
+                'id', 'name', 'province_id', 'fiscal_year_id', 'minimum_penalty')],
+            penalty_tiers=[PenaltyTierEntry(*row) for row in PenaltyTier.objects.values_list(
+                'id', 'schedule_id', 'from_day', 'rate')],
+            generation=generation,
+        )
+
+    def fiscal_year_for(self, day: date) -> Optional[FiscalYearEntry]:
+        """Fiscal year whose [start_date, end_date] contains the given AD date"""
+        return self.fiscal_index.containing(day.toordinal())
+
+    def range_index(self, province=None, fiscal_year=None, reg_type=None,
+                    category=None, for_income_tax: bool = False) -> IntervalIndex:
+        """
+        Interval index of the CC ranges in effect for a lookup key
+
+        With a full key, a fiscal year that defines no ranges of its own
+        inherits those of the latest earlier year that does. Any component
+        left as None matches every value; those partial indexes are built on
+        first use and kept for the life of the book.
+
+        Args:
+            province: Province object or id
+            fiscal_year: FiscalYear object or id
+            reg_type: RegType object or id
+            category: Category object or id
+            for_income_tax: Index the ranges flagged for income tax instead
+                of the tax ranges
+
+        Returns:
+            IntervalIndex (empty when nothing is configured)
+        """
+        for_income_tax = bool(for_income_tax)
+        key = (_id(province), _id(fiscal_year), _id(reg_type), _id(category))
+        if None not in key:
+            index = self._range_indexes.get((*key, for_income_tax))
+            if index is not None:
+                return index
+            fiscal_year_entry = self.fiscal_years.get(key[1])
+            years = self._range_years.get((key[0], key[2], key[3], for_income_tax))
+            if fiscal_year_entry is None or not years:
+                return _EMPTY_INDEX
+            position = bisect_right(years, (fiscal_year_entry.start_date, key[1])) - 1
+            if position < 0:
+                return _EMPTY_INDEX
+            return self._range_indexes[(key[0], years[position][1], key[2], key[3], for_income_tax)]
+
+        index = self._partial_indexes.get((*key, for_income_tax))
+        if index is None:
+            index = IntervalIndex([
+                r for r in self._all_ranges
+                if bool(r.for_income_tax) == for_income_tax
+                and (key[0] is None or r.province_id == key[0])
+                and (key[1] is None or r.fiscal_year_id == key[1])
+                and (key[2] is None or r.reg_type_id == key[2])
+                and (key[3] is None or r.category_id == key[3])
+            ])
+            self._partial_indexes[(*key, for_income_tax)] = index
+        return index
+
+    def find_cc_range(self, category, cc_power, province=None, fiscal_year=None,
+                      reg_type=None, for_income_tax: bool = False) -> Optional[CCRangeEntry]:
+        """
+        Find the CC range containing cc_power
+
+        Args:
+            category: Category object or id
+            cc_power: Engine capacity or power value
+            province: Optional Province to narrow the search
+            fiscal_year: Optional FiscalYear to narrow the search
+            reg_type: Optional RegType to narrow the search
+            for_income_tax: Search the income tax ranges instead of the tax ranges
+
+        Returns:
+            CCRangeEntry or None
+        """
+        return self.range_index(province, fiscal_year, reg_type, category,
+                                for_income_tax).resolve(cc_power).cc_range
+
+    def tax_rate(self, reg_type, category, cc_range, fiscal_year,
+                 province=None) -> Optional[TaxRateEntry]:
+        """Tax rate row for the lookup tuple, or None"""
+        if province is None:
+            return self._tax_rates_any_province.get(
+                (_id(fiscal_year), _id(reg_type), _id(category), _id(cc_range)))
+        return self._tax_rates.get(
+            (_id(province), _id(fiscal_year), _id(reg_type), _id(category), _id(cc_range)))
+
+    def has_tax_rates(self, reg_type, category) -> bool:
+        """True if any tax rate is configured for the reg type and category"""
+        return (_id(reg_type), _id(category)) in self._tax_rate_pairs
+
+    def income_tax_rate(self, category, cc_range, fiscal_year) -> Optional[IncomeTaxRateEntry]:
+        """
+        Income tax rate for the category, preferring a CC range specific row
+        when the range is flagged for income tax
+        """
+        category_id, fiscal_year_id = _id(category), _id(fiscal_year)
+        cc_range_id = _id(cc_range)
+        if cc_range_id is not None:
+            entry = self.cc_ranges.get(cc_range_id)
+            if entry is not None and entry.for_income_tax:
+                rate = self._income_tax_rates.get((category_id, fiscal_year_id, cc_range_id))
+                if rate is not None:
+                    return rate
+        return self._income_tax_rates.get((category_id, fiscal_year_id, None))
+
+    def reg_rule(self, province, fiscal_year, reg_type) -> Optional[RegRuleEntry]:
+        """Exemption rule for the registration type, or None"""
+        return self._reg_rules.get((_id(province), _id(fiscal_year), _id(reg_type)))
+
+    def penalty_schedule(self, province, fiscal_year) -> CompiledSchedule:
+        """
+        Penalty schedule for dues of a fiscal year in a province
+
+        The most specific schedule wins: province and fiscal year, then
+        province only, then fiscal year only, then a catch-all schedule, and
+        finally the built-in monthly rule.
+        """
+        if not self._penalty_schedules:
+            return default_schedule()
+        province_id, fiscal_year_id = _id(province), _id(fiscal_year)
+        schedules = self._penalty_schedules
+        return (schedules.get((province_id, fiscal_year_id))
+                or schedules.get((province_id, None))
+                or schedules.get((None, fiscal_year_id))
+                or schedules.get((None, None))
+                or default_schedule())
+
+
+_EMPTY_INDEX = IntervalIndex(())
+
+_current: Optional[RateBook] = None
+_build_lock = threading.Lock()
+_worker_lock = threading.Lock()
+_worker: Optional[threading.Thread] = None
+_dirty = threading.Event()
+_generation_checked_at = 0.0
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_RATE_BOOK', {}).get(key, default)
+
+
+def _shared_generation() -> int:
+    try:
+        return cache.get(GENERATION_CACHE_KEY, 0)
+    except Exception as e:
+        logger.warning("Could not read rate book generation: %s", e)
+        return 0
+
+
+def rebuild() -> RateBook:
+    """
+    Load a fresh rate book and swap it in
+
+    Readers holding the previous book keep using it until they finish, so a
+    request never observes a partially built table.
+    """
+    global _current
+    with _build_lock:
+        generation = _shared_generation()
+        book = RateBook.load(generation=generation)
+        _current = book
+    return book
+
+
+def _generation_check_due() -> bool:
+    """Whether CHECK_INTERVAL has elapsed since the shared generation was last read"""
+    global _generation_checked_at
+    now = time.monotonic()
+    if now - _generation_checked_at < _config('CHECK_INTERVAL', 5):
+        return False
+    _generation_checked_at = now
+    return True
+
+
+def get_rate_book() -> RateBook:
+    """
+    Return the current rate book, building it on first use
+
+    Every CHECK_INTERVAL seconds the shared generation counter is compared
+    with the one the book was built from, so changes saved by other worker
+    processes are picked up without a query per request.
+    """
+    book = _current
+    if book is None:
+        return rebuild()
+
+    if _generation_check_due() and _shared_generation() != book.generation:
+        schedule_rebuild()
+    return book
+
+
+async def aget_rate_book() -> RateBook:
+    """
+    Async variant of get_rate_book
+
+    The cold build, the generation read and any rebuild all touch the cache
+    or the database, so they run in a worker thread rather than on the event
+    loop (a DatabaseCache raises SynchronousOnlyOperation there).
+    """
+    book = _current
+    if book is None:
+        return await sync_to_async(rebuild)()
+
+    if _generation_check_due() and await sync_to_async(_shared_generation)() != book.generation:
+        await sync_to_async(schedule_rebuild)()
+    return book
+
+
+def _rebuild_worker():
+    global _worker
+    try:
+        while _dirty.is_set():
+            _dirty.clear()
+            try:
+                rebuild()
+            except Exception as e:
+                logger.exception("Rate book rebuild failed: %s", e)
+    finally:
+        connection.close()
+        with _worker_lock:
+            _worker = None
+        # A change may have landed between the last loop check and the reset above
+        if _dirty.is_set():
+            schedule_rebuild()
+
+
+def schedule_rebuild():
+    """
+    Rebuild the rate book in a background thread
+
+    Bursts of changes (e.g. an import of thousands of rows) coalesce into a
+    single rebuild because the worker drains the dirty flag before loading.
+    """
+    global _worker
+    _dirty.set()
+    if not _config('BACKGROUND_REBUILD', True):
+        _dirty.clear()
+        rebuild()
+        return
+
+    with _worker_lock:
+        if _worker is not None:
+            return
+        _worker = threading.Thread(target=_rebuild_worker, name='ratebook-rebuild', daemon=True)
+        _worker.start()
+
+
+def _rates_changed():
+    try:
+        cache.add(GENERATION_CACHE_KEY, 0, timeout=None)
+        cache.incr(GENERATION_CACHE_KEY)
+    except Exception as e:
+        logger.warning("Could not bump rate book generation: %s", e)
+    schedule_rebuild()
+
+
+def mark_rates_changed(**kwargs):
+    """
+    Signal handler: once the current transaction commits, bump the shared
+    generation and rebuild
+
+    Bumping before the commit would let another worker rebuild from the
+    old rows and stamp that book with the new generation, serving stale
+    rates until the next change.
+    """
+    transaction.on_commit(_rates_changed)
@@ -0,0 +1,467 @@
+"""
+Rate cube: the rate book's lookup tables as flat NumPy arrays in one
+memory-mappable file
+
+A cube is addressed by (province, fiscal year, reg type, category) cells
+plus a range position. Every cell maps to the group of tax CC ranges and
+the group of income tax CC ranges in effect for it, already including
+inheritance from earlier fiscal years, and every
+group carries its IntervalIndex slot table (breakpoints in cents, covering
+count and winning range per slot). Tax rates and income tax rates are
+sorted int64 keys with paisa value columns. Resolving a batch of powers and
+fetching their rates are therefore a few searchsorted and fancy-indexing
+operations over the whole batch, with the rate book's semantics: lowest id
+wins on duplicate keys, lowest from_cc wins on shared boundaries.
+
+The file is a fixed header, a JSON table of contents and 64-byte aligned
+arrays. RateCube.open maps it read-only and wraps the arrays without
+copying, so opening is a header parse and every worker shares the same
+page cache pages. publish_rate_cube writes it to CALC_RATE_CUBE['PATH']
+with an atomic rename; processes still mapping the previous file keep
+reading it until they reopen. get_rate_cube hands the arrears engine the
+cube matching its rate book, which prices all segments of a batch with it.
+
+Powers are resolved at cent precision, the precision CC ranges are stored
+at.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .intervals import RANGE_AMBIGUOUS, RANGE_GAP, RANGE_HIT
+from .ratebook import RateBook
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CALCCUBE'
+FORMAT = 3
+ALIGN = 64
+# Magic, format, length of the JSON table of contents
+HEADER = struct.Struct('<8sII')
+
+AXES = ('provinces', 'fiscal_years', 'reg_types', 'categories')
+RATE_COLUMNS = ('private_tax', 'public_tax', 'private_renewal', 'public_renewal')
+
+# Breakpoints are keyed as (group << BOUND_SHIFT) | cents; CC values have at
+# most 10 digits, so cents stay below 2 ** 34
+BOUND_SHIFT = 34
+MAX_CENTS = (1 << BOUND_SHIFT) - 1
+
+
+def _cents(values) -> np.ndarray:
+    """Amounts with two decimal places (DecimalField(max_digits=10)) as exact whole cents or paisa"""
+    return np.round(np.asarray(values, dtype=np.float64) * 100)
+
+
+class RateCube:
+    """
+    Array form of a rate book
+
+    Attributes:
+        fingerprint: Fingerprint of the rate book the cube was built from
+        arrays: Name -> array; read-only views into the file when opened
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], fingerprint: str, buffer=None):
+        self.arrays = arrays
+        self.fingerprint = fingerprint
+        # The mapping backing the arrays, kept alive as long as the cube
+        self._buffer = buffer
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.shape = tuple(len(arrays[axis]) for axis in AXES)
+
+    @classmethod
+    def build(cls, book: RateBook) -> 'RateCube':
+        """Build a cube from a rate book"""
+        axes = {
+            'provinces': set(book.provinces),
+            'fiscal_years': set(book.fiscal_years),
+            'reg_types': set(book.reg_types),
+            'categories': set(book.categories),
+        }
+        for cc_range in book.cc_ranges.values():
+            axes['provinces'].add(cc_range.province_id)
+            axes['fiscal_years'].add(cc_range.fiscal_year_id)
+            axes['reg_types'].add(cc_range.reg_type_id)
+            axes['categories'].add(cc_range.category_id)
+        axis_ids = {name: sorted(i for i in ids if i is not None) for name, ids in axes.items()}
+
+        # Tax and income tax range groups of every cell; cells sharing an
+        # inherited index share its group
+        groups: Dict[int, int] = {}
+        indexes = []
+        cell_count = int(np.prod([len(ids) for ids in axis_ids.values()]))
+        cell_groups = {False: np.full(cell_count, -1, dtype=np.int32),
+                       True: np.full(cell_count, -1, dtype=np.int32)}
+        cell = 0
+        for province_id in axis_ids['provinces']:
+            for fiscal_year_id in axis_ids['fiscal_years']:
+                for reg_type_id in axis_ids['reg_types']:
+                    for category_id in axis_ids['categories']:
+                        for for_income_tax, cell_group in cell_groups.items():
+                            index = book.range_index(province_id, fiscal_year_id, reg_type_id, category_id,
+                                                     for_income_tax)
+                            if len(index):
+                                group = groups.get(id(index))
+                                if group is None:
+                                    group = groups[id(index)] = len(indexes)
+                                    indexes.append(index)
+                                cell_group[cell] = group
+                        cell += 1
+        if len(indexes) >= 1 << (63 - BOUND_SHIFT):
+            raise ValueError(f"Too many CC range groups for a rate cube: {len(indexes)}")
+
+        ranges, bound_keys, slot_counts, slot_ranges = [], [], [], []
+        range_start, bound_start, slot_start = [0], [0], [0]
+        for group, index in enumerate(indexes):
+            bounds, counts, winners = index.slot_table()
+            bound_keys.append((group << BOUND_SHIFT) | _cents(bounds).astype(np.int64))
+            slot_counts.append(counts)
+            slot_ranges.append(np.where(winners >= 0, winners + range_start[-1], -1))
+            ranges.extend(index.ranges)
+            range_start.append(len(ranges))
+            bound_start.append(bound_start[-1] + len(bounds))
+            slot_start.append(slot_start[-1] + len(counts))
+        position_of = {cc_range.id: position for position, cc_range in enumerate(ranges)}
+        range_ids = np.array([r.id for r in ranges], dtype=np.int64)
+        by_id = np.argsort(range_ids, kind='stable')
+
+        def concat(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        arrays = {name: np.array(ids, dtype=np.int64) for name, ids in axis_ids.items()}
+        arrays.update({
+            'cell_group': cell_groups[False],
+            'income_cell_group': cell_groups[True],
+            'range_id': range_ids,
+            # Range ids in ascending order and their positions, to map ids back to positions
+            'range_sorted_id': range_ids[by_id],
+            'range_sorted_position': by_id.astype(np.int64),
+            # Stored bounds in cents; a to_cc of 0 marks an open-ended top range
+            'range_from': _cents([float(r.from_cc) for r in ranges]).astype(np.int64),
+            'range_to': _cents([float(r.to_cc) for r in ranges]).astype(np.int64),
+            'range_income': np.array([r.for_income_tax for r in ranges], dtype=np.bool_),
+            'range_start': np.array(range_start, dtype=np.int64),
+            'bound_key': concat(bound_keys, np.int64),
+            'bound_start': np.array(bound_start, dtype=np.int64),
+            'slot_count': concat(slot_counts, np.int32),
+            'slot_range': concat(slot_ranges, np.int64),
+            'slot_start': np.array(slot_start, dtype=np.int64),
+        })
+        cube = cls(arrays, book.fingerprint)
+
+        # Rates keyed by cell and range position; rows whose range no lookup
+        # can resolve (unknown or inverted) are left out
+        def positions(rates):
+            return np.array([position_of.get(rate.cc_range_id, -1 if rate.cc_range_id is None else -2)
+                             for rate in rates], dtype=np.int64).reshape(-1)
+
+        def column(rates, field):
+            return np.array([getattr(rate, field) for rate in rates], dtype=np.int64).reshape(-1)
+
+        # The book's rate dicts already hold the lowest id per key
+        tax_rates = list(book._tax_rates.values())
+        cells = cube.cells(column(tax_rates, 'province_id'), column(tax_rates, 'fiscal_year_id'),
+                           column(tax_rates, 'reg_type_id'), column(tax_rates, 'category_id'))
+        tax_positions = positions(tax_rates)
+        keep = (cells >= 0) & (tax_positions >= -1)
+        tax_keys = cube._rate_key(cells, tax_positions)[keep]
+        tax_values = _cents([[float(getattr(rate, name)) for name in RATE_COLUMNS] for rate in tax_rates])
+        tax_values = tax_values.reshape(-1, len(RATE_COLUMNS)).astype(np.int64)[keep]
+        skipped = len(tax_rates) - int(keep.sum())
+
+        income_rates = list(book._income_tax_rates.values())
+        cells = cube._income_cell(column(income_rates, 'fiscal_year_id'), column(income_rates, 'category_id'))
+        income_positions = positions(income_rates)
+        keep = (cells >= 0) & (income_positions >= -1)
+        income_keys = cube._rate_key(cells, income_positions)[keep]
+        income_values = _cents([float(rate.income_tax) for rate in income_rates]).astype(np.int64)[keep]
+        skipped += len(income_rates) - int(keep.sum())
+        if skipped:
+            logger.info("Rate cube left out %d rates without a resolvable CC range", skipped)
+
+        tax_order = np.argsort(tax_keys, kind='stable')
+        income_order = np.argsort(income_keys, kind='stable')
+        arrays.update({
+            'tax_key': tax_keys[tax_order],
+            'tax_values': tax_values[tax_order],
+            'income_key': income_keys[income_order],
+            'income_values': income_values[income_order],
+        })
+        return cls(arrays, book.fingerprint)
+
+    # File format
+
+    def write(self, path) -> Path:
+        """Write the cube to a file; the write is atomic"""
+        path = Path(path)
+        toc, offset = {}, 0
+        for name, array in self.arrays.items():
+            array = np.ascontiguousarray(array)
+            toc[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+        contents = json.dumps({'fingerprint': self.fingerprint, 'arrays': toc},
+                              sort_keys=True, separators=(',', ':')).encode()
+        start = -(-(HEADER.size + len(contents)) // ALIGN) * ALIGN
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT, len(contents)))
+                f.write(contents)
+                for name, array in self.arrays.items():
+                    f.seek(start + toc[name]['offset'])
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.truncate(start + offset)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return path
+
+    @classmethod
+    def open(cls, path) -> 'RateCube':
+        """
+        Map a cube file read-only; the arrays are views into the mapping
+
+        Raises:
+            ValueError: If the file is not a rate cube of this format
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < HEADER.size:
+            raise ValueError(f"{path} is not a rate cube")
+        magic, version, length = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT:
+            raise ValueError(f"{path} is not a format {FORMAT} rate cube")
+        contents = json.loads(bytes(buffer[HEADER.size:HEADER.size + length]))
+        start = -(-(HEADER.size + length) // ALIGN) * ALIGN
+        arrays = {}
+        for name, entry in contents['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape']))
+            arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                         offset=start + entry['offset']).reshape(entry['shape'])
+        return cls(arrays, contents['fingerprint'], buffer)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+    # Lookups; every argument may be a scalar or an array, ids are broadcast together
+
+    def axis_index(self, axis: str, ids) -> np.ndarray:
+        """Positions of ids along an axis, -1 for unknown ids"""
+        values = self.arrays[axis]
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(values):
+            return np.full(ids.shape, -1, dtype=np.int64)
+        positions = np.searchsorted(values, ids)
+        clipped = np.minimum(positions, len(values) - 1)
+        return np.where(values[clipped] == ids, clipped, -1)
+
+    def range_positions(self, cc_range_ids) -> np.ndarray:
+        """Positions of CC range ids, -1 for ranges the cube does not hold"""
+        rows = self._search(self.range_sorted_id, np.asarray(cc_range_ids, dtype=np.int64))
+        if not len(self.range_sorted_id):
+            return rows
+        return np.where(rows >= 0, self.range_sorted_position[np.maximum(rows, 0)], -1)
+
+    def cells(self, province, fiscal_year, reg_type, category) -> np.ndarray:
+        """Flat cell numbers of (province, fiscal year, reg type, category) ids, -1 if any is unknown"""
+        indexes = [self.axis_index(axis, ids)
+                   for axis, ids in zip(AXES, (province, fiscal_year, reg_type, category))]
+        cells = np.ravel_multi_index(tuple(np.maximum(i, 0) for i in indexes), self.shape)
+        known = (indexes[0] >= 0) & (indexes[1] >= 0) & (indexes[2] >= 0) & (indexes[3] >= 0)
+        return np.where(known, cells, -1)
+
+    def _income_cell(self, fiscal_year, category) -> np.ndarray:
+        fiscal_year = self.axis_index('fiscal_years', fiscal_year)
+        category = self.axis_index('categories', category)
+        cells = fiscal_year * self.shape[3] + category
+        return np.where((fiscal_year >= 0) & (category >= 0), cells, -1)
+
+    def _rate_key(self, cells, positions) -> np.ndarray:
+        # Position -1 (no CC range) is slot 0 of its cell
+        return np.asarray(cells, dtype=np.int64) * (len(self.range_id) + 1) + positions + 1
+
+    @staticmethod
+    def _search(keys: np.ndarray, wanted: np.ndarray) -> np.ndarray:
+        """Rows of wanted keys in a sorted key array, -1 where absent"""
+        if not len(keys):
+            return np.full(wanted.shape, -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return np.where(keys[rows] == wanted, rows, -1)
+
+    def resolve(self, province, fiscal_year, reg_type, category, cc_power,
+                for_income_tax: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resolve powers to CC range positions
+
+        Args:
+            province, fiscal_year, reg_type, category: Ids
+            cc_power: Powers; NaN where absent
+            for_income_tax: Resolve among the income tax ranges instead of the tax ranges
+
+        Returns:
+            Tuple of (positions, statuses); positions index range_id and are
+            -1 for gaps, statuses are the calc.intervals codes
+        """
+        cells = self.cells(province, fiscal_year, reg_type, category)
+        cents = _cents(cc_power)
+        cells, cents = np.broadcast_arrays(cells, cents)
+        if not len(self.range_id):
+            return np.full(cells.shape, -1, dtype=np.int64), np.full(cells.shape, RANGE_GAP, dtype=np.int8)
+        cell_group = self.income_cell_group if for_income_tax else self.cell_group
+        groups = np.where(cells >= 0, cell_group[np.maximum(cells, 0)], -1)
+        valid = (groups >= 0) & (cents >= 0) & (cents <= MAX_CENTS)
+        groups = np.where(valid, groups, 0)
+        cents = np.where(valid, cents, 0).astype(np.int64)
+
+        keys = (groups.astype(np.int64) << BOUND_SHIFT) | cents
+        found = np.searchsorted(self.bound_key, keys)
+        end = self.bound_start[groups + 1]
+        exact = (found < end) & (self.bound_key[np.minimum(found, len(self.bound_key) - 1)] == keys)
+        slots = self.slot_start[groups] + 2 * (found - self.bound_start[groups]) + exact
+
+        counts = np.where(valid, self.slot_count[slots], 0)
+        positions = np.where(counts > 0, self.slot_range[slots], -1)
+        statuses = np.where(counts == 0, RANGE_GAP,
+                            np.where(counts == 1, RANGE_HIT, RANGE_AMBIGUOUS)).astype(np.int8)
+        return positions, statuses
+
+    def tax_rates(self, province, fiscal_year, reg_type, category, positions) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tax rates for cells and range positions (-1 for categories without ranges)
+
+        Returns:
+            Tuple of (found, values); values has the RATE_COLUMNS in paisa,
+            zero where no rate is configured
+        """
+        cells = self.cells(province, fiscal_year, reg_type, category)
+        rows = self._search(self.tax_key, self._rate_key(cells, positions))
+        rows = np.where(cells >= 0, rows, -1)
+        if not len(self.tax_key):
+            return rows >= 0, np.zeros(rows.shape + (len(RATE_COLUMNS),), dtype=np.int64)
+        values = self.tax_values[np.maximum(rows, 0)]
+        values[rows < 0] = 0
+        return rows >= 0, values
+
+    def income_tax(self, fiscal_year, category, positions) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Income tax in paisa, preferring a range specific rate when the range
+        is flagged for income tax
+
+        Args:
+            positions: Income tax range positions, e.g. from
+                resolve(..., for_income_tax=True); -1 for none
+
+        Returns:
+            Tuple of (found, income tax); zero where no rate is configured
+        """
+        cells = self._income_cell(fiscal_year, category)
+        positions = np.asarray(positions, dtype=np.int64)
+        flagged = np.zeros(positions.shape, dtype=np.bool_)
+        if len(self.range_income):
+            flagged = (positions >= 0) & self.range_income[np.maximum(positions, 0)]
+        specific = self._search(self.income_key, self._rate_key(cells, positions))
+        general = self._search(self.income_key, self._rate_key(cells, -1))
+        rows = np.where(flagged & (specific >= 0), specific, general)
+        rows = np.where(cells >= 0, rows, -1)
+        if not len(self.income_key):
+            return rows >= 0, np.zeros(rows.shape, dtype=np.int64)
+        return rows >= 0, np.where(rows >= 0, self.income_values[np.maximum(rows, 0)], 0)
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_RATE_CUBE', {}).get(key, default)
+
+
+_cube: Optional[RateCube] = None
+_lock = threading.Lock()
+_building: Set[str] = set()
+# (inode, mtime) of the published file when it was last opened
+_published_stat: Optional[Tuple[int, int]] = None
+
+
+def _open_published(path) -> Optional[RateCube]:
+    """The published cube, or None if it is missing, unreadable or unchanged since the last open"""
+    global _published_stat
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if (stat.st_ino, stat.st_mtime_ns) == _published_stat:
+        return None
+    _published_stat = (stat.st_ino, stat.st_mtime_ns)
+    try:
+        return RateCube.open(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not open rate cube %s: %s", path, e)
+        return None
+
+
+def _build(book: RateBook, path):
+    global _cube
+    try:
+        cube = RateCube.build(book)
+        if path:
+            try:
+                cube = RateCube.open(cube.write(path))
+            except OSError as e:
+                logger.warning("Could not publish rate cube to %s: %s", path, e)
+        with _lock:
+            _cube = cube
+    except Exception as e:
+        logger.exception("Rate cube build failed: %s", e)
+    finally:
+        with _lock:
+            _building.discard(book.fingerprint)
+
+
+def get_rate_cube(book: RateBook) -> Optional[RateCube]:
+    """
+    Rate cube matching a rate book, or None while none is available
+
+    Freshness is a comparison of the cube's fingerprint with the book's. A
+    stale cube is replaced by the published file when that matches (e.g.
+    after publish_rate_cube or another worker's build); otherwise the cube
+    is built from the given book off the request path and published, and
+    callers fall back to the book's own lookups until it is ready.
+    """
+    global _cube
+    if not _config('ENABLED', True):
+        return None
+    cube = _cube
+    if cube is not None and cube.fingerprint == book.fingerprint:
+        return cube
+
+    path = _config('PATH', None)
+    with _lock:
+        cube = _cube
+        if cube is not None and cube.fingerprint == book.fingerprint:
+            return cube
+        published = _open_published(path) if path else None
+        if published is not None and published.fingerprint == book.fingerprint:
+            _cube = published
+            return published
+        if book.fingerprint in _building:
+            return None
+        _building.add(book.fingerprint)
+
+    if not _config('BACKGROUND_BUILD', True):
+        _build(book, path)
+        return _cube if _cube is not None and _cube.fingerprint == book.fingerprint else None
+    threading.Thread(target=_build, args=(book, path), name='ratecube-build', daemon=True).start()
+    return None
@@ -0,0 +1,216 @@
+"""
+In-process registry of the reference tables
+
+Provinces, registration types, categories and fiscal years change a few
+times a year but feed every form render, form submission and GraphQL
+listing. A ReferenceData snapshot holds them as immutable rate book entries,
+together with which categories have rates per registration type, so those
+reads cost no queries.
+
+Once a transaction saving or deleting any of REFERENCE_MODELS commits,
+the snapshot is dropped and a shared generation counter bumped; other
+workers notice the new generation within CALC_RATE_BOOK['CHECK_INTERVAL']
+seconds, as they do for the rate book. Reloading is five small queries.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category, FiscalYear, Province, RegType, TaxRate
+from .ratebook import (CategoryEntry, FiscalYearEntry, ProvinceEntry, RegTypeEntry, _fingerprint,
+                       _id)
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CACHE_KEY = 'calc:reference:generation'
+
+# Tables the registry reads; changes to any of them invalidate it
+REFERENCE_MODELS = (Province, RegType, Category, FiscalYear, TaxRate)
+
+Entry = Union[ProvinceEntry, RegTypeEntry, CategoryEntry, FiscalYearEntry]
+
+
+class ReferenceData:
+    """
+    Immutable snapshot of the reference tables
+
+    Tables are tuples of entries in id order, keyed by name: 'provinces',
+    'reg_types', 'categories' and 'fiscal_years'.
+
+    Attributes:
+        version: Digest of the rows, identical across processes holding the
+            same data; changes whenever any reference row does
+        generation: Shared change counter the snapshot was loaded at
+    """
+
+    def __init__(self, provinces: Sequence[ProvinceEntry], reg_types: Sequence[RegTypeEntry],
+                 categories: Sequence[CategoryEntry], fiscal_years: Sequence[FiscalYearEntry],
+                 rate_pairs: Sequence[Tuple[int, int]] = (), generation: int = 0):
+        self.generation = generation
+        self.tables: Dict[str, Tuple[Entry, ...]] = {
+            'provinces': tuple(sorted(provinces, key=lambda e: e.id)),
+            'reg_types': tuple(sorted(reg_types, key=lambda e: e.id)),
+            'categories': tuple(sorted(categories, key=lambda e: e.id)),
+            'fiscal_years': tuple(sorted(fiscal_years, key=lambda e: e.id)),
+        }
+        self._by_id: Dict[str, Dict[int, Entry]] = {
+            table: {entry.id: entry for entry in entries} for table, entries in self.tables.items()
+        }
+
+        rate_pairs = sorted(set(rate_pairs))
+        categories_by_id = self._by_id['categories']
+        grouped: Dict[int, list] = {}
+        for reg_type_id, category_id in rate_pairs:
+            if category_id in categories_by_id:
+                grouped.setdefault(reg_type_id, []).append(categories_by_id[category_id])
+        self._categories_by_reg_type = {key: tuple(value) for key, value in grouped.items()}
+
+        digest = hashlib.blake2b(_fingerprint(*self.tables.values()).encode(), digest_size=12)
+        digest.update(repr(rate_pairs).encode())
+        self.version = digest.hexdigest()
+        self._ordered: Dict[Tuple[str, str, bool], Tuple[Entry, ...]] = {}
+
+    @classmethod
+    def load(cls, generation: int = 0) -> 'ReferenceData':
+        """Build a snapshot from the database, one query per table"""
+        return cls(
+            provinces=[ProvinceEntry(*row) for row in Province.objects.values_list('id', 'name', 'name_en')],
+            reg_types=[RegTypeEntry(*row) for row in RegType.objects.values_list('id', 'name', 'name_en')],
+            categories=[CategoryEntry(*row) for row in
+                        Category.objects.values_list('id', 'name', 'name_en', 'has_cc_range')],
+            fiscal_years=[FiscalYearEntry(*row) for row in FiscalYear.objects.values_list(
+                'id', 'name', 'name_en', 'start_date', 'end_date',
+                'income_tax_due_date', 'vehicle_tax_due_date', 'previous_id')],
+            # Served by the (reg_type, category) index without reading rate rows
+            rate_pairs=list(TaxRate.objects.order_by().values_list('reg_type_id', 'category_id').distinct()),
+            generation=generation,
+        )
+
+    @property
+    def provinces(self) -> Tuple[ProvinceEntry, ...]:
+        return self.tables['provinces']
+
+    @property
+    def reg_types(self) -> Tuple[RegTypeEntry, ...]:
+        return self.tables['reg_types']
+
+    @property
+    def categories(self) -> Tuple[CategoryEntry, ...]:
+        return self.tables['categories']
+
+    @property
+    def fiscal_years(self) -> Tuple[FiscalYearEntry, ...]:
+        return self.tables['fiscal_years']
+
+    def get(self, table: str, pk) -> Optional[Entry]:
+        """Entry of a table by primary key (int or numeric string), or None"""
+        try:
+            return self._by_id[table].get(int(pk if isinstance(pk, (int, str)) else pk.id))
+        except (TypeError, ValueError):
+            return None
+
+    def ordered(self, table: str, field: str, reverse: bool = False) -> Tuple[Entry, ...]:
+        """Entries of a table sorted by one field, then id; computed once per snapshot"""
+        key = (table, field, reverse)
+        entries = self._ordered.get(key)
+        if entries is None:
+            entries = self._ordered[key] = tuple(sorted(
+                self.tables[table], key=lambda e: (getattr(e, field), e.id), reverse=reverse))
+        return entries
+
+    def categories_for(self, reg_type) -> Tuple[CategoryEntry, ...]:
+        """Categories with at least one tax rate for the registration type, in id order"""
+        return self._categories_by_reg_type.get(_id(reg_type), ())
+
+
+_current: Optional[ReferenceData] = None
+_load_lock = threading.Lock()
+_generation_checked_at = 0.0
+
+
+def _check_interval() -> float:
+    return getattr(settings, 'CALC_RATE_BOOK', {}).get('CHECK_INTERVAL', 5)
+
+
+def _shared_generation() -> int:
+    try:
+        return cache.get(GENERATION_CACHE_KEY, 0)
+    except Exception as e:
+        logger.warning("Could not read reference data generation: %s", e)
+        return 0
+
+
+def reload() -> ReferenceData:
+    """Load a fresh snapshot and swap it in"""
+    global _current
+    with _load_lock:
+        reference = ReferenceData.load(generation=_shared_generation())
+        _current = reference
+    return reference
+
+
+def _generation_check_due() -> bool:
+    """Whether CHECK_INTERVAL has elapsed since the shared generation was last read"""
+    global _generation_checked_at
+    now = time.monotonic()
+    if now - _generation_checked_at < _check_interval():
+        return False
+    _generation_checked_at = now
+    return True
+
+
+def _current_or_none() -> Optional[ReferenceData]:
+    """The loaded snapshot, or None when it must be (re)loaded first"""
+    reference = _current
+    if reference is None:
+        return None
+    if _generation_check_due() and _shared_generation() != reference.generation:
+        return None
+    return reference
+
+
+def get_reference() -> ReferenceData:
+    """Return the current reference data, loading it on first use or after a change"""
+    return _current_or_none() or reload()
+
+
+async def aget_reference() -> ReferenceData:
+    """
+    Async variant of get_reference
+
+    The generation read and the reload both run in a worker thread, since
+    the cache backend may do blocking I/O.
+    """
+    reference = _current
+    if reference is not None and _generation_check_due():
+        if await sync_to_async(_shared_generation)() != reference.generation:
+            reference = None
+    return reference or await sync_to_async(reload)()
+
+
+def _changed():
+    global _current
+    try:
+        cache.add(GENERATION_CACHE_KEY, 0, timeout=None)
+        cache.incr(GENERATION_CACHE_KEY)
+    except Exception as e:
+        logger.warning("Could not bump reference data generation: %s", e)
+    _current = None
+
+
+def invalidate_reference(**kwargs):
+    """
+    Signal handler: once the current transaction commits, bump the shared
+    generation and drop the snapshot
+
+    Doing both after the commit keeps a reload from capturing uncommitted
+    (and possibly rolled back) rows under the new generation.
+    """
+    transaction.on_commit(_changed)
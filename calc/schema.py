@@ -1,55 +1,106 @@
 import graphene
-from graphene_django.types import DjangoObjectType
+from asgiref.sync import sync_to_async
+from graphql import GraphQLError
 
+from calc.loaders import resolve_related
 from calc.models import RegType, Province, FiscalYear, Category, CCRange
+from calc.projection import ProjectedObjectType, fetch_projected
+from calc.query_cost import enforce_cost
+from calc.quoting import MAX_BATCH_SIZE, QuoteError, QuoteRequest, quote_batch
+from calc.ratebook import aget_rate_book
+from calc.reference import aget_reference
 
 
-class CategoryType(DjangoObjectType):
+class CategoryType(ProjectedObjectType):
     class Meta:
         model = Category
-        fields = ('id', 'name', 'name_en', 'has_cc_range')
+        fields = ("id", "name", "name_en", "has_cc_range")
 
 
-class RegTypeType(DjangoObjectType):
+class RegTypeType(ProjectedObjectType):
     categories = graphene.List(CategoryType)
 
-    def resolve_categories(self, info, **kwargs):
-        return Category.objects.filter(reg_type=self)
+    async def resolve_categories(self, info, **kwargs):
+        return (await aget_reference()).categories_for(self.id)
 
     class Meta:
         model = RegType
         fields = ("id", "name", "name_en")
 
 
-class ProvinceType(DjangoObjectType):
+class ProvinceType(ProjectedObjectType):
     class Meta:
         model = Province
         fields = ("id", "name", "name_en")
 
 
-class FiscalYearType(DjangoObjectType):
+class FiscalYearType(ProjectedObjectType):
     class Meta:
         model = FiscalYear
         fields = ("id", "name", "name_en")
 
 
-class CategoryType(DjangoObjectType):
-    class Meta:
-        model = Category
-        fields = ("id", "name", "name_en", "has_cc_range")
-
-
-class CCRangeType(DjangoObjectType):
+class CCRangeType(ProjectedObjectType):
     name = graphene.String()
 
+    field_requirements = {'name': ('from_cc', 'to_cc')}
+
     def resolve_name(self, info, **kwargs):
         return f"{self.from_cc}-{self.to_cc}"
 
+    resolve_province = resolve_related('province', 'ProvinceType')
+    resolve_reg_type = resolve_related('reg_type', 'RegTypeType')
+    resolve_category = resolve_related('category', 'CategoryType')
+    resolve_fiscal_year = resolve_related('fiscal_year', 'FiscalYearType')
+
     class Meta:
         model = CCRange
         fields = ("id", "province", "reg_type", "category", "fiscal_year", "name", "from_cc", "to_cc")
 
 
+class CCRangeLookupType(graphene.ObjectType):
+    status = graphene.String(description="hit, ambiguous or gap")
+    cc_range = graphene.Field(CCRangeType)
+    candidates = graphene.List(CCRangeType)
+
+
+class QuoteInput(graphene.InputObjectType):
+    province = graphene.ID(required=True)
+    reg_type = graphene.ID(required=True)
+    category = graphene.ID(required=True)
+    cc_power = graphene.Decimal()
+    last_paid_date = graphene.String(required=True)
+    next_payment_date = graphene.String(required=True)
+    is_public = graphene.Boolean(default_value=False)
+
+
+class QuoteFiscalYearType(graphene.ObjectType):
+    fiscal_year = graphene.String()
+    fiscal_year_id = graphene.ID()
+    cc_range = graphene.String()
+    days = graphene.Int()
+    tax_amount = graphene.Decimal()
+    renewal_fee = graphene.Decimal()
+    income_tax = graphene.Decimal()
+    penalty = graphene.Decimal()
+    case_note = graphene.String()
+
+
+class QuoteResultType(graphene.ObjectType):
+    ok = graphene.Boolean()
+    error = graphene.String()
+    reg_type = graphene.String()
+    category = graphene.String()
+    cc_power = graphene.Decimal()
+    cc_range = graphene.String()
+    fiscal_years = graphene.List(QuoteFiscalYearType)
+    total_tax = graphene.Decimal()
+    total_renewal_fee = graphene.Decimal()
+    total_income_tax = graphene.Decimal()
+    total_penalty = graphene.Decimal()
+    grand_total = graphene.Decimal()
+
+
 class Query(graphene.ObjectType):
     provinces = graphene.List(ProvinceType)
     reg_types = graphene.List(RegTypeType)
@@ -61,31 +112,91 @@ class Query(graphene.ObjectType):
                               category=graphene.ID(required=True),
                               reg_type=graphene.ID(required=True)
                               )
+    cc_range_for_power = graphene.Field(CCRangeLookupType,
+                                        province=graphene.ID(required=True),
+                                        fiscal_year=graphene.ID(required=True),
+                                        category=graphene.ID(required=True),
+                                        reg_type=graphene.ID(required=True),
+                                        power=graphene.Decimal(required=True)
+                                        )
+    tax_quotes = graphene.List(QuoteResultType,
+                               inputs=graphene.List(graphene.NonNull(QuoteInput), required=True)
+                               )
+
+    # Reference tables come from the in-process registry (calc.reference) without queries
 
     @staticmethod
-    def resolve_provinces(root, info, **kwargs):
-        return Province.objects.all()
+    async def resolve_provinces(root, info, **kwargs):
+        return (await aget_reference()).provinces
 
     @staticmethod
-    def resolve_reg_types(root, info, **kwargs):
-        return RegType.objects.all()
+    async def resolve_reg_types(root, info, **kwargs):
+        return (await aget_reference()).reg_types
 
     @staticmethod
-    def resolve_fiscal_years(root, info, **kwargs):
-        return FiscalYear.objects.all()
+    async def resolve_fiscal_years(root, info, **kwargs):
+        return (await aget_reference()).fiscal_years
 
     @staticmethod
-    def resolve_categories(root, info, **kwargs):
-        return Category.objects.all()
+    async def resolve_categories(root, info, **kwargs):
+        return (await aget_reference()).categories
 
     @staticmethod
-    def resolve_cc_ranges(root, info, province, fiscal_year, category, reg_type):
-        return CCRange.objects.filter(
+    async def resolve_cc_ranges(root, info, province, fiscal_year, category, reg_type):
+        queryset = CCRange.objects.filter(
             province=province,
             fiscal_year=fiscal_year,
             category=category,
             reg_type=reg_type
         )
+        return await fetch_projected(queryset, info, CCRangeType)
+
+    @staticmethod
+    async def resolve_cc_range_for_power(root, info, province, fiscal_year, category, reg_type, power):
+        book = await aget_rate_book()
+        hit = book.range_index(
+            int(province), int(fiscal_year), int(reg_type), int(category)
+        ).resolve(power)
+        # Related objects selected under ccRange/candidates are batched by the CCRangeType loaders
+        ranges = await CCRange.objects.ain_bulk([r.id for r in hit.candidates])
+        return {
+            'status': hit.status_name,
+            'cc_range': ranges.get(hit.cc_range.id) if hit.cc_range else None,
+            'candidates': [ranges[r.id] for r in hit.candidates if r.id in ranges],
+        }
+
+    @staticmethod
+    async def resolve_tax_quotes(root, info, inputs):
+        if len(inputs) > MAX_BATCH_SIZE:
+            raise GraphQLError(f"At most {MAX_BATCH_SIZE} quotes per request")
+        enforce_cost(info)
+
+        requests = [
+            QuoteRequest(
+                province=item.province,
+                reg_type=item.reg_type,
+                category=item.category,
+                cc_power=item.cc_power,
+                last_paid_date=item.last_paid_date,
+                next_payment_date=item.next_payment_date,
+                is_public=bool(item.is_public),
+            )
+            for item in inputs
+        ]
+        book = await aget_rate_book()
+        # quote_batch reads and writes the quote cache, so never on the event loop
+        results = await sync_to_async(quote_batch, thread_sensitive=False)(requests, book)
+
+        quotes = []
+        for result in results:
+            if isinstance(result, QuoteError):
+                quotes.append({'ok': False, 'error': str(result)})
+            else:
+                quotes.append(dict(result, ok=True, **{
+                    key: result['vehicle_info'][key]
+                    for key in ('reg_type', 'category', 'cc_power', 'cc_range')
+                }))
+        return quotes
 
 
 # Define schema
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from import_export.signals import post_import
+
+from . import quote_cache, ratebook, reference
+from .models import (Category, CCRange, FiscalYear, IncomeTaxRate, PenaltySchedule, PenaltyTier,
+                     Province, RegRule, RegType, TaxRate)
+
+RATE_MODELS = (Province, FiscalYear, RegType, Category, CCRange, TaxRate, IncomeTaxRate, RegRule,
+               PenaltySchedule, PenaltyTier)
+
+# Signal handlers and the models whose changes they follow, run in this order
+HANDLERS = (
+    ('ratebook', ratebook.mark_rates_changed, RATE_MODELS),
+    ('quotes', quote_cache.invalidate_quotes, RATE_MODELS),
+    ('reference', reference.invalidate_reference, reference.REFERENCE_MODELS),
+)
+
+
+def connect_signals():
+    """Keep in-process rate data and derived caches in step with the database"""
+    for name, handler, models in HANDLERS:
+        for model in models:
+            uid = f'calc.{name}.{model.__name__}'
+            post_save.connect(handler, sender=model, dispatch_uid=f'{uid}.save')
+            post_delete.connect(handler, sender=model, dispatch_uid=f'{uid}.delete')
+        # import_export may bulk-create rows without per-instance signals
+        post_import.connect(handler, dispatch_uid=f'calc.{name}.import')
@@ -0,0 +1,340 @@
+"""
+Deterministic synthetic rate tables and vehicle inputs for scale testing
+"""
+import csv
+import datetime
+import random
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from . import bscalendar
+from .helper import TAX_CALCULATION_CONSTANTS
+from .models import (CCRange, Category, FiscalYear, IncomeTaxRate, PenaltySchedule, PenaltyTier,
+                     Province, RegRule, RegType, TaxRate)
+
+PROVINCE_NAMES = [
+    ('कोशी', 'Koshi'), ('मधेश', 'Madhesh'), ('बागमती', 'Bagmati'), ('गण्डकी', 'Gandaki'),
+    ('लुम्बिनी', 'Lumbini'), ('कर्णाली', 'Karnali'), ('सुदूरपश्चिम', 'Sudurpashchim'),
+]
+REG_TYPE_NAMES = [
+    ('निजि', 'Private'), ('सार्वजनिक', 'Public'), ('सरकारी', 'Government'), ('संस्थान', 'Institutional'),
+    ('एम्बुलेन्स', 'Ambulance'), ('कुटनीतिक', 'Diplomatic'), ('पर्यटक', 'Tourist'),
+]
+# (name, English name, has CC ranges, base annual tax)
+CATEGORY_KINDS = [
+    ('मोटरसाइकल', 'Motorcycle', True, 2000),
+    ('कार', 'Car', True, 15000),
+    ('बस', 'Bus', False, 25000),
+    ('ट्रक', 'Truck', False, 30000),
+    ('ट्रयाक्टर', 'Tractor', False, 5000),
+    ('विद्युतीय सवारी', 'Electric Vehicle', True, 8000),
+]
+RANGE_WIDTHS = (25, 50, 75, 100, 150, 250, 500)
+LAST_FISCAL_YEAR = 2082
+VEHICLE_COLUMNS = ['vehicle_id', 'province', 'reg_type', 'category', 'cc_power',
+                   'last_paid_date', 'next_payment_date', 'is_public']
+
+# Children first, so a plain DELETE never trips a foreign key
+DELETE_ORDER = (PenaltyTier, PenaltySchedule, TaxRate, IncomeTaxRate, CCRange, RegRule, FiscalYear,
+                Category, RegType, Province)
+
+
+class Scale(NamedTuple):
+    provinces: int
+    fiscal_years: int
+    reg_types: int
+    categories: int
+    ranges: int
+    revise_every: int = 3
+
+
+PROFILES = {
+    'small': Scale(provinces=1, fiscal_years=7, reg_types=7, categories=15, ranges=6),
+    'medium': Scale(provinces=7, fiscal_years=12, reg_types=7, categories=60, ranges=8),
+    'large': Scale(provinces=7, fiscal_years=20, reg_types=7, categories=120, ranges=10, revise_every=2),
+}
+
+
+def _bs_date(year: int, month: int, day: int) -> datetime.date:
+    return datetime.date.fromordinal(bscalendar.to_ordinal(year, month, day))
+
+
+def _round_hundred(amount: float) -> int:
+    return max(100, int(round(amount / 100.0)) * 100)
+
+
+def _next_id(model) -> int:
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+def _insert_rows(model, field_names: Sequence[str], rows: Iterable[tuple], batch_size: int) -> int:
+    """
+    Insert value tuples with executemany
+
+    bulk_create spends most of its time preparing every field of every
+    instance; for the large tables the values are already in database form,
+    so they go straight to a single prepared INSERT.
+    """
+    quote_name = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in field_names]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+    )
+    rows = iter(rows)
+    count = 0
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return count
+            cursor.executemany(sql, batch)
+            count += len(batch)
+
+
+def _range_bounds(rng: random.Random, count: int) -> List[tuple]:
+    """Contiguous (from_cc, to_cc) bands; the top band is open-ended (to_cc 0)"""
+    bounds, start = [], 0
+    for band in range(count):
+        end = start + rng.choice(RANGE_WIDTHS)
+        bounds.append((start, end if band < count - 1 else 0))
+        start = end
+    return bounds
+
+
+def clear_rate_tables() -> None:
+    """Delete every rate table row without loading them"""
+    with connection.cursor() as cursor:
+        for model in DELETE_ORDER:
+            cursor.execute('DELETE FROM %s' % connection.ops.quote_name(model._meta.db_table))
+
+
+def generate(scale: Scale, seed: int = 1, batch_size: int = 10000) -> Dict[str, int]:
+    """
+    Write a referentially valid rate dataset
+
+    Fiscal years are consecutive Nepali fiscal years ending in
+    LAST_FISCAL_YEAR, chained through ``previous``. CC ranges and their
+    rates are revised every ``revise_every`` years and later years inherit
+    the ranges in effect, as the real data does, while tax and income tax
+    rates exist for every fiscal year. The same seed produces the same rows.
+    No signals are sent; callers tell the caches about the new data.
+
+    Args:
+        scale: Table sizes
+        seed: Random seed
+        batch_size: Rows per INSERT batch
+
+    Returns:
+        Model name -> rows written
+    """
+    rng = random.Random(seed)
+    counts = {}
+    with transaction.atomic():
+        provinces = Province.objects.bulk_create(
+            Province(name=name, name_en=name_en)
+            for name, name_en in _names(PROVINCE_NAMES, scale.provinces))
+
+        years = range(LAST_FISCAL_YEAR - scale.fiscal_years + 1, LAST_FISCAL_YEAR + 1)
+        fiscal_years = FiscalYear.objects.bulk_create(
+            FiscalYear(name=_fiscal_year_name(year), name_en=_fiscal_year_name(year),
+                       start_date=_bs_date(year, 4, 1),
+                       end_date=_bs_date(year + 1, 4, 1) - datetime.timedelta(days=1),
+                       income_tax_due_date=_bs_date(year, 7, 1),
+                       vehicle_tax_due_date=_bs_date(year + 1, 1, 1))
+            for year in years)
+        for previous, fiscal_year in zip(fiscal_years, fiscal_years[1:]):
+            fiscal_year.previous = previous
+        FiscalYear.objects.bulk_update(fiscal_years, ['previous'])
+
+        reg_types = RegType.objects.bulk_create(
+            RegType(name=name, name_en=name_en) for name, name_en in _names(REG_TYPE_NAMES, scale.reg_types))
+
+        kinds = [CATEGORY_KINDS[i % len(CATEGORY_KINDS)] for i in range(scale.categories)]
+        categories = Category.objects.bulk_create(
+            Category(name=f"{kind[0]} {i // len(CATEGORY_KINDS) + 1}",
+                     name_en=f"{kind[1]} {i // len(CATEGORY_KINDS) + 1}", has_cc_range=kind[2])
+            for i, kind in enumerate(kinds))
+        base_tax = {c.id: kind[3] * rng.uniform(0.8, 1.2) for c, kind in zip(categories, kinds)}
+        # Half of the CC range categories charge income tax per range
+        per_range_income_tax = {c.id for i, c in enumerate(categories) if c.has_cc_range and i % 2 == 0}
+
+        RegRule.objects.bulk_create(
+            RegRule(regtype=reg_type, province=province, fiscal_year=fiscal_year,
+                    tax_exempted=index == 4, renewal_exempted=index == 4,
+                    income_tax_exempted=index in (2, 4) or rng.random() < 0.1)
+            for province in provinces for fiscal_year in fiscal_years
+            for index, reg_type in enumerate(reg_types))
+        counts.update(Province=len(provinces), FiscalYear=len(fiscal_years), RegType=len(reg_types),
+                      Category=len(categories), RegRule=len(provinces) * len(fiscal_years) * len(reg_types))
+
+        # CC ranges of each revision year: key -> [(id, band)]
+        revisions = fiscal_years[::max(1, scale.revise_every)]
+        revision_of = {}
+        for fiscal_year in fiscal_years:
+            if fiscal_year in revisions:
+                current = fiscal_year
+            revision_of[fiscal_year.id] = current
+        cc_categories = [c for c in categories if c.has_cc_range]
+        flat_categories = [c for c in categories if not c.has_cc_range]
+
+        next_range_id = _next_id(CCRange)
+        range_rows, ranges_in_effect = [], {}
+        for province in provinces:
+            for revision in revisions:
+                for reg_type in reg_types:
+                    for category in cc_categories:
+                        bands = []
+                        for band, (from_cc, to_cc) in enumerate(_range_bounds(rng, scale.ranges)):
+                            range_rows.append((next_range_id, category.id, from_cc, to_cc,
+                                               category.id in per_range_income_tax, reg_type.id,
+                                               province.id, revision.id))
+                            bands.append((next_range_id, band))
+                            next_range_id += 1
+                        ranges_in_effect[(province.id, revision.id, reg_type.id, category.id)] = bands
+        counts['CCRange'] = _insert_rows(
+            CCRange, ('id', 'category', 'from_cc', 'to_cc', 'for_income_tax', 'reg_type', 'province',
+                      'fiscal_year'), range_rows, batch_size)
+        del range_rows
+
+        revision_number = {fy.id: revisions.index(revision_of[fy.id]) for fy in fiscal_years}
+
+        def tax_rate_rows():
+            row_id = _next_id(TaxRate)
+            for province in provinces:
+                for fiscal_year in fiscal_years:
+                    revision = revision_of[fiscal_year.id]
+                    growth = 1 + 0.1 * revision_number[fiscal_year.id]
+                    for reg_type in reg_types:
+                        for category in cc_categories:
+                            for range_id, band in ranges_in_effect[(province.id, revision.id, reg_type.id,
+                                                                    category.id)]:
+                                private = _round_hundred(base_tax[category.id] * (1 + 0.6 * band) * growth)
+                                yield (row_id, reg_type.id, category.id, range_id, fiscal_year.id, private,
+                                       _round_hundred(private * 0.7), 300, 500, province.id)
+                                row_id += 1
+                        for category in flat_categories:
+                            private = _round_hundred(base_tax[category.id] * growth)
+                            yield (row_id, reg_type.id, category.id, None, fiscal_year.id, private,
+                                   _round_hundred(private * 0.7), 500, 800, province.id)
+                            row_id += 1
+
+        counts['TaxRate'] = _insert_rows(
+            TaxRate, ('id', 'reg_type', 'category', 'cc_range', 'fiscal_year', 'private_tax', 'public_tax',
+                      'private_renewal', 'public_renewal', 'province'), tax_rate_rows(), batch_size)
+
+        def income_tax_rate_rows():
+            row_id = _next_id(IncomeTaxRate)
+            for fiscal_year in fiscal_years:
+                revision = revision_of[fiscal_year.id]
+                growth = 1 + 0.1 * revision_number[fiscal_year.id]
+                for category in categories:
+                    income_tax = _round_hundred(base_tax[category.id] * 0.25 * growth)
+                    # Income tax is keyed by (category, fiscal_year, cc_range), so a flat rate
+                    # is stored once, under the first registration type
+                    if category.id not in per_range_income_tax:
+                        yield row_id, reg_types[0].id, category.id, None, fiscal_year.id, income_tax
+                        row_id += 1
+                        continue
+                    for reg_type in reg_types:
+                        for province in provinces:
+                            for range_id, band in ranges_in_effect[(province.id, revision.id, reg_type.id,
+                                                                    category.id)]:
+                                yield (row_id, reg_type.id, category.id, range_id, fiscal_year.id,
+                                       _round_hundred(income_tax * (1 + 0.5 * band)))
+                                row_id += 1
+
+        counts['IncomeTaxRate'] = _insert_rows(
+            IncomeTaxRate, ('id', 'reg_type', 'category', 'cc_range', 'fiscal_year', 'income_tax'),
+            income_tax_rate_rows(), batch_size)
+
+        # Explicit ids leave PostgreSQL-style sequences behind; no-op on SQLite
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), [CCRange, TaxRate, IncomeTaxRate])
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+    return counts
+
+
+def _names(known: Sequence[tuple], count: int) -> List[tuple]:
+    names = list(known[:count])
+    for i in range(len(names), count):
+        names.append((f"{known[i % len(known)][0]} {i // len(known) + 1}",
+                      f"{known[i % len(known)][1]} {i // len(known) + 1}"))
+    return names
+
+
+def _fiscal_year_name(year: int) -> str:
+    return f"{year % 1000:03d}/{(year + 1) % 100:02d}"
+
+
+def iter_vehicles(book, count: int, seed: int = 1) -> Iterator[Dict[str, str]]:
+    """
+    Vehicle rows in the bulk_quote CSV layout that the rate book can price
+
+    CC powers fall inside a configured range, categories without CC ranges
+    only pair with registration types that have rates, and payment dates
+    lie within the configured fiscal years.
+
+    Args:
+        book: RateBook of the target data
+        count: Number of rows
+        seed: Random seed
+
+    Yields:
+        Dict per vehicle keyed by VEHICLE_COLUMNS
+    """
+    rng = random.Random(seed)
+    ranges = sorted(book.cc_ranges.values(), key=lambda r: r.id)
+    flat = [(province_id, reg_type_id, category.id)
+            for category in sorted(book.categories.values(), key=lambda c: c.id) if not category.has_cc_range
+            for reg_type_id in sorted(book.reg_types) if book.has_tax_rates(reg_type_id, category.id)
+            for province_id in sorted(book.provinces)]
+    if not ranges and not flat:
+        return
+    cc_share = len({r.category_id for r in ranges}) / max(1, len(book.categories))
+
+    fiscal_years = book.fiscal_index.fiscal_years
+    first = max(fiscal_years[0].start_date.toordinal(),
+                bscalendar.to_ordinal(TAX_CALCULATION_CONSTANTS['MIN_NEPALI_YEAR'], 1, 1))
+    last = fiscal_years[-1].end_date.toordinal()
+
+    for number in range(count):
+        if ranges and (not flat or rng.random() < cc_share):
+            cc_range = rng.choice(ranges)
+            province_id, reg_type_id, category_id = cc_range.province_id, cc_range.reg_type_id, cc_range.category_id
+            low = float(cc_range.from_cc)
+            high = float(cc_range.to_cc) if cc_range.to_cc else low * 1.5 + 100
+            cc_power = f"{low + (high - low) * rng.uniform(0.05, 0.95):.2f}"
+        else:
+            province_id, reg_type_id, category_id = rng.choice(flat)
+            cc_power = ''
+        last_paid = rng.randint(first, last - 31)
+        next_payment = min(last, last_paid + rng.randint(30, 5 * 366))
+        yield {
+            'vehicle_id': f"V{number:07d}",
+            'province': str(province_id),
+            'reg_type': str(reg_type_id),
+            'category': str(category_id),
+            'cc_power': cc_power,
+            'last_paid_date': '%04d-%02d-%02d' % bscalendar.from_ordinal(last_paid),
+            'next_payment_date': '%04d-%02d-%02d' % bscalendar.from_ordinal(next_payment),
+            'is_public': 'true' if rng.random() < 0.1 else '',
+        }
+
+
+def write_vehicles_csv(stream, book, count: int, seed: int = 1) -> int:
+    """Write iter_vehicles rows as CSV with a header; returns the row count"""
+    writer = csv.DictWriter(stream, fieldnames=VEHICLE_COLUMNS, lineterminator='\n')
+    writer.writeheader()
+    written = 0
+    for row in iter_vehicles(book, count, seed):
+        writer.writerow(row)
+        written += 1
+    return written
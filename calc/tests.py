@@ -1,3 +1,605 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
 
-# Create your tests here.
+import nepali_datetime
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import bscalendar, bundle, metrics, quote_cache, ratebook, reference, timing
+from .arrears import ArrearsEngine, QuoteError, QuoteRequest
+from .helper import calculate_penalty, get_tax_calculation_context
+from .intervals import RANGE_AMBIGUOUS, RANGE_GAP, RANGE_HIT, IntervalIndex
+from .models import Category, CCRange, FiscalYear, IncomeTaxRate, Province, RegType, TaxRate
+from .penalties import default_schedule, from_paisa, to_paisa
+from .ratebook import CCRangeEntry, RateBook
+from .views import QuoteExportView
+
+# Keep the rate cube in memory and build it on the calling thread
+NO_CUBE = {'ENABLED': False}
+IN_MEMORY_CUBE = {'ENABLED': True, 'BACKGROUND_BUILD': False, 'PATH': None}
+
+
+def baseline_penalty(tax_amount: Decimal, income_tax: Decimal, days_late: int) -> Decimal:
+    """The original monthly rule: 10% per 30 days late (at least one month), capped at 100%, Rs.50 minimum"""
+    if days_late <= 0:
+        return Decimal('0')
+    months_late = max(1, days_late // 30)
+    penalty_rate = min(Decimal('0.10') * months_late, Decimal('1.00'))
+    penalty = max((tax_amount + income_tax) * penalty_rate, Decimal('50'))
+    return penalty.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class RateFixture:
+    """
+    Three fiscal years (079/80 - 081/82) with CC ranges defined in the first
+    one only. The income tax ranges overlap the tax ranges, as they do in
+    the bundled data.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.province = Province.objects.create(name='बागमती', name_en='Bagmati')
+        cls.private = RegType.objects.create(name='निजी', name_en='Private')
+        cls.car = Category.objects.create(name='कार', name_en='Car', has_cc_range=True)
+        cls.tractor = Category.objects.create(name='ट्र्याक्टर', name_en='Tractor')
+
+        # BS Shrawan 1 to Ashadh end; vehicle tax falls due on Poush 1 (AD dates)
+        cls.fy79 = FiscalYear.objects.create(
+            name='०७९/८०', name_en='079/80', start_date=date(2022, 7, 17), end_date=date(2023, 7, 16),
+            income_tax_due_date=date(2022, 12, 16), vehicle_tax_due_date=date(2022, 12, 16))
+        cls.fy80 = FiscalYear.objects.create(
+            name='०८०/८१', name_en='080/81', start_date=date(2023, 7, 17), end_date=date(2024, 7, 15),
+            income_tax_due_date=date(2023, 12, 17), vehicle_tax_due_date=date(2023, 12, 17),
+            previous=cls.fy79)
+        cls.fy81 = FiscalYear.objects.create(
+            name='०८१/८२', name_en='081/82', start_date=date(2024, 7, 16), end_date=date(2025, 7, 16),
+            income_tax_due_date=date(2024, 12, 16), vehicle_tax_due_date=date(2024, 12, 16),
+            previous=cls.fy80)
+        cls.fiscal_years = (cls.fy79, cls.fy80, cls.fy81)
+
+        def cc_range(from_cc, to_cc, for_income_tax=False):
+            return CCRange.objects.create(
+                category=cls.car, from_cc=from_cc, to_cc=to_cc, for_income_tax=for_income_tax,
+                reg_type=cls.private, province=cls.province, fiscal_year=cls.fy79)
+
+        cls.small = cc_range(0, 1000)
+        cls.medium = cc_range(1001, 1500)
+        cls.large = cc_range(1501, 2000)
+        cls.ranges = (cls.small, cls.medium, cls.large)
+        cls.income_low = cc_range(0, 1300, for_income_tax=True)
+        cls.income_high = cc_range(1300, 2500, for_income_tax=True)
+        cls.income_ranges = (cls.income_low, cls.income_high)
+
+        for year, fiscal_year in enumerate(cls.fiscal_years):
+            for size, bounds in enumerate(cls.ranges):
+                TaxRate.objects.create(
+                    reg_type=cls.private, category=cls.car, cc_range=bounds, fiscal_year=fiscal_year,
+                    province=cls.province, private_tax=5000 + 1000 * size + 500 * year,
+                    public_tax=4000 + 1000 * size, private_renewal=500, public_renewal=300)
+            IncomeTaxRate.objects.create(reg_type=cls.private, category=cls.car,
+                                         fiscal_year=fiscal_year, income_tax=1000)
+        # Range specific income tax in 080/81 only; the other years fall back to the flat rate
+        IncomeTaxRate.objects.create(reg_type=cls.private, category=cls.car, cc_range=cls.income_low,
+                                     fiscal_year=cls.fy80, income_tax=2500)
+        # A range specific row on a range not flagged for income tax is never used
+        IncomeTaxRate.objects.create(reg_type=cls.private, category=cls.car, cc_range=cls.large,
+                                     fiscal_year=cls.fy80, income_tax=9999)
+
+        # Tractor rates for 079/80 and 081/82; 080/81 is missing
+        for fiscal_year in (cls.fy79, cls.fy81):
+            TaxRate.objects.create(
+                reg_type=cls.private, category=cls.tractor, fiscal_year=fiscal_year, province=cls.province,
+                private_tax=1500, public_tax=1500, private_renewal=200, public_renewal=200)
+
+    def request(self, last_paid, next_payment, category=None, cc_power=Decimal('1200'), **kwargs):
+        category = category or self.car
+        return QuoteRequest(self.province.id, self.private.id, category.id,
+                            cc_power if category.has_cc_range else None, last_paid, next_payment, **kwargs)
+
+
+@override_settings(CALC_RATE_CUBE=NO_CUBE)
+class ArrearsEngineTests(RateFixture, TestCase):
+
+    def setUp(self):
+        self.engine = ArrearsEngine(RateBook.load())
+
+    def owed(self, last_paid, next_payment):
+        _key, _info, spans = self.engine.plan(self.request(last_paid, next_payment))
+        return [(span.fiscal_year.name_en, span.days) for span in spans]
+
+    def test_year_of_last_payment_is_not_owed(self):
+        # 2080-04-20 is 2023-08-05, 2081-04-20 is 2024-08-04
+        self.assertEqual(self.owed('2080-04-20', '2081-04-20'), [('081/82', 20)])
+
+    def test_every_year_after_the_last_payment_is_owed(self):
+        # 2079-05-10 is 2022-08-26
+        self.assertEqual(self.owed('2079-05-10', '2081-04-20'), [('080/81', 365), ('081/82', 20)])
+
+    def test_payment_within_the_paid_year_owes_nothing(self):
+        self.assertEqual(self.owed('2079-05-10', '2080-03-01'), [])
+
+    def test_quote_amounts(self):
+        result = self.engine.calculate(self.request('2079-05-10', '2081-04-20'))
+        by_year = {entry['fiscal_year']: entry for entry in result['fiscal_years']}
+
+        # 080/81: 231 days after its Poush 1 due date -> 7 months -> 70% of 6500 + 2500
+        self.assertEqual(by_year['०८०/८१']['tax_amount'], Decimal('6500.00'))
+        self.assertEqual(by_year['०८०/८१']['income_tax'], Decimal('2500.00'))
+        self.assertEqual(by_year['०८०/८१']['penalty'], Decimal('6300.00'))
+        self.assertEqual(by_year['०८०/८१']['penalty'], baseline_penalty(Decimal('6500'), Decimal('2500'), 231))
+        # 081/82 is not yet due and falls back to the flat income tax
+        self.assertEqual(by_year['०८१/८२']['tax_amount'], Decimal('7000.00'))
+        self.assertEqual(by_year['०८१/८२']['income_tax'], Decimal('1000.00'))
+        self.assertEqual(by_year['०८१/८२']['penalty'], Decimal('0.00'))
+        self.assertEqual(result['total_renewal_fee'], Decimal('1000.00'))
+        self.assertEqual(result['grand_total'], Decimal('24300.00'))
+
+    def test_tax_and_income_tax_ranges_resolve_separately(self):
+        # 1200 lies in tax range 1001-1500 and income tax range 0-1300, which starts lower
+        _key, _info, spans = self.engine.plan(self.request('2079-05-10', '2081-04-20'))
+        self.assertEqual([(span.cc_range.id, span.income_range.id) for span in spans],
+                         [(self.medium.id, self.income_low.id)] * 2)
+
+        result = self.engine.calculate(self.request('2079-05-10', '2081-04-20', cc_power=Decimal('1600')))
+        by_year = {entry['fiscal_year']: entry for entry in result['fiscal_years']}
+        self.assertEqual(by_year['०८०/८१']['tax_amount'], Decimal('7500.00'))
+        self.assertEqual(by_year['०८०/८१']['income_tax'], Decimal('1000.00'))
+        self.assertEqual(result['vehicle_info']['cc_range'], '1501.00 - 2000.00')
+
+    def test_power_outside_the_income_tax_ranges_pays_the_flat_rate(self):
+        CCRange.objects.filter(id=self.income_high.id).delete()
+        engine = ArrearsEngine(RateBook.load())
+        result = engine.calculate(self.request('2079-05-10', '2081-04-20', cc_power=Decimal('1600')))
+        self.assertEqual(result['total_income_tax'], Decimal('2000.00'))
+
+    def test_missing_tax_rate(self):
+        request = self.request('2079-05-10', '2081-04-20', category=self.tractor)
+        with self.assertRaisesMessage(QuoteError, "No tax rate configured for 080/81"):
+            self.engine.calculate(request)
+
+    def test_missing_tax_rate_in_a_batch_fails_only_that_quote(self):
+        good = self.engine.plan(self.request('2079-05-10', '2081-04-20'))
+        bad = self.engine.plan(self.request('2079-05-10', '2081-04-20', category=self.tractor))
+        priced, failed = self.engine.price_many({key: (info, False, spans) for key, info, spans in (good, bad)})
+        self.assertIn(good[0], priced)
+        self.assertEqual(str(failed[bad[0]]), "No tax rate configured for 080/81")
+
+    def test_power_outside_every_range(self):
+        with self.assertRaisesMessage(QuoteError, "No CC range covers 2500"):
+            self.engine.plan(self.request('2079-05-10', '2081-04-20', cc_power=Decimal('2500')))
+
+    @override_settings(CALC_RATE_CUBE=IN_MEMORY_CUBE)
+    def test_rate_cube_prices_like_the_book(self):
+        requests = [self.request('2079-05-10', '2081-04-20', cc_power=Decimal(power), is_public=is_public)
+                    for power in ('500', '1000', '1001', '1200', '1500', '1800')
+                    for is_public in (False, True)]
+        requests.append(self.request('2079-05-10', '2081-04-20', category=self.tractor))
+        groups = {key: (info, request.is_public, spans)
+                  for request in requests for key, info, spans in [self.engine.plan(request)]}
+
+        with override_settings(CALC_RATE_CUBE=NO_CUBE):
+            expected = self.engine.price_many(groups)
+        priced, failed = self.engine.price_many(groups)
+        self.assertEqual(priced, expected[0])
+        self.assertEqual({key: str(e) for key, e in failed.items()},
+                         {key: str(e) for key, e in expected[1].items()})
+
+
+class PenaltyScheduleTests(SimpleTestCase):
+
+    def setUp(self):
+        self.schedule = default_schedule()
+
+    def test_on_time_has_no_band(self):
+        self.assertIsNone(self.schedule.band(0))
+        self.assertIsNone(self.schedule.band(-10))
+
+    def test_first_month_is_ten_percent(self):
+        for days in (1, 29, 30, 45, 59):
+            self.assertEqual(self.schedule.band(days).rate_bp, 1000, days)
+        self.assertEqual(self.schedule.band(60).rate_bp, 2000)
+
+    def test_five_months_is_fifty_percent(self):
+        self.assertEqual(self.schedule.band(149).rate_bp, 4000)
+        for days in (150, 165, 179):
+            self.assertEqual(self.schedule.band(days).rate_bp, 5000, days)
+        self.assertEqual(self.schedule.band(180).rate_bp, 6000)
+
+    def test_rate_is_capped_at_the_full_amount(self):
+        self.assertEqual(self.schedule.band(300).rate_bp, 10000)
+        self.assertEqual(self.schedule.band(5000).rate_bp, 10000)
+
+    def test_penalty_amounts(self):
+        self.assertEqual(calculate_penalty(Decimal('800'), Decimal('200'), 45),
+                         (Decimal('100.00'), "Late payment penalty: 10.0% (1-59 days late)"))
+        self.assertEqual(calculate_penalty(Decimal('6500'), Decimal('2500'), 179)[0], Decimal('4500.00'))
+        self.assertEqual(calculate_penalty(Decimal('333.33'), Decimal('0'), 150)[0], Decimal('166.67'))
+
+    def test_minimum_penalty(self):
+        self.assertEqual(calculate_penalty(Decimal('200'), Decimal('0'), 45)[0], Decimal('50.00'))
+        self.assertEqual(calculate_penalty(Decimal('0.01'), Decimal('0'), 1)[0], Decimal('50.00'))
+        self.assertEqual(calculate_penalty(Decimal('500'), Decimal('0'), 45)[0], Decimal('50.00'))
+        self.assertEqual(calculate_penalty(Decimal('501'), Decimal('0'), 45)[0], Decimal('50.10'))
+
+    def test_nothing_taxable_has_no_penalty(self):
+        # Unlike the original rule, an exempted year is not charged the Rs.50 minimum
+        self.assertEqual(calculate_penalty(Decimal('0'), Decimal('0'), 45), (Decimal('0'), ''))
+        self.assertEqual(self.schedule.evaluate([45, 400], [0, 0]).tolist(), [0, 0])
+
+    def test_matches_the_original_rule(self):
+        amounts = [Decimal(amount) for amount in
+                   ('0.01', '0.05', '1', '49.99', '123.45', '499.99', '500', '500.05', '1234.56', '98765.43')]
+        for days in range(-5, 400):
+            for amount in amounts:
+                expected = baseline_penalty(amount, Decimal('0'), days)
+                self.assertEqual(calculate_penalty(amount, Decimal('0'), days)[0], expected, (days, amount))
+
+    def test_batch_evaluation_matches_single_bands(self):
+        days = list(range(-5, 400))
+        taxable = [to_paisa(Decimal('1234.56'))] * len(days)
+        expected = [self.schedule.band(d).penalty(t) if self.schedule.band(d) else 0
+                    for d, t in zip(days, taxable)]
+        self.assertEqual(self.schedule.evaluate(days, taxable).tolist(), expected)
+        self.assertEqual(from_paisa(expected[45 + 5]), Decimal('123.46'))
+
+
+def cc_range_entry(id, from_cc, to_cc):
+    return CCRangeEntry(id, 1, 1, 1, 1, Decimal(from_cc), Decimal(to_cc), False)
+
+
+class IntervalIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        # A gap between 150 and 200, "0-125" and "125-150" share a boundary,
+        # and "200-0" is open-ended
+        self.ranges = [cc_range_entry(1, 0, 125), cc_range_entry(2, 125, 150),
+                       cc_range_entry(3, 200, 400), cc_range_entry(4, 200, 0)]
+        self.index = IntervalIndex(self.ranges)
+
+    def resolved(self, value):
+        hit = self.index.resolve(value)
+        return hit.status, hit.cc_range.id if hit.cc_range else None, [r.id for r in hit.candidates]
+
+    def test_inside_a_single_range(self):
+        self.assertEqual(self.resolved(Decimal('60')), (RANGE_HIT, 1, [1]))
+        self.assertEqual(self.resolved(149.5), (RANGE_HIT, 2, [2]))
+        self.assertEqual(self.resolved(100000), (RANGE_HIT, 4, [4]))
+
+    def test_endpoints_are_inclusive(self):
+        self.assertEqual(self.resolved(0), (RANGE_HIT, 1, [1]))
+        self.assertEqual(self.resolved(150), (RANGE_HIT, 2, [2]))
+
+    def test_shared_boundary_goes_to_the_lower_range(self):
+        self.assertEqual(self.resolved(125), (RANGE_AMBIGUOUS, 1, [1, 2]))
+
+    def test_overlapping_ranges_go_to_the_lowest_from_cc_then_id(self):
+        self.assertEqual(self.resolved(300), (RANGE_AMBIGUOUS, 3, [3, 4]))
+        self.assertEqual(self.resolved(400), (RANGE_AMBIGUOUS, 3, [3, 4]))
+        self.assertEqual(self.resolved(400.5), (RANGE_HIT, 4, [4]))
+        nested = IntervalIndex([cc_range_entry(9, 100, 500), cc_range_entry(5, 100, 200),
+                                cc_range_entry(7, 50, 1000)])
+        self.assertEqual(nested.resolve(150).cc_range.id, 7)
+        self.assertEqual(nested.resolve(75).status, RANGE_HIT)
+        self.assertEqual([r.id for r in nested.resolve(150).candidates], [7, 5, 9])
+
+    def test_values_outside_every_range_are_gaps(self):
+        for value in (-1, 150.01, 175, 199.99, None):
+            self.assertEqual(self.resolved(value), (RANGE_GAP, None, []), value)
+        self.assertEqual(IntervalIndex([]).resolve(10).status, RANGE_GAP)
+
+    def test_inverted_ranges_are_ignored(self):
+        index = IntervalIndex([cc_range_entry(1, 500, 100), cc_range_entry(2, 0, 50)])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.resolve(300).status, RANGE_GAP)
+
+    def test_vectorized_lookup_matches_single_lookups(self):
+        values = [-1, 0, 60, 125, 125.5, 150, 150.01, 175, 200, 300, 400, 400.5, 100000, float('nan')]
+        ids, statuses = self.index.resolve_many(values)
+        for value, cc_range_id, status in zip(values, ids.tolist(), statuses.tolist()):
+            hit = self.index.resolve(None if value != value else value)
+            self.assertEqual((status, cc_range_id), (hit.status, hit.cc_range.id if hit.cc_range else -1), value)
+
+    def test_slot_table(self):
+        bounds, count, winner = self.index.slot_table()
+        self.assertEqual(bounds.tolist(), [0, 125, 150, 200, 400])
+        # gap, 0, gap, 125, gap, 150, gap, 200, gap, 400, gap
+        self.assertEqual(count.tolist(), [0, 1, 1, 2, 1, 1, 0, 2, 2, 2, 1])
+        self.assertEqual(winner.tolist(), [-1, 0, 0, 0, 1, 1, -1, 2, 2, 2, 3])
+
+
+class BaselineLookupTests(RateFixture, TestCase):
+    """The rate book against the queries the calculator used to run per lookup"""
+
+    def setUp(self):
+        self.book = RateBook.load()
+
+    def test_cc_range_lookup(self):
+        for power in ('1', '999.99', '1000', '1000.5', '1001', '1200', '1500', '1501', '2000', '2000.01'):
+            power = Decimal(power)
+            for for_income_tax in (False, True):
+                expected = CCRange.objects.filter(category=self.car, for_income_tax=for_income_tax,
+                                                  from_cc__lte=power, to_cc__gte=power).first()
+                found = self.book.find_cc_range(self.car, power, for_income_tax=for_income_tax)
+                self.assertEqual(found.id if found else None, expected.id if expected else None, power)
+
+    def test_tax_rate_lookup(self):
+        for fiscal_year in self.fiscal_years:
+            for cc_range in self.ranges + (None,):
+                for category in (self.car, self.tractor):
+                    expected = TaxRate.objects.filter(reg_type=self.private, category=category,
+                                                      cc_range=cc_range, fiscal_year=fiscal_year).first()
+                    found = self.book.tax_rate(self.private, category, cc_range, fiscal_year)
+                    self.assertEqual(found.id if found else None, expected.id if expected else None)
+
+    def test_income_tax_rate_lookup(self):
+        for fiscal_year in self.fiscal_years:
+            for cc_range in self.ranges + self.income_ranges + (None,):
+                query = IncomeTaxRate.objects.filter(category=self.car, fiscal_year=fiscal_year)
+                expected = None
+                if cc_range:
+                    expected = query.filter(cc_range=cc_range, cc_range__for_income_tax=True).first()
+                expected = expected or query.filter(cc_range__isnull=True).first()
+                found = self.book.income_tax_rate(self.car, cc_range, fiscal_year)
+                self.assertEqual(found.id, expected.id, (fiscal_year, cc_range))
+        self.assertEqual(self.book.income_tax_rate(self.car, self.income_low, self.fy80).income_tax, Decimal('2500'))
+        self.assertEqual(self.book.income_tax_rate(self.car, self.large, self.fy80).income_tax, Decimal('1000'))
+
+    def test_tax_calculation_context(self):
+        self.addCleanup(setattr, ratebook, '_current', None)
+        self.addCleanup(setattr, reference, '_current', None)
+        ratebook.rebuild()
+        reference.reload()
+        context = get_tax_calculation_context()
+        # Registry entries, with the attributes of the model instances
+        self.assertEqual(context['fiscal_years'], reference.get_reference().ordered('fiscal_years', 'start_date',
+                                                                                     reverse=True))
+        self.assertEqual([entry.id for entry in context['fiscal_years']], [self.fy81.id, self.fy80.id, self.fy79.id])
+        self.assertEqual([entry.name_en for entry in context['categories']], ['Car', 'Tractor'])
+        self.assertEqual([entry.id for entry in context['reg_types']], [self.private.id])
+
+        expected = {
+            str(category.id): [{'id': r.id, 'from_cc': float(r.from_cc), 'to_cc': float(r.to_cc),
+                                'for_income_tax': r.for_income_tax, 'display': f"{r.from_cc} - {r.to_cc}"}
+                               for r in CCRange.objects.filter(category=category).order_by('from_cc', 'id')]
+            for category in Category.objects.filter(has_cc_range=True)
+        }
+        self.assertEqual(context['cc_ranges_data'], expected)
+
+        # Later calls reuse the tables built for this data version
+        with self.assertNumQueries(0):
+            again = get_tax_calculation_context()
+        self.assertIs(again['cc_ranges_data'], context['cc_ranges_data'])
+        self.assertIs(again['categories'], context['categories'])
+        self.assertIs(again['categories'], reference.get_reference().ordered('categories', 'name'))
+
+
+class BSCalendarTests(SimpleTestCase):
+
+    def test_ordinal_table_matches_nepali_datetime(self):
+        for year in range(bscalendar.MIN_YEAR, bscalendar.MAX_YEAR + 1, 7):
+            for month in range(1, 13):
+                for day in (1, 15, bscalendar.days_in_month(year, month)):
+                    expected = nepali_datetime.date(year, month, day).to_datetime_date().toordinal()
+                    self.assertEqual(bscalendar.to_ordinal(year, month, day), expected, (year, month, day))
+                    self.assertEqual(bscalendar.from_ordinal(expected), (year, month, day))
+
+    def test_invalid_dates(self):
+        self.assertIsNone(bscalendar.to_ordinal(2080, 13, 1))
+        self.assertIsNone(bscalendar.to_ordinal(2080, 1, 0))
+        self.assertIsNone(bscalendar.to_ordinal(2080, 1, bscalendar.days_in_month(2080, 1) + 1))
+        self.assertIsNone(bscalendar.to_ordinal(bscalendar.MAX_YEAR + 1, 1, 1))
+
+    def test_devanagari_digits(self):
+        expected = nepali_datetime.date(2080, 1, 1).to_datetime_date().toordinal()
+        self.assertEqual(bscalendar.split_date_string('२०८०-०१-०१'), (2080, 1, 1))
+        self.assertEqual(bscalendar.parse_ordinal('२०८०-०१-०१'), expected)
+        self.assertEqual(bscalendar.parse_ordinals(['२०८०-०१-०१', '2080-०१-01']).tolist(), [expected, expected])
+
+    def test_vectorized_parse_matches_scalar_parse(self):
+        strings = ['2080-01-01', '2080-12-30', '2080-12-31', '2080-13-01', '2080-1-01', '2080/01/01',
+                   '2080-01-011', '', '1999-12-30', '२०८१-०४-२०', '२०८१-०४-३३', '२०८१-०४-२०१',
+                   '२०८१–०४–२०', '²⁰⁸⁰-01-01', 'abcd-ef-gh', '2080-0a-01']
+        expected = [bscalendar.parse_ordinal(s) for s in strings]
+        parsed = bscalendar.parse_ordinals(strings)
+        self.assertEqual(parsed.tolist(), [-1 if e is None else e for e in expected])
+        self.assertEqual(parsed.dtype, np.int32)
+        self.assertEqual(bscalendar.parse_ordinals(np.array([], dtype=str)).shape, (0,))
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.counter = metrics.Counter(self.registry, 'test_events_total', "Events", ('kind',))
+        self.histogram = metrics.Histogram(self.registry, 'test_seconds', "Durations", buckets=(0.1, 1.0))
+
+    def test_shards_of_exited_threads_are_merged_and_dropped(self):
+        def work():
+            self.counter.labels('a').inc(2)
+            self.histogram.observe(0.5)
+
+        threads = [threading.Thread(target=work) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.counter.labels('a').inc()
+
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot[('test_events_total', ('a',))], 41)
+        self.assertEqual(snapshot[('test_seconds', ())], [0, 20, 0, 10.0, 20])
+        # Only this thread's shard is left; a second scrape gives the same totals
+        self.assertEqual(len(self.registry._shards), 1)
+        self.assertEqual(self.registry.snapshot(), snapshot)
+
+    def test_label_sets_are_bounded(self):
+        for value in range(metrics.MAX_SERIES + 5):
+            self.counter.labels(value).inc()
+        self.assertEqual(self.registry.snapshot()[('test_events_total', (metrics.OVERFLOW_LABEL,))], 5)
+
+    def test_metric_kinds_must_make_children(self):
+        class Gauge(metrics._ShardedMetric):
+            kind = 'gauge'
+
+        with self.assertRaises(TypeError):
+            Gauge(self.registry, 'test_gauge', "Gauge")
+
+    def test_one_execute_wrapper_for_timing_and_metrics(self):
+        connection.ensure_connection()
+        timing.install_query_timer()
+        timing.install_query_timer(metrics._count_query)
+        timing.install_query_timer(metrics._count_query)
+        self.assertEqual(connection.execute_wrappers.count(timing._record_query), 1)
+        self.assertEqual(timing._query_observers.count(metrics._count_query), 1)
+
+        before = metrics.REGISTRY.snapshot().get(('calc_db_queries_total', (connection.alias,)), 0)
+        Province.objects.count()
+        after = metrics.REGISTRY.snapshot()[('calc_db_queries_total', (connection.alias,))]
+        self.assertEqual(after - before, 1)
+
+    def test_metrics_view_allowlist_and_token(self):
+        url = reverse('calc:metrics')
+        self.assertEqual(url, '/metrics/')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        proxied = {'REMOTE_ADDR': '10.0.0.2', 'HTTP_X_FORWARDED_FOR': '203.0.113.9, 127.0.0.1'}
+        with override_settings(CALC_METRICS={'TRUSTED_PROXIES': ['10.0.0.2'], 'TOKEN': 'scrape-token'}):
+            # Only the hop appended by the trusted proxy counts, not one the client sent
+            self.assertEqual(self.client.get(url, **proxied).status_code, 200)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2',
+                                             HTTP_X_FORWARDED_FOR='127.0.0.1, 203.0.113.9').status_code, 403)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9').status_code, 403)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9',
+                                             headers={'Authorization': 'Bearer scrape-token'}).status_code, 200)
+        # Without trusted proxies the forwarded header is ignored
+        self.assertEqual(self.client.get(url, **proxied).status_code, 403)
+
+
+class BundlePublishingTests(RateFixture, TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = bundle.BundleStore(directory.name)
+        self.addCleanup(bundle._bundles.clear)
+        self.addCleanup(setattr, ratebook, '_current', None)
+
+    def stored_versions(self):
+        return sorted(path.name.split('.')[0] for path in self.store.path(self.province.id, 'x').parent.iterdir())
+
+    def test_publishing_prunes_old_versions(self):
+        versions = []
+        with override_settings(CALC_RATE_BUNDLE={'DIR': self.store.directory, 'KEEP': 2}):
+            for income_tax in (1000, 1100, 1200, 1300):
+                IncomeTaxRate.objects.filter(cc_range__isnull=True).update(income_tax=income_tax)
+                ratebook.rebuild()
+                versions.append(bundle.get_bundle(self.province.id).version)
+            self.assertEqual(len(set(versions)), 4)
+            self.assertEqual(self.stored_versions(), sorted(versions[-2:]))
+
+            # Returning to an earlier version publishes it again as the newest
+            IncomeTaxRate.objects.filter(cc_range__isnull=True).update(income_tax=1000)
+            ratebook.rebuild()
+            self.assertEqual(bundle.get_bundle(self.province.id).version, versions[0])
+            self.assertEqual(self.stored_versions(), sorted([versions[0], versions[-1]]))
+
+    def test_saving_a_stored_version_keeps_it(self):
+        first = bundle.EncodedBundle(bundle.build_bundle(self.province.id))
+        self.store.save(first)
+        TaxRate.objects.filter(category=self.tractor).update(private_tax=1600)
+        second = bundle.EncodedBundle(bundle.build_bundle(self.province.id))
+        self.store.save(second)
+        self.store.save(first)
+        self.store.prune(self.province.id, 1)
+        self.assertEqual(self.stored_versions(), [first.version])
+        self.assertEqual(self.store.load(self.province.id, first.version), first.document)
+
+
+@override_settings(CALC_RATE_CUBE=NO_CUBE, CALC_EXPORT={'TOKENS': ['export-token'], 'MAX_ROWS': 10,
+                                                         'MAX_BODY_SIZE': 300})
+class QuoteExportViewTests(RateFixture, TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, ratebook, '_current', None)
+        self.url = reverse('calc:quote_export', args=['ndjson'])
+        self.csv = ('province,reg_type,category,cc_power,last_paid_date,next_payment_date\n'
+                    f'{self.province.id},{self.private.id},{self.car.id},1200,2079-09-01,2081-09-15\n')
+
+    def post(self, body, token='export-token', **extra):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return self.client.post(self.url, body, content_type='text/csv', headers=headers, **extra)
+
+    def test_requires_a_bearer_token(self):
+        for token in (None, 'wrong-token'):
+            response = self.post(self.csv, token=token)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+    def test_quotes_a_csv_body(self):
+        response = self.post(self.csv)
+        self.assertEqual(response.status_code, 200)
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([record['row'] for record in records], [1])
+        self.assertNotIn('error', records[0])
+
+    def test_body_size_is_counted_as_it_is_read(self):
+        self.assertEqual(self.post(self.csv * 3).status_code, 413)
+
+        # A Content-Length that understates the body does not get it past the limit
+        for content_type, body in (('text/csv', self.csv * 3), ('application/json', json.dumps([{}] * 100))):
+            request = AsyncRequestFactory().post(self.url, body, content_type=content_type,
+                                                 headers={'Authorization': 'Bearer export-token'})
+            request.META['CONTENT_LENGTH'] = '10'
+            response = QuoteExportView.as_view()(request, format_type='ndjson')
+            self.assertEqual(response.status_code, 413)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'calc_test_cache'}},
+    CALC_RATE_BOOK={'CHECK_INTERVAL': 0, 'BACKGROUND_REBUILD': False},
+    CALC_RATE_CUBE=NO_CUBE)
+class AsyncCacheAccessTests(RateFixture, TransactionTestCase):
+    """A DatabaseCache raises SynchronousOnlyOperation when touched from the event loop"""
+
+    def setUp(self):
+        call_command('createcachetable', verbosity=0)
+        self.setUpTestData()
+        ratebook._current = reference._current = quote_cache._quote_cache = None
+        self.addCleanup(setattr, ratebook, '_current', None)
+        self.addCleanup(setattr, reference, '_current', None)
+        self.addCleanup(setattr, quote_cache, '_quote_cache', None)
+
+    async def test_generation_checks_run_off_the_event_loop(self):
+        book = await ratebook.aget_rate_book()
+        snapshot = await reference.aget_reference()
+        await cache.aset(ratebook.GENERATION_CACHE_KEY, book.generation + 1, timeout=None)
+        await cache.aset(reference.GENERATION_CACHE_KEY, snapshot.generation + 1, timeout=None)
+
+        with self.assertNoLogs('calc', level='WARNING'):
+            await ratebook.aget_rate_book()
+            # The book in hand is served while the rebuild it scheduled swaps in a new one
+            self.assertEqual(ratebook._current.generation, book.generation + 1)
+            self.assertEqual((await reference.aget_reference()).generation, snapshot.generation + 1)
+
+    async def test_tax_quotes_runs_off_the_event_loop(self):
+        from .schema import schema
+
+        query = """query($inputs: [QuoteInput!]!) {
+            taxQuotes(inputs: $inputs) { ok error grandTotal }
+        }"""
+        inputs = [{'province': self.province.id, 'regType': self.private.id, 'category': self.car.id,
+                   'ccPower': '1200', 'lastPaidDate': '2079-09-01', 'nextPaymentDate': '2081-09-15'}]
+        with self.assertNoLogs('calc', level='WARNING'):
+            first = await schema.execute_async(query, variable_values={'inputs': inputs})
+            quote_cache._quote_cache = None
+            second = await schema.execute_async(query, variable_values={'inputs': inputs})
+        self.assertIsNone(first.errors)
+        self.assertTrue(first.data['taxQuotes'][0]['ok'], first.data)
+        # The second call, with an empty L1, is served from the database cache
+        self.assertEqual(second.data, first.data)
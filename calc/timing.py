@@ -0,0 +1,211 @@
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# Timings of the request being served, or None when it is not sampled
+_current: ContextVar[Optional['RequestTimings']] = ContextVar('calc_request_timings', default=None)
+
+# Called with (connection alias, seconds) after every query, e.g. by calc.metrics
+_query_observers: List[Callable[[str, float], None]] = []
+
+
+def _config(key: str, default):
+    return getattr(settings, 'CALC_SERVER_TIMING', {}).get(key, default)
+
+
+class RequestTimings:
+    """Stage durations and database usage of one request"""
+
+    __slots__ = ('started', 'stages', 'db_queries', 'db_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.stages.get(name)
+        if entry is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def header(self, total: float) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        parts = [f'total;dur={total * 1000:.2f}',
+                 f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_queries} queries"']
+        parts.extend(f'{name};dur={seconds * 1000:.2f}' for name, (seconds, _count) in self.stages.items())
+        return ', '.join(parts)
+
+    def as_dict(self, total: float) -> Dict[str, object]:
+        return {
+            'total_ms': round(total * 1000, 3),
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db_seconds * 1000, 3),
+            'stages': {name: {'ms': round(seconds * 1000, 3), 'count': int(count)}
+                       for name, (seconds, count) in self.stages.items()},
+        }
+
+
+def current() -> Optional[RequestTimings]:
+    """Timings of the request being served, None outside a sampled request"""
+    return _current.get()
+
+
+class stage:
+    """
+    Context manager adding the time spent in its block to a named stage
+
+    Costs one context variable read when the request is not sampled.
+    """
+
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def timed(name: str):
+    """Decorator recording every call of a function as a stage"""
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None and not _query_observers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        if timings is not None:
+            timings.db_seconds += seconds
+            timings.db_queries += 1
+        for observer in _query_observers:
+            observer(context['connection'].alias, seconds)
+
+
+def _install_on(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install_query_timer(observer: Optional[Callable[[str, float], None]] = None) -> None:
+    """
+    Count and time queries on every database connection
+
+    Connections are per thread and opened lazily, so the wrapper is added
+    as each one is created. Under ASGI the ORM runs in worker threads,
+    which see the request's timings through the copied context. Every
+    connection gets this one wrapper, however many users time queries:
+    others pass an observer, called with the alias and duration of each
+    query.
+    """
+    if observer is not None and observer not in _query_observers:
+        _query_observers.append(observer)
+    connection_created.connect(_install_on, dispatch_uid='calc.timing.query_timer')
+    for connection in connections.all(initialized_only=True):
+        _install_on(connection)
+
+
+class ServerTimingMiddleware:
+    """
+    Report where a request spent its time in a Server-Timing header
+
+    A sampled request (CALC_SERVER_TIMING['SAMPLE_RATE']) gets a total, the
+    number and duration of its SQL queries, and every stage recorded with
+    ``stage``/``timed`` along the way: form validation, the calculator's
+    fiscal-year, range, rate and penalty steps, GraphQL parsing and
+    execution, rendering. With LOG enabled the same numbers are logged as
+    one JSON line. Unsampled requests pay for one random number.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = _config('ENABLED', True)
+        self.sample_rate = _config('SAMPLE_RATE', 1.0)
+        self.log = _config('LOG', False)
+        self.allow_origin = _config('ALLOW_ORIGIN', '')
+        if self.enabled:
+            install_query_timer()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def sampled(self) -> bool:
+        return self.enabled and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings: RequestTimings):
+        total = time.perf_counter() - timings.started
+        response['Server-Timing'] = timings.header(total)
+        if self.allow_origin:
+            response['Timing-Allow-Origin'] = self.allow_origin
+        if self.log:
+            logger.info(json.dumps(dict(timings.as_dict(total), method=request.method,
+                                        path=request.path, status=response.status_code)))
+        return response
@@ -4,5 +4,11 @@ from . import views
 app_name = 'calc'
 
 urlpatterns = [
-    path('', views.TaxCalculationView.as_view(), name='tax_calculator')
-]
\ No newline at end of file
+    path('', views.TaxCalculationView.as_view(), name='tax_calculator'),
+    path('context/', views.CalculatorContextView.as_view(), name='calculator_context'),
+    path('bundle/<int:province_id>/', views.RateBundleView.as_view(), name='rate_bundle'),
+    path('export/<str:format_type>/', views.QuoteExportView.as_view(), name='quote_export'),
+    path('quote-cache/stats/', views.QuoteCacheStatsView.as_view(), name='quote_cache_stats'),
+    path('graphql-cache/stats/', views.GraphQLCacheStatsView.as_view(), name='graphql_cache_stats'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+]
@@ -1,12 +1,248 @@
+import codecs
+import csv
+import hmac
+import json
+import tempfile
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+                         HttpResponseNotModified, JsonResponse)
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
+from calc.bundle import get_bundle, get_delta
+from calc.context_payload import get_context_payload
+from calc.documents import get_document_cache, get_registry
+from calc.exporters import FORMATS, streaming_export_response
 from calc.forms import TaxCalculatorForm
+from calc.metrics import REGISTRY
+from calc.quote_cache import get_quote_cache
+from calc.quoting import MAX_BATCH_SIZE, iter_quotes
+from calc.reference import get_reference
+from calc.timing import stage
 
 
 class TaxCalculationView(View):
-    def get(self, request):
+    async def get(self, request):
         form = TaxCalculatorForm()
-        return render(request, 'calc/tax_calculator.html', {
-            'form': form,
-        })
+        await form.aload_choices()
+        with stage('render'):
+            return render(request, 'calc/tax_calculator.html', {
+                'form': form,
+            })
+
+
+def _export_config(key: str, default):
+    return getattr(settings, 'CALC_EXPORT', {}).get(key, default)
+
+
+# Bodies are copied in chunks of this size; up to SPOOL_SIZE bytes stay in memory
+READ_CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+
+
+def _has_bearer_token(request, tokens) -> bool:
+    """Whether the Authorization header carries one of tokens"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and any(hmac.compare_digest(token.encode(), expected.encode())
+                                              for expected in tokens)
+
+
+def _unauthorized():
+    response = HttpResponse("Authentication required", status=401)
+    response['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+def _read_body(request, max_size: int):
+    """
+    Copy the request body into a spooled temporary file, counting the bytes
+    actually read rather than trusting Content-Length
+
+    Returns:
+        The file rewound to the start, or None when the body is over max_size
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    size = 0
+    while chunk := request.read(READ_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            body.close()
+            return None
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+
+def _csv_rows(body):
+    with body:
+        yield from csv.DictReader(codecs.iterdecode(body, 'utf-8'))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class QuoteExportView(View):
+    """
+    Quote many vehicles and stream the results back as txt, csv, json or ndjson.
+
+    Clients authenticate with one of the CALC_EXPORT['TOKENS'] bearer tokens.
+    Accepts either a CSV body (text/csv, same columns as bulk_quote) or a
+    JSON array of quote inputs. Bodies over CALC_EXPORT['MAX_BODY_SIZE']
+    bytes, whatever their Content-Length says, and JSON arrays over MAX_ROWS
+    items are refused with 413; a CSV body stops being quoted at MAX_ROWS
+    with an error record. Under ASGI the output is streamed through an async
+    iterator so it is never buffered whole.
+    """
+
+    def post(self, request, format_type):
+        if not _has_bearer_token(request, _export_config('TOKENS', ())):
+            return _unauthorized()
+        if format_type not in FORMATS:
+            return HttpResponseBadRequest(f"Unsupported format. Use one of: {', '.join(FORMATS)}")
+
+        max_rows = _export_config('MAX_ROWS', MAX_BATCH_SIZE)
+        max_body = _export_config('MAX_BODY_SIZE', 10 * 1024 * 1024)
+        too_large = HttpResponse(f"Body is limited to {max_body} bytes", status=413)
+        try:
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid Content-Length")
+        if length > max_body:
+            return too_large
+        body = _read_body(request, max_body)
+        if body is None:
+            return too_large
+
+        if request.content_type == 'text/csv':
+            rows = _csv_rows(body)
+        else:
+            with body:
+                try:
+                    rows = json.load(body)
+                except ValueError:
+                    return HttpResponseBadRequest("Body must be a JSON array or CSV")
+            if not isinstance(rows, list):
+                return HttpResponseBadRequest("Body must be a JSON array or CSV")
+            if len(rows) > max_rows:
+                return HttpResponse(f"At most {max_rows} rows per request", status=413)
+
+        return streaming_export_response(iter_quotes(rows, max_rows=max_rows), format_type,
+                                         filename='tax-quotes',
+                                         asynchronous=isinstance(request, ASGIRequest))
+
+
+class CalculatorContextView(View):
+    """
+    Reference tables and CC ranges per category as prebuilt JSON
+
+    The same bytes are served until the rate data changes: gzip-encoded when
+    the client accepts it, and as 304 Not Modified when its cached ETag is
+    still current.
+    """
+
+    def get(self, request):
+        payload = get_context_payload()
+        return _encoded_response(request, payload, payload.etag)
+
+
+class RateBundleView(View):
+    """
+    Everything needed to quote in one province, for clients that price
+    vehicles themselves (see calc.bundle)
+
+    ?since=<version> asks for the changes since a version the client holds:
+    304 when it is current, a delta document when that version was
+    published, the full bundle otherwise.
+    """
+
+    def get(self, request, province_id):
+        if get_reference().get('provinces', province_id) is None:
+            raise Http404("Unknown province")
+        bundle = get_bundle(province_id)
+        etag = f'"{bundle.version}"'
+        since = request.GET.get('since', '')
+        if since == bundle.version:
+            return _not_modified(etag)
+        delta = get_delta(province_id, since, bundle) if since else None
+        return _encoded_response(request, delta or bundle, etag)
+
+
+def _not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+def _encoded_response(request, payload, etag):
+    """
+    Serve prebuilt JSON bytes: 304 for a current If-None-Match, gzip when
+    the client accepts it
+    """
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = _not_modified(etag)
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(payload.gzipped, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(payload.body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+class QuoteCacheStatsView(View):
+    """Hit ratio and eviction counters of this worker's quote cache"""
+
+    def get(self, request):
+        quote_cache = get_quote_cache()
+        if quote_cache is None:
+            return JsonResponse({'enabled': False})
+        return JsonResponse(dict(quote_cache.stats(), enabled=True))
+
+
+class GraphQLCacheStatsView(View):
+    """Document cache counters and persisted query count for this worker"""
+
+    def get(self, request):
+        return JsonResponse(dict(get_document_cache().stats(), persisted_queries=len(get_registry())))
+
+
+def _metrics_config(key: str, default):
+    return getattr(settings, 'CALC_METRICS', {}).get(key, default)
+
+
+def _client_address(request) -> str:
+    """
+    The client's address, read from X-Forwarded-For when the request came
+    through one of CALC_METRICS['TRUSTED_PROXIES']
+
+    Walks the header from the right, past the trusted proxies, so an address
+    the client put there itself is never used.
+    """
+    trusted = _metrics_config('TRUSTED_PROXIES', ())
+    address = request.META.get('REMOTE_ADDR', '')
+    forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    while address in trusted and forwarded:
+        address = forwarded.pop()
+    return address
+
+
+class MetricsView(View):
+    """
+    Prometheus text exposition of all workers' metrics
+
+    Scrapers send CALC_METRICS['TOKEN'] as a bearer token, or connect from
+    one of ALLOWED_IPS (behind a reverse proxy, see _client_address).
+    """
+
+    def get(self, request):
+        token = _metrics_config('TOKEN', None)
+        allowed = _metrics_config('ALLOWED_IPS', ('127.0.0.1', '::1'))
+        if not ((token and _has_bearer_token(request, (token,))) or _client_address(request) in allowed):
+            return HttpResponseForbidden()
+        return HttpResponse(REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
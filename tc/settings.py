@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'calc.metrics.MetricsMiddleware',
+    'calc.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -126,4 +128,78 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 GRAPHENE = {
     "SCHEMA": "calc.schema.schema"  # path to schema object
-}
\ No newline at end of file
+}
+
+# The rate book, reference registry and quote cache share change counters and
+# quotes between workers through the default cache. LocMemCache is per process:
+# fine for runserver and a single worker, but with several workers point this at
+# a shared backend (Redis, Memcached, the database cache), or rate changes saved
+# in one worker are never seen by the others (check --deploy warns, calc.W001).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# In-process rate book (see calc/ratebook.py)
+CALC_RATE_BOOK = {
+    "BACKGROUND_REBUILD": True,  # rebuild off the request path after rate changes
+    "CHECK_INTERVAL": 5,  # seconds between checks for changes made by other workers
+}
+
+CALC_QUOTE_CACHE = {
+    "ENABLED": True,
+    "L1_MAX_ENTRIES": 10000,  # per-process LRU size
+    "TIMEOUT": 3600,  # seconds quotes stay in the shared (L2) cache
+    "CACHE_ALIAS": "default",
+}
+
+CALC_GRAPHQL = {
+    "PERSISTED_QUERIES_FILE": BASE_DIR / 'calc' / 'persisted_queries.json',
+    "PERSISTED_ONLY": False,  # reject query text that is not in the registry
+    "CACHE_MAX_AGE": 300,  # seconds persisted GET responses may be cached
+    "DOCUMENT_CACHE_SIZE": 512,  # parsed and validated documents kept per process
+    # Query cost limits; see calc.query_cost.DEFAULTS for weights and list sizes
+    "COST": {
+        "MAX_COST": 5000,
+        "MAX_DEPTH": 6,
+    },
+}
+
+# Server-Timing headers with per-request DB, form, calculator and render timings (see calc/timing.py)
+CALC_SERVER_TIMING = {
+    "ENABLED": True,
+    "SAMPLE_RATE": 1.0,  # fraction of requests measured, e.g. 0.01 in production
+    "LOG": False,  # also log each measured request as one JSON line on the calc.timing logger
+    "ALLOW_ORIGIN": "",  # Timing-Allow-Origin value so cross-origin pages can read the timings
+}
+
+# Prometheus metrics served at /metrics/ (see calc/metrics.py)
+CALC_METRICS = {
+    "ENABLED": True,
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],  # clients allowed to scrape /metrics/
+    "TRUSTED_PROXIES": [],  # reverse proxies whose X-Forwarded-For gives the client address
+    "TOKEN": None,  # bearer token that lets a scraper in from any address
+    "MULTIPROCESS_DIR": None,  # shared directory for per-worker snapshots; empty it on restart
+    "FLUSH_INTERVAL": 5,  # seconds between a worker's snapshot writes
+}
+
+# Bulk quote exports at /export/<format>/ (see calc.views.QuoteExportView)
+CALC_EXPORT = {
+    "TOKENS": [],  # bearer tokens accepted from export clients; empty refuses every request
+    "MAX_ROWS": 10000,  # vehicles quoted per request
+    "MAX_BODY_SIZE": 10 * 1024 * 1024,  # bytes of CSV or JSON input
+}
+
+# Offline rate bundles served at /bundle/<province>/ (see calc/bundle.py)
+CALC_RATE_BUNDLE = {
+    "DIR": BASE_DIR / 'bundles',  # published versions, needed to send deltas; None disables publishing
+    "KEEP": 20,  # versions per province kept when a new one is published
+}
+
+# Memory-mapped array form of the rate tables (calc.ratecube)
+CALC_RATE_CUBE = {
+    "ENABLED": True,  # price quote batches with array lookups on the cube
+    "BACKGROUND_BUILD": True,  # build a missing or stale cube off the request path
+    "PATH": BASE_DIR / 'ratecube.bin',  # written by publish_rate_cube, mapped read-only by workers; None keeps it in memory
+}
@@ -17,10 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+
+from calc.graphql_view import AsyncGraphQLView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('calc.urls')),
-    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path("graphql/", csrf_exempt(AsyncGraphQLView.as_view(graphiql=True))),
 ]